@@ -1,59 +1,133 @@
 
-from auth import authenticate_user, create_access_token, get_current_user
-from database import get_db
-from sqlalchemy.orm import Session
+from auth import authenticate_user, create_access_token, get_current_user, shutdown_auth_executors, auth_cache_stats, listen_for_auth_invalidations
+from database import get_async_db
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.security import  OAuth2PasswordRequestForm
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 import logging      
 from Schemas import Token, UserOut        
 from datetime import timedelta
-from dotenv import load_dotenv
-import os
-from database import  engine, get_db
+from settings import settings
+from database import async_engine
 from models import Base, User
-from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect, Query
-from ConnectionManager import ConnectionManager
+from fastapi import APIRouter, Depends, HTTPException, Request, WebSocket, WebSocketDisconnect, Query
+from ConnectionManager import create_connection_manager
+from GenerationScheduler import GenerationScheduler, QueueFullError, OLLAMA_MAX_CONCURRENCY
+from ollama_backends import backend_pool
+from response_cache import response_cache
+from history_archive import history_archive, HISTORY_ARCHIVE_ENABLED
+from static_assets import static_assets
+from rate_limit import message_limiter, limit_requests, limit_logins, rate_limit_stats
+from logging_setup import bind_log_context
+from metrics import render_metrics, WEBSOCKET_CONNECTIONS, GENERATION_TASKS, GENERATIONS_RUNNING, GENERATION_QUEUE_DEPTH, GENERATIONS_REJECTED
 from uuid import uuid4
 import json
-from Redis import ensure_system_message, get_all_sessions, append_history, get_history
-from ollama_chat import generate_with_ollama
+from Redis import ensure_system_message, get_sessions_page, append_history, get_history_page, iter_history, ensure_session_index, ensure_history_encoding, run_history_archiver, recover_partial_response, close_redis, redis_client, SESSIONS_PAGE_SIZE, HISTORY_PAGE_SIZE
+from ollama_chat import generate_with_ollama, start_http_client, close_http_client, pool_stats
 import asyncio
-from fastapi.staticfiles import StaticFiles
+import math
+import time
+from contextlib import asynccontextmanager
 
 
 
 # Logging setup 
 logger = logging.getLogger(__name__)
 
-# # Load environment variables
-load_dotenv()
 
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
+ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire_minutes
 
-router = APIRouter()
+manager = create_connection_manager()
 
-router.mount("/static", StaticFiles(directory="static"), name="static")
+# OLLAMA_MAX_CONCURRENCY is per backend
+scheduler = GenerationScheduler(max_concurrency=OLLAMA_MAX_CONCURRENCY * max(1, len(backend_pool.backends)))
 
-manager = ConnectionManager()
+# Startup work that runs in the background, cancelled on shutdown
+_background_tasks: set = set()
 
+# How long startup took; None until it has finished (and again after shutdown)
+_startup = {"seconds": None}
 
-@router.on_event("startup")
-def startup_event():
+# Read when /metrics is scraped, so the hot path pays nothing for them
+WEBSOCKET_CONNECTIONS.set_function(lambda: len(manager.active_connections))
+GENERATION_TASKS.set_function(lambda: len(manager.generation_tasks))
+GENERATIONS_RUNNING.set_function(lambda: scheduler.running)
+GENERATION_QUEUE_DEPTH.set_function(lambda: scheduler.queued)
+
+
+async def _seed_demo_users():
+    """Create the demo users (seed_users.py) if the user table is empty and SEED_DEMO_USERS is set."""
+    if not settings.seed_demo_users:
+        return
+    async with async_engine.connect() as conn:
+        if (await conn.execute(select(User.username).limit(1))).first() is not None:
+            return
+    # Imported here: seeding pulls in passlib and runs bcrypt, which the normal startup never needs
+    from seed_users import seed
+    await asyncio.to_thread(seed)
+    logger.info("Demo users seeded.")
+
+@asynccontextmanager
+async def lifespan(app):
     """
-    Initialise the database on startup.
+    On startup: check the settings, initialise the database (seeding the demo users into an empty one),
+    the Redis session index, the Ollama HTTP client and the connection manager,
+    preload and precompress the static files,
+    and start migrating stored history to HISTORY_ENCODING (and, if enabled, archiving idle sessions) in the background,
+    along with the listener that drops changed users from the authentication caches.
+    /ready answers 200 once this is done.
+
+    On shutdown: stop the connection manager and close the Ollama HTTP client, the authentication pool,
+    the database pool and the Redis connections.
     """
-    Base.metadata.create_all(bind=engine)
+    started = time.perf_counter()
+    settings.check()
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
     logger.info("Database tables created.")
-
-@router.post("/token", response_model=Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    await _seed_demo_users()
+    await asyncio.to_thread(static_assets.load)
+    await ensure_session_index()
+    await start_http_client()
+    await manager.start()
+    background = [ensure_history_encoding(), listen_for_auth_invalidations(redis_client)]
+    if HISTORY_ARCHIVE_ENABLED:
+        background.append(run_history_archiver())
+    for coro in background:
+        task = asyncio.create_task(coro)
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+    _startup["seconds"] = round(time.perf_counter() - started, 3)
+    logger.info("Startup complete in %.3fs", _startup["seconds"])
+    try:
+        yield
+    finally:
+        _startup["seconds"] = None
+        for task in list(_background_tasks):
+            task.cancel()
+        await manager.close()
+        await close_http_client()
+        shutdown_auth_executors()
+        await async_engine.dispose()
+        await close_redis()
+
+# Every route, HTTP or WebSocket, counts against the per-IP request limit
+router = APIRouter(dependencies=[Depends(limit_requests)], lifespan=lifespan)
+# Except the readiness probe and the metrics: load balancers and scrapers poll them from a single IP
+probe_router = APIRouter()
+
+@router.post("/token", response_model=Token, dependencies=[Depends(limit_logins)])
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_async_db)):
     """
     Function Task:
         Authenticates the user and returns an access token if the credentials are correct.
+        The bcrypt check runs in the authentication pool, off the event loop.
+        Attempts are rate limited per client IP (429 with Retry-After).
 
     Arguments:
         form_data (OAuth2PasswordRequestForm): The form containing username and password.
-        db (Session): The database session to use for the query.
+        db (AsyncSession): The database session to use for the query.
 
     Returns:
         dict: Contains the access token, token type, and user UUID.
@@ -61,12 +135,14 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     Raises:
         HTTPException: If the username or password is incorrect.
     """
-    user = authenticate_user(db, form_data.username, form_data.password)
+    started = time.perf_counter()
+    user = await authenticate_user(db, form_data.username, form_data.password)
+    latency = {"latency_ms": round((time.perf_counter() - started) * 1000, 1)}
     if not user:
-        logger.info(f"Failed login attempt for username: {form_data.username}")
+        logger.info("Failed login attempt for username: %s", form_data.username, extra=latency)
         raise HTTPException(status_code=400, detail="Incorrect username or password")
     access_token = create_access_token(data={"sub": user.username}, expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    logger.info(f"User logged in: {user.username} (uuid: {user.uuid})")
+    logger.info("User logged in: %s (uuid: %s)", user.username, user.uuid, extra=latency)
     return {"access_token": access_token, "token_type": "bearer", "user_uuid": user.uuid}
 
 @router.get("/users/me/", response_model=UserOut)
@@ -81,14 +157,15 @@ async def read_users_me(current_user: User = Depends(get_current_user)):
     Returns:
         User: The user profile information.
     """
-    logger.info(f"User profile accessed: {current_user.username}")
+    logger.info("User profile accessed: %s", current_user.username)
     return current_user
 
 @router.websocket("/api/chat")
-async def websocket_endpoint(websocket: WebSocket, uuid: str = Query(...), session_id: str = Query(None)):
+async def websocket_endpoint(websocket: WebSocket, uuid: str = Query(...), session_id: str = Query(None), last_seq: str = Query(None)):
     """ Handle WebSocket connections for chat sessions.
     This function manages the WebSocket connection, handles incoming messages,
-    and interacts with the Ollama API to generate responses based on conversation history."""
+    and interacts with the Ollama API to generate responses based on conversation history.
+    In resumable mode a client reconnecting with last_seq first receives the frames it missed."""
     """Manages the WebSocket connection lifecycle,
     Receives and processes messages,
     Starts and stops background tasks,
@@ -96,95 +173,352 @@ async def websocket_endpoint(websocket: WebSocket, uuid: str = Query(...), sessi
     Handles exceptions and cleans up resources."""
     if not session_id:
         session_id = str(uuid4())
+    else:
+        # Saves the output of a generation whose worker died mid-stream
+        await recover_partial_response(uuid, session_id)
+    # Every record logged by this connection and its generations carries uuid and session_id
+    bind_log_context(uuid=uuid, session_id=session_id)
     await ensure_system_message(uuid, session_id)
     try:
-        await manager.connect(websocket, session_id)
+        await manager.connect(websocket, uuid, session_id, last_seq)
         while True:
             data = await websocket.receive_text()
             try:
                 message = json.loads(data)
                 if message.get("type") == "user_message":
-                    manager.stop_task(session_id)
-                    await append_history(uuid, session_id, "user", message["content"])
-                    logger.info(f"User message received: uuid={uuid}, session_id={session_id}")
-                    task = asyncio.create_task(
-                        generate_with_ollama(uuid, session_id, websocket)
-                    )
+                    if message_limiter is not None:
+                        retry_after = await message_limiter.hit(uuid)
+                        if retry_after:
+                            # The message is dropped; a running generation is left alone, and the error is not
+                            # recorded in its replay stream
+                            seconds = max(1, math.ceil(retry_after))
+                            await manager.send_message({
+                                "type": "error",
+                                "content": f"Rate limit exceeded, retry in {seconds}s",
+                                "retry_after": seconds,
+                            }, session_id)
+                            continue
+                    sender = manager.sender(uuid, session_id, new_generation=True)
+                    # Admission comes first: a rejected message must neither enter the history nor stop the
+                    # running answer. The admitted generation waits for its question to be saved before it starts.
+                    # Queue and rejection notices are not recorded: only the generation's own frames replace the
+                    # session's replay stream.
+                    question_saved = asyncio.Event()
+
+                    async def generate(sender=sender, question_saved=question_saved):
+                        await question_saved.wait()
+                        return await generate_with_ollama(uuid, session_id, sender)
+
+                    try:
+                        task = scheduler.submit(
+                            uuid,
+                            generate,
+                            notify=lambda position: manager.send_message({"type": "queued", "position": position}, session_id),
+                        )
+                    except QueueFullError as e:
+                        GENERATIONS_REJECTED.inc()
+                        logger.warning("Generation rejected, queue full: uuid=%s, session_id=%s", uuid, session_id)
+                        await manager.send_message({"type": "error", "content": str(e)}, session_id)
+                        continue
+                    try:
+                        # Once the previous generation is known to be over, what a dead worker left is saved before
+                        # the new question even if its lease has not expired. A generation still running (on another
+                        # worker, or slow to stop) keeps its partial: the new generation's first checkpoint takes it over.
+                        previous_over = await manager.stop_and_wait(session_id)
+                        await recover_partial_response(uuid, session_id, force=previous_over)
+                        await append_history(uuid, session_id, "user", message["content"])
+                    except BaseException:
+                        task.cancel()
+                        raise
+                    logger.info("User message received: uuid=%s, session_id=%s", uuid, session_id)
+                    question_saved.set()
                     manager.set_task(session_id, task)
                 elif message.get("type") == "stop_generation":
-                    stopped = manager.stop_task(session_id)
+                    stopped = await manager.stop(session_id)
                     if stopped:
                         await manager.send_message({"type": "stopped"}, session_id)
-                        logger.info(f"Stop requested by user: uuid={uuid}, session_id={session_id}")
+                        logger.info("Stop requested by user: uuid=%s, session_id=%s", uuid, session_id)
             except json.JSONDecodeError:
                 logger.warning("Received invalid JSON on WebSocket")
     except WebSocketDisconnect:
-        manager.disconnect(session_id)
-        logger.info(f"WebSocketDisconnect: session_id={session_id}")
+        manager.disconnect(websocket, session_id)
+        logger.info("WebSocketDisconnect: session_id=%s", session_id)
     except Exception as e:
-        manager.disconnect(session_id)
-        logger.error(f"WebSocket error: {e}")
+        manager.disconnect(websocket, session_id)
+        logger.error("WebSocket error: %s", e)
 
 
 @router.get("/")
-def serve_index():
+def serve_index(request: Request):
     """
     Function Task:
-        Serves the main index HTML page to the client.
+        Serves the main index HTML page to the client from the in-memory asset store.
 
     Arguments:
-        None
+        request (Request): The request, for its Accept-Encoding and If-None-Match headers.
 
     Returns:
-        FileResponse: The index.html file from the static directory.
+        Response: The (possibly compressed) index.html, or 304 if the client's copy is current.
     """
     # Redirect to login page
-    return FileResponse("static/index.html")
+    return static_assets.response(request, "index.html")
 
 @router.get("/chat.html")
-def serve_chat():
+def serve_chat(request: Request):
     """
     Function Task:
-        Serves the chat HTML page to the client.
+        Serves the chat HTML page to the client from the in-memory asset store.
 
     Arguments:
-        None
+        request (Request): The request, for its Accept-Encoding and If-None-Match headers.
+
+    Returns:
+        Response: The (possibly compressed) chat.html, or 304 if the client's copy is current.
+    """
+    return static_assets.response(request, "chat.html")
+
+@router.get("/static/{path:path}")
+def serve_static(path: str, request: Request):
+    """
+    Function Task:
+        Serves any file under the static directory from the in-memory asset store.
+
+    Arguments:
+        path (str): The file path relative to the static directory.
+        request (Request): The request, for its Accept-Encoding and If-None-Match headers.
 
     Returns:
-        FileResponse: The chat.html file from the static directory.
+        Response: The (possibly compressed) file, 304 if the client's copy is current, or 404.
     """
-    return FileResponse("static/chat.html")
+    return static_assets.response(request, path)
 
 
 @router.get("/history_sessions")
-async def history_sessions(uuid: str):
+async def history_sessions(response: Response, uuid: str, cursor: str = Query(None), limit: int = Query(SESSIONS_PAGE_SIZE, ge=1, le=500)):
     """
     Function Task:
-        Returns a list of all chat sessions for a user.
+        Returns a page of chat sessions for a user, most recently updated first.
 
     Arguments:
+        response (Response): The outgoing response, used to set the next page cursor.
         uuid (str): The user's unique identifier.
+        cursor (str): The X-Next-Cursor value returned with the previous page (omitted for the first page).
+        limit (int): The maximum number of sessions to return.
 
     Returns:
-        list: A list of session metadata dictionaries.
+        list: A list of session metadata dictionaries. The X-Next-Cursor header
+            holds the cursor of the next page when there is one.
     """
-    sessions = await get_all_sessions(uuid)
-    logger.info(f"History sessions fetched for uuid={uuid}")
+    try:
+        sessions, next_cursor = await get_sessions_page(uuid, cursor, limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+    logger.info("History sessions fetched for uuid=%s", uuid)
     return sessions
 
+# Bytes of message JSON collected before a chunk of a history response is sent
+HISTORY_STREAM_CHUNK_BYTES = 64 * 1024
+
+async def _stream_history_json(session_id, batches, tail):
+    """
+    Function Task:
+        Streams a history response body. Messages are stored as JSON text in Redis,
+        so they are copied into the response as-is instead of being parsed and re-encoded.
+
+    Arguments:
+        session_id (str): The chat session's unique identifier.
+        batches (AsyncIterator[list]): Lists of stored message JSON, oldest first.
+        tail (dict): The fields written after the history list, e.g. the next page cursor.
+
+    Returns:
+        AsyncIterator[str]: The chunks of the JSON body.
+    """
+    yield '{"session_id": %s, "history": [' % json.dumps(session_id)
+    chunk, size, separator = [], 0, ""
+    async for batch in batches:
+        for entry in batch:
+            chunk.append(separator + entry)
+            size += len(entry) + 1
+            separator = ","
+            if size >= HISTORY_STREAM_CHUNK_BYTES:
+                yield "".join(chunk)
+                chunk, size = [], 0
+    yield "".join(chunk) + "]" + "".join(f", {json.dumps(k)}: {json.dumps(v)}" for k, v in tail.items()) + "}"
+
 @router.get("/history/{session_id}")
-async def get_history_api(session_id: str, uuid: str):
+async def get_history_api(session_id: str, uuid: str, before: int = Query(None, ge=0), limit: int = Query(None, ge=1, le=1000)):
     """
     Function Task:
-        Returns the chat history for a specific session and user.
+        Returns the chat history for a specific session and user. With `limit` (and
+        `before` for older pages) one page is returned, newest page first; follow
+        `next_before` until it is null. Without them the whole history is streamed.
 
     Arguments:
         session_id (str): The chat session's unique identifier.
         uuid (str): The user's unique identifier.
+        before (int | None): Return the messages stored before this index (the previous page's `next_before`).
+        limit (int | None): The page size (HISTORY_PAGE_SIZE when only `before` is given).
+
+    Returns:
+        StreamingResponse: {"session_id", "history"} in chronological order, plus
+            "next_before" and "total" for paged requests.
+    """
+    if before is None and limit is None:
+        body = _stream_history_json(session_id, iter_history(uuid, session_id), {})
+    else:
+        entries, first, total = await get_history_page(uuid, session_id, before, limit or HISTORY_PAGE_SIZE, decode=False)
+
+        async def page():
+            yield entries
+
+        body = _stream_history_json(session_id, page(), {"next_before": first if first > 0 else None, "total": total})
+    logger.info("History fetched: uuid=%s, session_id=%s, before=%s, limit=%s", uuid, session_id, before, limit)
+    return StreamingResponse(body, media_type="application/json")
+
+@probe_router.get("/ready")
+async def ready():
+    """
+    Function Task:
+        Readiness probe: succeeds once startup has finished and Redis and the database answer.
+        Load balancers and orchestrators should route traffic only when this returns 200.
+
+    Arguments:
+        None
+
+    Returns:
+        JSONResponse: 200 with the startup time, or 503 naming what is not ready.
+    """
+    if _startup["seconds"] is None:
+        return JSONResponse({"ready": False, "reason": "starting"}, status_code=503)
+    checks = {}
+    try:
+        await redis_client.ping()
+        checks["redis"] = "ok"
+    except Exception as e:
+        checks["redis"] = str(e) or type(e).__name__
+    try:
+        async with async_engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+        checks["database"] = "ok"
+    except Exception as e:
+        checks["database"] = str(e) or type(e).__name__
+    ok = all(value == "ok" for value in checks.values())
+    return JSONResponse({"ready": ok, "startup_seconds": _startup["seconds"], **checks}, status_code=200 if ok else 503)
+
+@router.get("/stats/ollama_pool")
+async def ollama_pool_stats():
+    """
+    Function Task:
+        Returns the Ollama connection pool statistics.
+
+    Arguments:
+        None
+
+    Returns:
+        dict: The pool limits, in-flight and total request counts and idle connections.
+    """
+    return pool_stats()
+
+@router.get("/stats/auth_cache")
+async def auth_cache_statistics():
+    """
+    Function Task:
+        Returns the hit/miss statistics of the authentication caches.
+
+    Arguments:
+        None
+
+    Returns:
+        dict: The statistics of the token and user caches.
+    """
+    return auth_cache_stats()
+
+@router.get("/stats/scheduler")
+async def scheduler_stats():
+    """
+    Function Task:
+        Returns the generation scheduler's limits and current load.
+
+    Arguments:
+        None
+
+    Returns:
+        dict: The running and queued generation counts and the number of rejections.
+    """
+    return scheduler.stats()
+
+@router.get("/stats/response_cache")
+async def response_cache_stats():
+    """
+    Function Task:
+        Returns the hit/miss statistics of the model response cache.
+
+    Arguments:
+        None
+
+    Returns:
+        dict: The cache backend and its hit, miss, store and eviction counters.
+    """
+    if response_cache is None:
+        return {"backend": "off"}
+    return response_cache.stats()
+
+@router.get("/stats/history_archive")
+async def history_archive_stats():
+    """
+    Function Task:
+        Returns the state of the on-disk archive of idle sessions.
+
+    Arguments:
+        None
+
+    Returns:
+        dict: Whether archiving is enabled, the archive file and the number of archived sessions.
+    """
+    return await history_archive.stats()
+
+@router.get("/stats/rate_limit")
+async def rate_limit_statistics():
+    """
+    Function Task:
+        Returns how many requests each rate limit allowed and denied in this worker.
+
+    Arguments:
+        None
+
+    Returns:
+        dict: Per limit, its setting and the allowed/denied/error counters.
+    """
+    return rate_limit_stats()
+
+@router.get("/stats/static")
+async def static_asset_stats():
+    """
+    Function Task:
+        Returns the preloaded static files and their size in each encoding.
+
+    Arguments:
+        None
+
+    Returns:
+        dict: Whether dev reload and brotli are enabled, and the sizes per file and encoding.
+    """
+    return static_assets.stats()
+
+@probe_router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Function Task:
+        Returns this worker's metrics in the Prometheus text exposition format:
+        generation time-to-first-token, tokens/s and duration, Redis call latency,
+        login latency, WebSocket/task counts and scheduler queue depth.
+
+    Arguments:
+        None
 
     Returns:
-        JSONResponse: The chat history for the session.
+        PlainTextResponse: The metrics, one sample per line.
     """
-    history = await get_history(uuid, session_id)
-    logger.info(f"History fetched: uuid={uuid}, session_id={session_id}")
-    return JSONResponse(content={"session_id": session_id, "history": history})
\ No newline at end of file
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+class ChunkCoalescer:
+    """Buffers streamed model output and sends it to the client as fewer, larger response_chunk frames.
+
+    A buffer is flushed when it has been open for `window_ms` milliseconds or when it
+    reaches `max_chars` characters, whichever comes first. With a window of 0 every
+    chunk is sent as soon as it arrives (per-token mode).
+
+    Attributes:
+        websocket: The connection (anything with an async send_json) the frames are sent to.
+        window_ms (int): How long a chunk may wait in the buffer before it is flushed.
+        max_chars (int): How many buffered characters force an immediate flush.
+        frames_sent (int): How many response_chunk frames have been sent.
+    """
+
+    def __init__(self, websocket, window_ms: int = 0, max_chars: int = 256):
+        """Initialize the coalescer with an empty buffer for the given websocket."""
+        self.websocket = websocket
+        self.window_ms = window_ms
+        self.max_chars = max_chars
+        self.frames_sent = 0
+        self._buffer = []
+        self._buffered_chars = 0
+        self._timer: asyncio.Task | None = None
+        self._send_lock = asyncio.Lock()
+
+    async def add(self, chunk: str):
+        """Add a chunk of model output to the buffer, flushing if the buffer is full."""
+        """ARGS: chunk (str): the text produced by the model"""
+        if not chunk:
+            return
+        if self.window_ms <= 0:
+            await self._send(chunk)
+            return
+        self._buffer.append(chunk)
+        self._buffered_chars += len(chunk)
+        if self._buffered_chars >= self.max_chars:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def flush(self):
+        """Send everything in the buffer as one response_chunk frame."""
+        """Returns: None, it does nothing if the buffer is empty."""
+        self._cancel_timer()
+        if not self._buffer:
+            return
+        content = "".join(self._buffer)
+        self._buffer = []
+        self._buffered_chars = 0
+        await self._send(content)
+
+    async def close(self):
+        """Flush the remaining buffer and stop the flush timer. Call before response_end, stopped or error."""
+        await self.flush()
+        # Wait for a timer flush that is still sending, so nothing follows the final frame
+        async with self._send_lock:
+            pass
+
+    async def _flush_later(self):
+        """Flush the buffer once the time window has passed."""
+        await asyncio.sleep(self.window_ms / 1000)
+        self._timer = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error("Error flushing coalesced chunk: %s", e)
+
+    def _cancel_timer(self):
+        """Cancel the pending flush timer unless it is the task currently running."""
+        timer = self._timer
+        self._timer = None
+        if timer is not None and timer is not asyncio.current_task() and not timer.done():
+            timer.cancel()
+
+    async def _send(self, content: str):
+        """Send one response_chunk frame, keeping frames in order."""
+        async with self._send_lock:
+            await self.websocket.send_json({
+                "type": "response_chunk",
+                "content": content
+            })
+            self.frames_sent += 1
@@ -1,52 +1,106 @@
 import asyncio
+import json
+import os
+import socket
 from typing import Dict
+from uuid import uuid4
 from fastapi import WebSocket
 import logging
+from settings import settings
+from Redis import append_stream_frame, read_stream_frames, generation_in_progress
 
 
 
 logger = logging.getLogger(__name__)
 
+
+# "local" keeps everything in this process; "distributed" routes control messages between workers over Redis
+CONNECTION_MODE = settings.connection_mode
+CONNECTION_OWNERSHIP_TTL = settings.connection_ownership_ttl
+# Resumable mode keeps generations running after a disconnect and records their frames for replay
+RESUMABLE_STREAMS = settings.resumable_streams
+RESUME_GRACE_SECONDS = settings.resume_grace_seconds
+# Frames read from Redis per replay round trip
+REPLAY_BATCH_SIZE = 500
+# How long stop() waits for a cancelled generation to save its partial answer
+STOP_WAIT_SECONDS = 5
+
+
+def _seq_key(seq: str):
+    """Turn a stream sequence number ("<ms>-<n>") into a tuple that sorts in stream order."""
+    ms, _, n = seq.partition("-")
+    return int(ms), int(n or 0)
+
 class ConnectionManager:
     """Manages active websockest connections and associated backgorund tasks for each session.
       
     Attributes: 
         active_connections (dict): A dictionary mapping session IDs to active WebSocket connections.
         generation_tasks (dict): A dictionary mapping session IDs to asyncio tasks for ongoing generation processes.
+        resumable (bool): Whether generations outlive a disconnect and their frames are recorded for replay.
+        grace_seconds (float): How long a detached generation keeps running without a client (resumable mode).
     """
     
-    def __init__(self):
+    def __init__(self, resumable: bool = False, grace_seconds: float = 30):
         """Initialize the connection manager with empty dictionaries for active connections and generation tasks."""
         self.active_connections: Dict[str, WebSocket] = {}
         self.generation_tasks: Dict[str, asyncio.Task] = {}
+        self.resumable = resumable
+        self.grace_seconds = grace_seconds
+        # Frames that arrive for a session while its missed frames are being replayed
+        self._replaying: Dict[str, list] = {}
+        self._grace_timers: Dict[str, asyncio.TimerHandle] = {}
+        self._pending: set = set()
 
-    async def connect(self, websocket: WebSocket, session_id: str):
+    async def connect(self, websocket: WebSocket, uuid: str, session_id: str, last_seq: str | None = None):
         """Accept the new websocket connection and store in the active_connections dictionary."""
         """ARGS: 
                 websocket: the websocket connection 
+                uuid (str): the user the session belongs to; only their frames are replayed
                 session_id (str): the unique session ID.
+                last_seq (str | None): in resumable mode, the sequence number of the last frame the client saw
               """
         """Returns: None if the session_id is already in the active_connections dictionary, it does nothing."""
-        """Accepts a new WebSocket connection and stores it in the active_connections dictionary."""
+        """Accepts a new WebSocket connection and stores it in the active_connections dictionary.
+        In resumable mode the frames the client missed are replayed before live frames are delivered."""
         await websocket.accept()
+        self._cancel_grace_timer(session_id)
+        if self.resumable:
+            self._replaying[session_id] = []
         self.active_connections[session_id] = websocket
+        await self._claim(session_id)
         await websocket.send_json({
             "type": "session_id",
             "session_id": session_id
         })
-        logger.info(f"WebSocket connected: session_id={session_id}")
+        logger.info("WebSocket connected: session_id=%s", session_id)
+        if self.resumable:
+            await self._replay(websocket, uuid, session_id, last_seq)
 
-    def disconnect(self, session_id: str):
+    def disconnect(self, websocket: WebSocket, session_id: str):
         """ Remove the websocket connection from the dictionarry of active_Connections """
-        """ARGS: session_id : the uniques session ID """
-        """Returns: None if the session_id is not in the active_connections dictionary, it does nothing."""
-        """Remove the websocket connection for the given session ID and cancel any ongoing generation task."""
-        if session_id in self.active_connections:
-            del self.active_connections[session_id]
-        task = self.generation_tasks.pop(session_id, None)
+        """ARGS: websocket : the websocket that closed
+                session_id : the uniques session ID """
+        """Returns: True if the websocket was the session's connection, False if the client has already reconnected
+        on a newer websocket (the late disconnect of the old one then leaves the session alone)."""
+        """Remove the websocket connection for the given session ID and cancel any ongoing generation task.
+        In resumable mode the task keeps running for grace_seconds so a reconnecting client can pick it up."""
+        current = self.active_connections.get(session_id)
+        if current is not None and current is not websocket:
+            logger.info("Stale WebSocket disconnected, session already reconnected: session_id=%s", session_id)
+            return False
+        self.active_connections.pop(session_id, None)
+        self._replaying.pop(session_id, None)
+        task = self.generation_tasks.get(session_id)
+        if self.resumable and task and not task.done():
+            self._arm_grace_timer(session_id)
+            logger.info("WebSocket disconnected, generation detached: session_id=%s", session_id)
+            return True
+        self.generation_tasks.pop(session_id, None)
         if task and not task.done():
             task.cancel()
-        logger.info(f"WebSocket disconnected: session_id={session_id}")
+        logger.info("WebSocket disconnected: session_id=%s", session_id)
+        return True
 
     async def send_message(self, message: dict, session_id: str):
         """Send a json message to the specified websocket connection (at the user end)"""
@@ -57,6 +111,10 @@ class ConnectionManager:
         """Returns: None if the session_id is not in the active_connections dictionary, it does nothing."""
         """Sends a JSON message to the WebSocket connection associated with the given session ID."""
         if session_id in self.active_connections:
+            pending = self._replaying.get(session_id)
+            if pending is not None:
+                pending.append(message)
+                return
             await self.active_connections[session_id].send_json(message)
 
     def set_task(self, session_id: str, task: asyncio.Task):
@@ -65,6 +123,7 @@ class ConnectionManager:
                 task: we give the asyncio task to manage the users chat generation process"""
         """Returns: None  it stores the given asyncio task in the generation_tasks dictionary with the session_id as the key."""
         self.generation_tasks[session_id] = task
+        task.add_done_callback(lambda _: self._task_finished(session_id, task))
 
     def stop_task(self, session_id: str):
         """ Stop the generation task for the specified session ID if it exists and is running."""
@@ -73,6 +132,322 @@ class ConnectionManager:
         task = self.generation_tasks.get(session_id)
         if task and not task.done():
             task.cancel()
-            logger.info(f"Generation task stopped: session_id={session_id}")
+            logger.info("Generation task stopped: session_id=%s", session_id)
             return True
-        return False
\ No newline at end of file
+        return False
+
+    def sender(self, uuid: str, session_id: str, new_generation: bool = False):
+        """ Return an object with an async send_json that delivers messages to the session's websocket through this manager."""
+        """ARGS: uuid : the user the session belongs to
+                session_id : the unique session ID for the websocket connection
+                new_generation : the sender carries a new generation's frames; its first frame replaces the recorded frames of earlier ones"""
+        """Returns: a SessionSender, which can be handed to code that expects a websocket (e.g. generate_with_ollama)."""
+        return SessionSender(self, uuid, session_id, new_generation)
+
+    async def stop(self, session_id: str):
+        """ Stop the generation task for the specified session ID, wherever it runs.
+        A local task is awaited (up to STOP_WAIT_SECONDS), so its partial answer is saved when this returns."""
+        """ARGS: session_id : the unique session ID for the websocket connection"""
+        """Returns: True if a running task was found and stopped, False otherwise."""
+        task = self.generation_tasks.get(session_id)
+        if not self.stop_task(session_id):
+            return False
+        await asyncio.wait({task}, timeout=STOP_WAIT_SECONDS)
+        return True
+
+    async def stop_and_wait(self, session_id: str):
+        """ Stop the session's generation like stop(), and report whether it is over."""
+        """ARGS: session_id : the unique session ID for the websocket connection"""
+        """Returns: True if no generation of the session is left running: none was found, or the local task finished
+        within STOP_WAIT_SECONDS (its partial answer is then saved). False if it runs on another worker or is still running."""
+        task = self.generation_tasks.get(session_id)
+        stopped = await self.stop(session_id)
+        if task is not None:
+            return task.done()
+        return not stopped
+
+    async def start(self):
+        """ Start background work needed by the manager. Nothing is needed in single-process mode."""
+
+    async def close(self):
+        """ Stop background work started by start() and the grace timers of detached generations."""
+        for timer in self._grace_timers.values():
+            timer.cancel()
+        self._grace_timers.clear()
+
+    def _task_finished(self, session_id: str, task: asyncio.Task):
+        """ Forget a finished task, unless a newer task already replaced it."""
+        if self.generation_tasks.get(session_id) is task:
+            del self.generation_tasks[session_id]
+            self._cancel_grace_timer(session_id)
+
+    async def _claim(self, session_id: str):
+        """ Record that this process holds the session's websocket. Nothing is needed in single-process mode."""
+
+    async def _is_attached(self, session_id: str):
+        """ Returns: True if a client is connected to the session."""
+        return session_id in self.active_connections
+
+    def _arm_grace_timer(self, session_id: str):
+        """ Schedule the check that stops a detached generation once the grace period is over."""
+        self._cancel_grace_timer(session_id)
+        loop = asyncio.get_running_loop()
+        self._grace_timers[session_id] = loop.call_later(
+            self.grace_seconds, lambda: self._spawn(self._expire_detached(session_id))
+        )
+
+    def _cancel_grace_timer(self, session_id: str):
+        """ Cancel the pending grace period check of a session, if any."""
+        timer = self._grace_timers.pop(session_id, None)
+        if timer is not None:
+            timer.cancel()
+
+    async def _expire_detached(self, session_id: str):
+        """ Stop a detached generation whose client did not come back within the grace period."""
+        self._grace_timers.pop(session_id, None)
+        if await self._is_attached(session_id):
+            if session_id not in self.active_connections:
+                # The client is connected to another worker; check again later
+                self._arm_grace_timer(session_id)
+            return
+        if self.stop_task(session_id):
+            logger.info("Detached generation expired: session_id=%s", session_id)
+
+    async def _replay(self, websocket: WebSocket, uuid: str, session_id: str, last_seq: str | None):
+        """ Send the recorded frames the client missed, then the live frames that arrived meanwhile.
+        The stream only holds the latest generation, so a fresh client replays that generation from its start."""
+        last = last_seq
+        try:
+            # A fresh client only needs the frames of a generation that is still running
+            if last_seq is not None or await generation_in_progress(uuid, session_id):
+                while True:
+                    frames = await read_stream_frames(uuid, session_id, last, REPLAY_BATCH_SIZE)
+                    for seq, frame in frames:
+                        await websocket.send_json(frame)
+                        last = seq
+                    if len(frames) < REPLAY_BATCH_SIZE:
+                        break
+                if last != last_seq:
+                    logger.info("Replayed missed frames: session_id=%s, last_seq=%s", session_id, last)
+        except Exception as e:
+            logger.error("Error replaying frames: session_id=%s, error=%s", session_id, e)
+        finally:
+            # Deliver frames that arrived during the replay, skipping those the replay already sent
+            while self._replaying.get(session_id):
+                pending = self._replaying[session_id]
+                self._replaying[session_id] = []
+                for frame in pending:
+                    seq = frame.get("seq")
+                    if seq is not None and last is not None and _seq_key(seq) <= _seq_key(last):
+                        continue
+                    await websocket.send_json(frame)
+                    if seq is not None:
+                        last = seq
+            self._replaying.pop(session_id, None)
+
+    def _spawn(self, coro):
+        """ Run a coroutine in the background, keeping a reference until it finishes."""
+        task = asyncio.create_task(coro)
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+
+class SessionSender:
+    """Sends messages to a session through a ConnectionManager, so the caller does not need to hold the websocket.
+
+    Attributes:
+        manager (ConnectionManager): The manager that routes the messages.
+        uuid (str): The user the session belongs to.
+        session_id (str): The session the messages are for.
+        new_generation (bool): Until its first frame is recorded, the sender starts a new generation's stream.
+    """
+
+    def __init__(self, manager: ConnectionManager, uuid: str, session_id: str, new_generation: bool = False):
+        self.manager = manager
+        self.uuid = uuid
+        self.session_id = session_id
+        self.new_generation = new_generation
+
+    async def send_json(self, message: dict):
+        """Send a json message to the session's websocket connection.
+        In resumable mode the message is first recorded in the session's stream and tagged with its sequence number;
+        the first frame of a new generation replaces the frames of earlier generations."""
+        if self.manager.resumable:
+            reset, self.new_generation = self.new_generation, False
+            seq = await append_stream_frame(self.uuid, self.session_id, message, reset=reset)
+            message = {**message, "seq": seq}
+        await self.manager.send_message(message, self.session_id)
+
+
+class DistributedConnectionManager(ConnectionManager):
+    """Connection manager for running several workers behind a load balancer.
+
+    Which worker holds each session's websocket and generation task is recorded in Redis.
+    Messages and stop requests for a session that lives on another worker are published
+    on that worker's control channel and handled there.
+
+    Attributes:
+        redis_client: The Redis client used for ownership keys and pub/sub.
+        worker_id (str): The unique identifier of this worker.
+        ownership_ttl (int): Seconds an ownership key lives without being refreshed.
+    """
+
+    def __init__(self, redis_client, worker_id: str | None = None, ownership_ttl: int = 60, resumable: bool = False, grace_seconds: float = 30):
+        """Initialize the manager for this worker."""
+        super().__init__(resumable, grace_seconds)
+        self.redis_client = redis_client
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+        self.ownership_ttl = ownership_ttl
+        self._pubsub = None
+        self._background: list[asyncio.Task] = []
+
+    @staticmethod
+    def socket_owner_key(session_id: str):
+        """Returns the Redis key naming the worker that holds the session's websocket."""
+        return f"wsowner:{session_id}"
+
+    @staticmethod
+    def task_owner_key(session_id: str):
+        """Returns the Redis key naming the worker that runs the session's generation task."""
+        return f"taskowner:{session_id}"
+
+    @staticmethod
+    def control_channel(worker_id: str):
+        """Returns the pub/sub channel a worker listens on for control messages."""
+        return f"wsctl:{worker_id}"
+
+    async def start(self):
+        """Subscribe to this worker's control channel and start refreshing ownership keys."""
+        self._pubsub = self.redis_client.pubsub()
+        await self._pubsub.subscribe(self.control_channel(self.worker_id))
+        self._background = [
+            asyncio.create_task(self._listen()),
+            asyncio.create_task(self._refresh_ownership()),
+        ]
+        logger.info("Distributed connection manager started: worker_id=%s", self.worker_id)
+
+    async def close(self):
+        """Stop listening for control messages and release this worker's ownership keys."""
+        await super().close()
+        for task in self._background:
+            task.cancel()
+        await asyncio.gather(*self._background, return_exceptions=True)
+        self._background = []
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe()
+            await self._pubsub.aclose()
+            self._pubsub = None
+        for session_id in list(self.active_connections):
+            await self._release(self.socket_owner_key(session_id))
+        for session_id in list(self.generation_tasks):
+            await self._release(self.task_owner_key(session_id))
+
+    async def _claim(self, session_id: str):
+        """Record this worker as the owner of the session's connection."""
+        await self.redis_client.set(self.socket_owner_key(session_id), self.worker_id, ex=self.ownership_ttl)
+
+    async def _is_attached(self, session_id: str):
+        """Returns: True if a client is connected to the session on any worker."""
+        if session_id in self.active_connections:
+            return True
+        return bool(await self.redis_client.exists(self.socket_owner_key(session_id)))
+
+    def disconnect(self, websocket: WebSocket, session_id: str):
+        """Remove the websocket locally and release the ownership keys held by this worker."""
+        had_task = session_id in self.generation_tasks
+        if not super().disconnect(websocket, session_id):
+            return False
+        self._spawn(self._release(self.socket_owner_key(session_id)))
+        if had_task and session_id not in self.generation_tasks:
+            self._spawn(self._release(self.task_owner_key(session_id)))
+        return True
+
+    async def send_message(self, message: dict, session_id: str):
+        """Send the message to the session's websocket, forwarding it to the owning worker if it is not local."""
+        if session_id in self.active_connections:
+            await super().send_message(message, session_id)
+            return
+        owner = await self.redis_client.get(self.socket_owner_key(session_id))
+        if owner and owner != self.worker_id:
+            await self._publish(owner, {"op": "send", "session_id": session_id, "message": message})
+
+    def set_task(self, session_id: str, task: asyncio.Task):
+        """Store the task locally and record this worker as the owner of the session's generation."""
+        super().set_task(session_id, task)
+        self._spawn(self.redis_client.set(self.task_owner_key(session_id), self.worker_id, ex=self.ownership_ttl))
+
+    async def stop(self, session_id: str):
+        """Stop the session's generation task locally, or ask the worker running it to stop it."""
+        if await super().stop(session_id):
+            return True
+        owner = await self.redis_client.get(self.task_owner_key(session_id))
+        if owner and owner != self.worker_id:
+            await self._publish(owner, {"op": "stop", "session_id": session_id})
+            return True
+        return False
+
+    def _task_finished(self, session_id: str, task: asyncio.Task):
+        """Forget a finished task and release its ownership key, unless a newer task replaced it."""
+        if self.generation_tasks.get(session_id) is task:
+            super()._task_finished(session_id, task)
+            self._spawn(self._release(self.task_owner_key(session_id)))
+
+    async def _publish(self, worker_id: str, payload: dict):
+        """Publish a control message to another worker."""
+        await self.redis_client.publish(self.control_channel(worker_id), json.dumps(payload))
+
+    async def _listen(self):
+        """Handle control messages published to this worker."""
+        async for item in self._pubsub.listen():
+            if item.get("type") != "message":
+                continue
+            try:
+                payload = json.loads(item["data"])
+                session_id = payload["session_id"]
+                if payload["op"] == "send":
+                    await super().send_message(payload["message"], session_id)
+                elif payload["op"] == "stop":
+                    self.stop_task(session_id)
+            except Exception as e:
+                logger.error("Error handling control message: %s", e)
+
+    async def _refresh_ownership(self):
+        """Periodically extend the ownership keys of local sessions, so keys of a crashed worker expire."""
+        while True:
+            await asyncio.sleep(self.ownership_ttl / 3)
+            try:
+                pipe = self.redis_client.pipeline(transaction=False)
+                for session_id in self.active_connections:
+                    pipe.set(self.socket_owner_key(session_id), self.worker_id, ex=self.ownership_ttl)
+                for session_id in self.generation_tasks:
+                    pipe.set(self.task_owner_key(session_id), self.worker_id, ex=self.ownership_ttl)
+                await pipe.execute()
+            except Exception as e:
+                logger.error("Error refreshing session ownership: %s", e)
+
+    async def _release(self, key: str):
+        """Delete an ownership key if this worker still holds it."""
+        await self.redis_client.eval(RELEASE_OWNERSHIP_SCRIPT, 1, key, self.worker_id)
+
+
+# Deletes KEYS[1] only when it still names this worker (ARGV[1])
+RELEASE_OWNERSHIP_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def create_connection_manager():
+    """Create the connection manager selected by CONNECTION_MODE ("local" by default, or "distributed")."""
+    """Returns: a ConnectionManager, or a DistributedConnectionManager backed by the shared Redis client."""
+    if CONNECTION_MODE == "distributed":
+        from Redis import redis_client
+        return DistributedConnectionManager(
+            redis_client,
+            ownership_ttl=CONNECTION_OWNERSHIP_TTL,
+            resumable=RESUMABLE_STREAMS,
+            grace_seconds=RESUME_GRACE_SECONDS,
+        )
+    return ConnectionManager(RESUMABLE_STREAMS, RESUME_GRACE_SECONDS)
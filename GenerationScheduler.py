@@ -0,0 +1,162 @@
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Awaitable, Callable, Deque
+from settings import settings
+
+
+
+logger = logging.getLogger(__name__)
+
+
+# Generations that may run at once against one Ollama backend, and how many may wait for a slot
+OLLAMA_MAX_CONCURRENCY = settings.ollama_max_concurrency
+GENERATION_QUEUE_SIZE = settings.generation_queue_size
+
+
+class QueueFullError(Exception):
+    """Raised when a generation cannot start now and the waiting queue is full."""
+
+
+class Ticket:
+    """A generation's place in the scheduler.
+
+    Attributes:
+        uuid (str): The user the generation belongs to.
+        notify (callable | None): Awaitable callback receiving the ticket's queue position while it waits.
+        granted (asyncio.Future): Resolved when the generation may start.
+        position (int | None): The last queue position reported to the client.
+    """
+
+    def __init__(self, uuid: str, notify: Callable[[int], Awaitable[None]] | None):
+        self.uuid = uuid
+        self.notify = notify
+        self.granted = asyncio.get_running_loop().create_future()
+        self.position: int | None = None
+
+
+class GenerationScheduler:
+    """Admission control and fair queuing in front of the model backend.
+
+    At most max_concurrency generations run at once. Further generations wait in
+    per-user queues that are served round-robin, so one user sending many messages
+    cannot starve the others. When max_queue generations are already waiting, new
+    ones are rejected with QueueFullError.
+
+    Attributes:
+        max_concurrency (int): How many generations may run at once.
+        max_queue (int): How many generations may wait for a slot.
+        running (int): How many generations are running.
+        queued (int): How many generations are waiting.
+        rejected_total (int): How many generations were rejected because the queue was full.
+    """
+
+    def __init__(self, max_concurrency: int = OLLAMA_MAX_CONCURRENCY, max_queue: int = GENERATION_QUEUE_SIZE):
+        """Initialize an idle scheduler."""
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.running = 0
+        self.queued = 0
+        self.rejected_total = 0
+        # uuid -> waiting tickets; the key order is the round-robin order
+        self._queues: "OrderedDict[str, Deque[Ticket]]" = OrderedDict()
+        self._pending: set = set()
+
+    def submit(self, uuid: str, job: Callable[[], Awaitable], notify: Callable[[int], Awaitable[None]] | None = None) -> asyncio.Task:
+        """Start a generation now if a slot is free, otherwise queue it behind the other users' generations."""
+        """ARGS: uuid (str): the user the generation belongs to
+                job (callable): a function returning the awaitable to run, e.g. lambda: generate_with_ollama(...)
+                notify (callable | None): awaitable callback receiving the queue position while the generation waits"""
+        """Returns: the asyncio task running the generation; cancelling it also removes it from the queue.
+        Raises QueueFullError if the generation must wait and the queue is full."""
+        ticket = Ticket(uuid, notify)
+        if self.running < self.max_concurrency and not self.queued:
+            self.running += 1
+            ticket.granted.set_result(True)
+        elif self.queued >= self.max_queue:
+            self.rejected_total += 1
+            raise QueueFullError("The server is busy, please try again shortly.")
+        else:
+            if uuid not in self._queues:
+                self._queues[uuid] = deque()
+            self._queues[uuid].append(ticket)
+            self.queued += 1
+            self._notify_positions()
+        task = asyncio.create_task(self._run(ticket, job))
+        # The done callback frees the slot or the queue place however the task ends, even if cancelled before it started
+        task.add_done_callback(lambda _: self._finished(ticket))
+        return task
+
+    async def _run(self, ticket: Ticket, job: Callable[[], Awaitable]):
+        """Wait for the ticket's turn, then run the job."""
+        await ticket.granted
+        return await job()
+
+    def stats(self) -> dict:
+        """Return the scheduler's limits and current load."""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "queued": self.queued,
+            "users_waiting": len(self._queues),
+            "rejected_total": self.rejected_total,
+        }
+
+    def _release(self):
+        """Free a slot and hand it to the next waiting generation in round-robin order."""
+        self.running -= 1
+        while self._queues and self.running < self.max_concurrency:
+            uuid, waiting = next(iter(self._queues.items()))
+            ticket = waiting.popleft()
+            self.queued -= 1
+            if waiting:
+                self._queues.move_to_end(uuid)
+            else:
+                del self._queues[uuid]
+            if ticket.granted.done():
+                # Cancelled while waiting; _finished finds it already gone
+                continue
+            self.running += 1
+            ticket.granted.set_result(True)
+        self._notify_positions()
+
+    def _finished(self, ticket: Ticket):
+        """Free the slot of a finished generation, or remove a generation cancelled while it waited."""
+        if ticket.granted.done() and not ticket.granted.cancelled():
+            self._release()
+            return
+        ticket.granted.cancel()
+        waiting = self._queues.get(ticket.uuid)
+        if waiting and ticket in waiting:
+            waiting.remove(ticket)
+            self.queued -= 1
+            if not waiting:
+                del self._queues[ticket.uuid]
+            self._notify_positions()
+
+    def _notify_positions(self):
+        """Tell every waiting generation whose place changed its new position (1 = next to start)."""
+        # Positions follow the round-robin order: the i-th ticket of every user, in rotation order, then the (i+1)-th
+        position = 0
+        depth = 0
+        queues = list(self._queues.values())
+        while True:
+            row = [waiting[depth] for waiting in queues if len(waiting) > depth]
+            if not row:
+                break
+            for ticket in row:
+                position += 1
+                if ticket.position != position and ticket.notify is not None:
+                    ticket.position = position
+                    task = asyncio.create_task(self._send_position(ticket, position))
+                    self._pending.add(task)
+                    task.add_done_callback(self._pending.discard)
+            depth += 1
+
+    async def _send_position(self, ticket: Ticket, position: int):
+        """Report a queue position to the client, ignoring delivery errors."""
+        try:
+            await ticket.notify(position)
+        except Exception as e:
+            logger.warning("Could not send queue position: %s", e)
@@ -1,19 +1,55 @@
 import redis.asyncio as redis
+import asyncio
 import json
+import math
 import time
 import logging
-import os
-from dotenv import load_dotenv
+from settings import settings
+from metrics import REDIS_CALL_SECONDS, timed
+from history_codec import HISTORY_ENCODING, encode_entry, decode_entry, entry_json, is_current
+from history_archive import history_archive, HISTORY_ARCHIVE_ENABLED, HISTORY_ARCHIVE_IDLE_DAYS, HISTORY_ARCHIVE_INTERVAL, HISTORY_ARCHIVE_BATCH
 
 # Logging setup 
 logger = logging.getLogger(__name__) 
 
 
-load_dotenv()
 
 # --- Chat/History/WS Logic ---
-REDIS_URL = os.getenv("REDIS_URL")
+REDIS_URL = settings.redis_url
+SESSIONS_PAGE_SIZE = settings.sessions_page_size
+HISTORY_PAGE_SIZE = settings.history_page_size
+SESSION_INDEX_MIGRATED_KEY = "chatindexmeta:migrated"
+# Where the marker used to live, inside the chatindex:{uuid} namespace
+LEGACY_SESSION_INDEX_MIGRATED_KEY = "chatindex:migrated"
+RESUME_STREAM_TTL = settings.resume_stream_ttl
+RESUME_STREAM_MAXLEN = settings.resume_stream_maxlen
+# Frame types that end a generation
+TERMINAL_FRAME_TYPES = ("response_end", "stopped", "error")
+HISTORY_ENCODING_MIGRATED_KEY = "chatencoding:migrated"
+HISTORY_ENCODING_LOCK_KEY = "chatencoding:lock"
+# Sorted set of "uuid:session_id" by last update, across all users; the archiver reads the idle end
+SESSION_ACTIVITY_KEY = "chatactivity"
+HISTORY_ARCHIVE_LOCK_KEY = "chatarchive:lock"
+# Seconds an unrecovered partial response is kept
+RESPONSE_PARTIAL_TTL = settings.response_partial_ttl
 redis_client = redis.from_url(REDIS_URL, decode_responses=True)
+# chat: lists may hold binary (msgpack) entries, so they are read without response decoding
+raw_redis_client = redis.from_url(REDIS_URL)
+
+async def close_redis():
+    """
+    Function Task:
+        Closes both Redis clients' connection pools. The clients connect on first use,
+        so creating them at import costs nothing; this is called on shutdown.
+
+    Arguments:
+        None
+
+    Returns:
+        None
+    """
+    await redis_client.aclose()
+    await raw_redis_client.aclose()
 
 def session_key(uuid, session_id):
     """
@@ -43,16 +79,89 @@ def session_meta_key(uuid, session_id):
     """
     return f"chatmeta:{uuid}:{session_id}"
 
-async def append_history(uuid, session_id, role, content):
+def session_summary_key(uuid, session_id):
     """
     Function Task:
-        Adds a new message to the chat history in Redis and updates session metadata.
+        Creates the key for the rolling summary of a chat session's older messages.
+
+    Arguments:
+        uuid (str): The user's unique identifier.
+        session_id (str): The chat session's unique identifier.
+
+    Returns:
+        str: The Redis key for the session summary.
+    """
+    return f"chatsummary:{uuid}:{session_id}"
+
+def stream_key(uuid, session_id):
+    """
+    Function Task:
+        Creates the key of the Redis stream that records a session's generation frames for replay.
+        The key includes the user, so a session_id alone does not give access to another user's output.
+
+    Arguments:
+        uuid (str): The user's unique identifier.
+        session_id (str): The chat session's unique identifier.
+
+    Returns:
+        str: The Redis key for the session's frame stream.
+    """
+    return f"chatstream:{uuid}:{session_id}"
+
+def session_index_key(uuid):
+    """
+    Function Task:
+        Creates the key of the per-user sorted set that indexes chat sessions by last update.
+
+    Arguments:
+        uuid (str): The user's unique identifier.
+
+    Returns:
+        str: The Redis key for the user's session index.
+    """
+    return f"chatindex:{uuid}"
+
+def partial_response_key(uuid, session_id):
+    """
+    Function Task:
+        Creates the key holding the checkpointed text of an assistant response still being generated.
 
     Arguments:
         uuid (str): The user's unique identifier.
         session_id (str): The chat session's unique identifier.
+
+    Returns:
+        str: The Redis key for the partial response.
+    """
+    return f"chatpartial:{uuid}:{session_id}"
+
+def partial_lease_key(uuid, session_id):
+    """
+    Function Task:
+        Creates the key that exists while a live generation owns the session's partial response.
+
+    Arguments:
+        uuid (str): The user's unique identifier.
+        session_id (str): The chat session's unique identifier.
+
+    Returns:
+        str: The Redis key for the partial response lease.
+    """
+    return f"chatpartial:{uuid}:{session_id}:lease"
+
+def _queue_append(pipe, uuid, session_id, role, content, timestamp):
+    """
+    Function Task:
+        Queues the commands that append one message and update the session
+        metadata and index on a Redis pipeline.
+
+    Arguments:
+        pipe (Pipeline): The Redis pipeline to queue the commands on.
+        uuid (str): The user's unique identifier.
+        session_id (str): The chat session's unique identifier.
         role (str): The role of the sender ('user', 'assistant', or 'system').
         content (str): The message content.
+        timestamp (int): The message time in epoch seconds.
 
     Returns:
         None
@@ -60,25 +169,242 @@ async def append_history(uuid, session_id, role, content):
     entry = {
         "role": role,
         "content": content,
-        "timestamp": int(time.time())
+        "timestamp": timestamp
     }
-    await redis_client.rpush(session_key(uuid, session_id), json.dumps(entry))
-    meta = await redis_client.hgetall(session_meta_key(uuid, session_id))
-    if role == "user":
-        await redis_client.hset(session_meta_key(uuid, session_id), mapping={
+    pipe.rpush(session_key(uuid, session_id), encode_entry(entry))
+    if role in ("user", "assistant"):
+        meta_key = session_meta_key(uuid, session_id)
+        if role == "user":
+            pipe.hsetnx(meta_key, "title", content[:32])
+        pipe.hset(meta_key, mapping={
             "session_id": session_id,
-            "title": content[:32] if not meta.get("title") else meta["title"],
             "preview": content[:64],
-            "updated_at": str(int(time.time()))
+            "updated_at": str(timestamp)
         })
-    elif role == "assistant":
-        await redis_client.hset(session_meta_key(uuid, session_id), mapping={
-            "session_id": session_id,
-            "preview": content[:64],
-            "updated_at": str(int(time.time()))
-        })
-    logger.info(f"History appended: uuid={uuid}, session_id={session_id}, role={role}")
+        pipe.zadd(session_index_key(uuid), {session_id: timestamp})
+        if HISTORY_ARCHIVE_ENABLED:
+            pipe.zadd(SESSION_ACTIVITY_KEY, {f"{uuid}:{session_id}": timestamp})
+
+@timed(REDIS_CALL_SECONDS)
+async def append_history(uuid, session_id, role, content):
+    """
+    Function Task:
+        Adds a new message to the chat history in Redis and updates session metadata.
+        The message, metadata and session index are written in a single MULTI/EXEC
+        round trip, so concurrent writers never see a half-updated session.
+
+    Arguments:
+        uuid (str): The user's unique identifier.
+        session_id (str): The chat session's unique identifier.
+        role (str): The role of the sender ('user', 'assistant', or 'system').
+        content (str): The message content.
+
+    Returns:
+        None
+    """
+    pipe = raw_redis_client.pipeline(transaction=True)
+    _queue_append(pipe, uuid, session_id, role, content, int(time.time()))
+    await pipe.execute()
+    logger.info("History appended: uuid=%s, session_id=%s, role=%s", uuid, session_id, role)
+
+@timed(REDIS_CALL_SECONDS)
+async def append_history_batch(uuid, session_id, messages):
+    """
+    Function Task:
+        Adds several messages to the chat history in one atomic round trip,
+        e.g. when importing a conversation or persisting a user/assistant pair.
 
+    Arguments:
+        uuid (str): The user's unique identifier.
+        session_id (str): The chat session's unique identifier.
+        messages (list): Dictionaries with 'role' and 'content' keys, in order.
+
+    Returns:
+        None
+    """
+    if not messages:
+        return
+    timestamp = int(time.time())
+    pipe = raw_redis_client.pipeline(transaction=True)
+    for message in messages:
+        _queue_append(pipe, uuid, session_id, message["role"], message["content"], timestamp)
+    await pipe.execute()
+    logger.info("History appended: uuid=%s, session_id=%s, messages=%s", uuid, session_id, len(messages))
+
+def _split_partial(value):
+    """Return (generation token, text) of a stored partial response; the token is None if there is none."""
+    if value is None:
+        return None, ""
+    text = value.decode("utf-8", errors="replace")
+    token, sep, rest = text.partition("\n")
+    if sep and len(token) == 32 and all(c in "0123456789abcdef" for c in token):
+        return token, rest
+    return None, text
+
+# Appends ARGV[2] to the partial KEYS[1] and renews the lease KEYS[2] only while the partial
+# still starts with the generation's token ARGV[1]; returns 0 if another generation took it over
+CHECKPOINT_PARTIAL_SCRIPT = """
+local prefix = ARGV[1] .. '\\n'
+if redis.call('GETRANGE', KEYS[1], 0, #prefix - 1) ~= prefix then
+    return 0
+end
+if ARGV[2] ~= '' then
+    redis.call('APPEND', KEYS[1], ARGV[2])
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+redis.call('SET', KEYS[2], ARGV[1], 'PX', ARGV[4])
+return 1
+"""
+
+@timed(REDIS_CALL_SECONDS)
+async def checkpoint_partial_response(uuid, session_id, token, delta, lease_ms, first=False):
+    """
+    Function Task:
+        Appends newly generated text to the session's partial response and renews
+        the lease that marks it as owned by a live generation, in one round trip.
+        Only the new text is sent, so every character is written once.
+
+        The partial starts with the token of the generation that writes it. The
+        first checkpoint of a generation replaces the key (SET, not APPEND): text
+        left by an earlier generation that never finished is saved to the history
+        first, in the same transaction, whether or not its lease has run out, since
+        a new generation only starts once the previous one was stopped. Later
+        checkpoints append only while the key still carries the generation's token,
+        so a generation that was taken over cannot recreate a partial without one.
+
+    Arguments:
+        uuid (str): The user's unique identifier.
+        session_id (str): The chat session's unique identifier.
+        token (str): The writing generation's token (32 hex characters).
+        delta (str): The text generated since the last checkpoint (may be empty).
+        lease_ms (int): How long the partial counts as live without another checkpoint.
+        first (bool): This is the generation's first checkpoint.
+
+    Returns:
+        bool: False if a newer generation took the partial over, so nothing was written.
+    """
+    key = partial_response_key(uuid, session_id)
+    lease = partial_lease_key(uuid, session_id)
+    if not first:
+        written = await raw_redis_client.eval(CHECKPOINT_PARTIAL_SCRIPT, 2, key, lease,
+                                              token, delta, RESPONSE_PARTIAL_TTL, lease_ms)
+        return bool(written)
+    async with raw_redis_client.pipeline(transaction=True) as pipe:
+        while True:
+            try:
+                await pipe.watch(key)
+                owner, leftover = _split_partial(await pipe.get(key))
+                pipe.multi()
+                if owner != token and leftover.strip():
+                    _queue_append(pipe, uuid, session_id, "assistant", leftover, int(time.time()))
+                pipe.set(key, f"{token}\n{delta}", ex=RESPONSE_PARTIAL_TTL)
+                pipe.set(lease, token, px=lease_ms)
+                await pipe.execute()
+                break
+            except redis.WatchError:
+                continue
+    if owner != token and leftover.strip():
+        logger.info("Partial response recovered: uuid=%s, session_id=%s, chars=%s", uuid, session_id, len(leftover))
+    return True
+
+@timed(REDIS_CALL_SECONDS)
+async def commit_partial_response(uuid, session_id, token, content, checkpointed):
+    """
+    Function Task:
+        Saves a generation's final response as an assistant message and deletes its
+        partial response and lease in the same transaction. If the partial was
+        already saved by a recovery (a new generation took the session over), the
+        response is not saved a second time. Blank responses only delete the partial.
+
+    Arguments:
+        uuid (str): The user's unique identifier.
+        session_id (str): The chat session's unique identifier.
+        token (str): The generation's token.
+        content (str): The full response.
+        checkpointed (bool): At least one checkpoint of this generation was written.
+
+    Returns:
+        bool: True if the response was saved.
+    """
+    key = partial_response_key(uuid, session_id)
+    async with raw_redis_client.pipeline(transaction=True) as pipe:
+        while True:
+            try:
+                await pipe.watch(key)
+                owner, _ = _split_partial(await pipe.get(key))
+                ours = owner == token
+                if checkpointed and not ours:
+                    await pipe.unwatch()
+                    if content.strip():
+                        logger.warning("Response already recovered from its checkpoint, not saved again: "
+                                       "uuid=%s, session_id=%s", uuid, session_id)
+                    return False
+                pipe.multi()
+                if content.strip():
+                    _queue_append(pipe, uuid, session_id, "assistant", content, int(time.time()))
+                if ours:
+                    pipe.delete(key, partial_lease_key(uuid, session_id))
+                await pipe.execute()
+                break
+            except redis.WatchError:
+                continue
+    if content.strip():
+        logger.info("History appended: uuid=%s, session_id=%s, role=assistant", uuid, session_id)
+    return bool(content.strip())
+
+async def discard_partial_response(uuid, session_id, token):
+    """
+    Function Task:
+        Deletes the session's partial response and its lease, if they belong to the generation.
+
+    Arguments:
+        uuid (str): The user's unique identifier.
+        session_id (str): The chat session's unique identifier.
+        token (str): The generation's token.
+
+    Returns:
+        None
+    """
+    await commit_partial_response(uuid, session_id, token, "", checkpointed=False)
+
+@timed(REDIS_CALL_SECONDS)
+async def recover_partial_response(uuid, session_id, force=False):
+    """
+    Function Task:
+        Saves the partial response left behind by a generation that died (its
+        worker crashed or was killed) as an assistant message. A partial whose
+        lease is still alive belongs to a running generation and is left alone,
+        unless force is set because the session's generation is known to be over.
+        Runs under WATCH, so two connections recovering at once save it once.
+
+    Arguments:
+        uuid (str): The user's unique identifier.
+        session_id (str): The chat session's unique identifier.
+        force (bool): Recover the partial even if its lease has not expired.
+
+    Returns:
+        bool: True if a partial response was recovered.
+    """
+    key = partial_response_key(uuid, session_id)
+    lease = partial_lease_key(uuid, session_id)
+    async with raw_redis_client.pipeline(transaction=True) as pipe:
+        try:
+            await pipe.watch(key, lease)
+            value = await pipe.get(key)
+            if value is None or (not force and await pipe.exists(lease)):
+                return False
+            _, content = _split_partial(value)
+            pipe.multi()
+            if content.strip():
+                _queue_append(pipe, uuid, session_id, "assistant", content, int(time.time()))
+            pipe.delete(key, lease)
+            await pipe.execute()
+        except redis.WatchError:
+            return False
+    logger.info("Partial response recovered: uuid=%s, session_id=%s, chars=%s", uuid, session_id, len(content))
+    return True
+
+@timed(REDIS_CALL_SECONDS)
 async def get_history(uuid, session_id):
     """
     Function Task:
@@ -91,9 +417,180 @@ async def get_history(uuid, session_id):
     Returns:
         list: A list of message entries for the session.
     """
-    entries = await redis_client.lrange(session_key(uuid, session_id), 0, -1)
-    return [json.loads(e) for e in entries]
+    entries = await raw_redis_client.lrange(session_key(uuid, session_id), 0, -1)
+    if not entries and await rehydrate_session(uuid, session_id):
+        entries = await raw_redis_client.lrange(session_key(uuid, session_id), 0, -1)
+    return [decode_entry(e) for e in entries]
+
+@timed(REDIS_CALL_SECONDS)
+async def get_history_page(uuid, session_id, before=None, limit=HISTORY_PAGE_SIZE, decode=True):
+    """
+    Function Task:
+        Retrieves one page of a session's messages, newest page first, with a
+        single LRANGE over the requested index range.
+
+    Arguments:
+        uuid (str): The user's unique identifier.
+        session_id (str): The chat session's unique identifier.
+        before (int | None): Return the messages stored before this list index (None for the newest page).
+        limit (int): The maximum number of messages to return.
+        decode (bool): False returns each message as JSON text (legacy JSON entries are not parsed).
+
+    Returns:
+        tuple: The messages of the page in chronological order, the list index of the
+            first one (the `before` of the next, older page) and the session's message count.
+    """
+    key = session_key(uuid, session_id)
+    if before is None:
+        start, end = -limit, -1
+    else:
+        start, end = max(0, before - limit), before - 1
+    for _ in range(2):
+        async with raw_redis_client.pipeline(transaction=True) as pipe:
+            pipe.llen(key)
+            if end >= start or before is None:
+                pipe.lrange(key, start, end)
+            results = await pipe.execute()
+        total = results[0]
+        if total or not await rehydrate_session(uuid, session_id):
+            break
+    entries = results[1] if len(results) > 1 else []
+    first = max(0, total - len(entries)) if before is None else start
+    entries = [decode_entry(e) if decode else entry_json(e) for e in entries]
+    return entries, first, total
+
+async def iter_history(uuid, session_id, batch_size=500):
+    """
+    Function Task:
+        Yields a session's stored messages in chronological batches, so a long
+        history can be streamed without holding all of it in memory.
+
+    Arguments:
+        uuid (str): The user's unique identifier.
+        session_id (str): The chat session's unique identifier.
+        batch_size (int): The number of messages fetched per LRANGE.
+
+    Returns:
+        AsyncIterator[list]: Lists of the messages as JSON text.
+    """
+    key = session_key(uuid, session_id)
+    start = 0
+    while True:
+        entries = await raw_redis_client.lrange(key, start, start + batch_size - 1)
+        if not entries and start == 0 and await rehydrate_session(uuid, session_id):
+            entries = await raw_redis_client.lrange(key, start, start + batch_size - 1)
+        if entries:
+            yield [entry_json(e) for e in entries]
+        if len(entries) < batch_size:
+            return
+        start += batch_size
+
+@timed(REDIS_CALL_SECONDS)
+async def get_context_history(uuid, session_id, count):
+    """
+    Function Task:
+        Retrieves what is needed to build the model context in one round trip:
+        the system prompt, the newest `count` messages that are not yet folded
+        into the session summary, and the summary itself.
+
+    Arguments:
+        uuid (str): The user's unique identifier.
+        session_id (str): The chat session's unique identifier.
+        count (int): How many of the newest messages to read (0 reads just the system prompt).
 
+    Returns:
+        tuple: The message entries (oldest first, system prompt included once),
+            the summary text or None, and the total number of stored messages.
+    """
+    key = session_key(uuid, session_id)
+    count = max(0, count)
+    for _ in range(2):
+        pipe = raw_redis_client.pipeline(transaction=True)
+        pipe.llen(key)
+        pipe.lindex(key, 0)
+        # LRANGE -0 -1 would read the whole list
+        pipe.lrange(key, -(count or 1), -1)
+        pipe.hmget(session_summary_key(uuid, session_id), "summary", "upto")
+        length, first, tail, (summary, upto) = await pipe.execute()
+        if length or not await rehydrate_session(uuid, session_id):
+            break
+    if not count:
+        tail = []
+    start = max(0, length - count)
+    # Skip messages already covered by the summary
+    skip = max(0, int(upto or 0) - start)
+    tail = tail[skip:]
+    if (start > 0 or skip > 0) and first is not None:
+        tail = [first] + tail
+    if summary is not None:
+        summary = summary.decode("utf-8")
+    return [decode_entry(e) for e in tail], summary, length
+
+@timed(REDIS_CALL_SECONDS)
+async def get_summary(uuid, session_id):
+    """
+    Function Task:
+        Retrieves the rolling summary of a chat session.
+
+    Arguments:
+        uuid (str): The user's unique identifier.
+        session_id (str): The chat session's unique identifier.
+
+    Returns:
+        tuple: The summary text (or None) and the index of the first message it does not cover.
+    """
+    summary, upto = await redis_client.hmget(session_summary_key(uuid, session_id), "summary", "upto")
+    return summary, int(upto or 1)
+
+@timed(REDIS_CALL_SECONDS)
+async def save_summary(uuid, session_id, summary, previous_upto, upto):
+    """
+    Function Task:
+        Stores a new rolling summary, unless another worker has already advanced it.
+
+    Arguments:
+        uuid (str): The user's unique identifier.
+        session_id (str): The chat session's unique identifier.
+        summary (str): The new summary text.
+        previous_upto (int): The coverage of the summary this one was built from.
+        upto (int): The index of the first message the new summary does not cover.
+
+    Returns:
+        bool: True if the summary was stored, False if it was out of date.
+    """
+    key = session_summary_key(uuid, session_id)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        try:
+            await pipe.watch(key)
+            current = await pipe.hget(key, "upto")
+            if int(current or 1) != previous_upto:
+                return False
+            pipe.multi()
+            pipe.hset(key, mapping={"summary": summary, "upto": str(upto)})
+            await pipe.execute()
+            return True
+        except redis.WatchError:
+            return False
+
+@timed(REDIS_CALL_SECONDS)
+async def get_history_range(uuid, session_id, start, end):
+    """
+    Function Task:
+        Retrieves the messages of a session between two list positions.
+
+    Arguments:
+        uuid (str): The user's unique identifier.
+        session_id (str): The chat session's unique identifier.
+        start (int): The index of the first message to read.
+        end (int): The index after the last message to read.
+
+    Returns:
+        list: The message entries, oldest first.
+    """
+    entries = await raw_redis_client.lrange(session_key(uuid, session_id), start, end - 1)
+    return [decode_entry(e) for e in entries]
+
+@timed(REDIS_CALL_SECONDS)
 async def ensure_system_message(uuid, session_id):
     """
     Function Task:
@@ -106,9 +603,65 @@ async def ensure_system_message(uuid, session_id):
     Returns:
         None
     """
-    if await redis_client.llen(session_key(uuid, session_id)) == 0:
+    if await redis_client.llen(session_key(uuid, session_id)) == 0 and not await rehydrate_session(uuid, session_id):
         await append_history(uuid, session_id, "system", "You are a helpful assistant.")
 
+@timed(REDIS_CALL_SECONDS)
+async def get_sessions_page(uuid, cursor=None, limit=SESSIONS_PAGE_SIZE):
+    """
+    Function Task:
+        Retrieves one page of chat session metadata for a user, newest first,
+        using the per-user session index and a single pipelined metadata fetch.
+        Archived sessions stay in the index; their metadata is read from the archive.
+
+        The cursor is the last returned session's score and id, not an offset, so a
+        session updated between two page fetches (and moved to the front) does not
+        make later pages repeat or skip sessions.
+
+    Arguments:
+        uuid (str): The user's unique identifier.
+        cursor (str | None): The cursor returned with the previous page (None for the first page).
+        limit (int): The maximum number of sessions to return.
+
+    Returns:
+        tuple: A list of session metadata dictionaries and the cursor of the next
+            page, or None if there are no more sessions.
+    """
+    key = session_index_key(uuid)
+    max_score, after_id = "+inf", None
+    if cursor:
+        score, _, after_id = cursor.partition(":")
+        max_score = float(score)
+        if not math.isfinite(max_score):
+            # float() accepts nan and inf, which Redis rejects or never returns in a cursor
+            raise ValueError(f"Invalid cursor score: {score}")
+    # Sessions sharing the cursor's score come in descending id order; skip those up to the cursor's
+    page, offset = [], 0
+    while len(page) <= limit:
+        batch = await redis_client.zrevrangebyscore(key, max_score, "-inf", start=offset, num=limit + 1, withscores=True)
+        offset += len(batch)
+        page.extend((session_id, score) for session_id, score in batch
+                    if after_id is None or score < max_score or session_id < after_id)
+        if len(batch) < limit + 1:
+            break
+    has_more = len(page) > limit
+    page = page[:limit]
+    if not page:
+        return [], None
+    session_ids = [session_id for session_id, _ in page]
+    pipe = redis_client.pipeline(transaction=False)
+    for session_id in session_ids:
+        pipe.hgetall(session_meta_key(uuid, session_id))
+    metas = await pipe.execute()
+    missing = [session_id for session_id, meta in zip(session_ids, metas) if not meta]
+    if missing:
+        archived = await history_archive.get_metas(uuid, missing)
+        metas = [meta or archived.get(session_id) for session_id, meta in zip(session_ids, metas)]
+    sessions = [meta for meta in metas if meta]
+    last_id, last_score = page[-1]
+    next_cursor = f"{last_score:.17g}:{last_id}" if has_more else None
+    return sessions, next_cursor
+
 async def get_all_sessions(uuid):
     """
     Function Task:
@@ -120,12 +673,407 @@ async def get_all_sessions(uuid):
     Returns:
         list: A list of session metadata dictionaries, sorted by last updated.
     """
-    keys = await redis_client.keys(f"chatmeta:{uuid}:*")
-    sessions = []
-    for key in keys:
-        meta = await redis_client.hgetall(key)
-        if meta:
-            sessions.append(meta)
-    sessions.sort(key=lambda x: int(x.get("updated_at", "0")), reverse=True)
+    sessions, cursor = await get_sessions_page(uuid, None, SESSIONS_PAGE_SIZE)
+    while cursor is not None:
+        page, cursor = await get_sessions_page(uuid, cursor, SESSIONS_PAGE_SIZE)
+        sessions.extend(page)
     return sessions
 
+@timed(REDIS_CALL_SECONDS)
+async def rebuild_session_index(batch_size=500):
+    """
+    Function Task:
+        Builds the per-user session indexes from the existing chatmeta keys.
+        Uses SCAN instead of KEYS so the Redis server is never blocked, and
+        writes the index entries in pipelined batches.
+
+    Arguments:
+        batch_size (int): How many metadata keys to process per pipeline.
+
+    Returns:
+        int: The number of sessions indexed.
+    """
+    indexed = 0
+    keys = []
+    async for key in redis_client.scan_iter(match="chatmeta:*", count=batch_size):
+        keys.append(key)
+        if len(keys) >= batch_size:
+            indexed += await _index_meta_keys(keys)
+            keys = []
+    if keys:
+        indexed += await _index_meta_keys(keys)
+    await redis_client.set(SESSION_INDEX_MIGRATED_KEY, str(int(time.time())))
+    logger.info("Session index rebuilt: %s sessions indexed", indexed)
+    return indexed
+
+async def _index_meta_keys(keys):
+    """
+    Function Task:
+        Adds a batch of chatmeta keys to their owners' session indexes.
+
+    Arguments:
+        keys (list): The chatmeta keys to index.
+
+    Returns:
+        int: The number of sessions indexed.
+    """
+    pipe = redis_client.pipeline(transaction=False)
+    for key in keys:
+        pipe.hget(key, "updated_at")
+    updated = await pipe.execute()
+    pipe = redis_client.pipeline(transaction=False)
+    count = 0
+    for key, updated_at in zip(keys, updated):
+        _, uuid, session_id = key.split(":", 2)
+        pipe.zadd(session_index_key(uuid), {session_id: int(updated_at or 0)})
+        if HISTORY_ARCHIVE_ENABLED:
+            pipe.zadd(SESSION_ACTIVITY_KEY, {f"{uuid}:{session_id}": int(updated_at or 0)})
+        count += 1
+    await pipe.execute()
+    return count
+
+# Renames KEYS[1] to KEYS[2] if KEYS[1] is a string; a missing key means it was already migrated
+RENAME_LEGACY_MARKER_SCRIPT = """
+if redis.call('TYPE', KEYS[1]).ok == 'string' then
+    redis.call('RENAME', KEYS[1], KEYS[2])
+    return 1
+end
+return 0
+"""
+
+@timed(REDIS_CALL_SECONDS)
+async def ensure_session_index():
+    """
+    Function Task:
+        Builds the session indexes once, the first time a server starts against
+        a Redis database that predates them (or, with archiving enabled, that
+        predates the global activity index the archiver reads). With archiving
+        disabled the activity index is dropped, as it is no longer maintained.
+
+    Arguments:
+        None
+
+    Returns:
+        None
+    """
+    # Frees chatindex:migrated for a user whose uuid is "migrated". Checked and renamed in one script, so
+    # workers starting together do not fail on a key another one has just renamed
+    await redis_client.eval(RENAME_LEGACY_MARKER_SCRIPT, 2, LEGACY_SESSION_INDEX_MIGRATED_KEY, SESSION_INDEX_MIGRATED_KEY)
+    if not HISTORY_ARCHIVE_ENABLED:
+        # The activity index is not kept up to date without archiving; drop it so that enabling
+        # archiving later rebuilds it instead of trusting stale scores
+        await redis_client.unlink(SESSION_ACTIVITY_KEY)
+    if not await redis_client.exists(SESSION_INDEX_MIGRATED_KEY) or (
+            HISTORY_ARCHIVE_ENABLED and not await redis_client.exists(SESSION_ACTIVITY_KEY)):
+        await rebuild_session_index()
+
+async def migrate_history_encoding(batch_size=100, pause=0.01, max_retries=5):
+    """
+    Function Task:
+        Rewrites stored chat history entries in the configured HISTORY_ENCODING.
+        Runs in the background: keys are scanned in batches with a short pause
+        between them, and each list is rewritten under WATCH, so a message appended
+        meanwhile makes that list retry instead of being lost. Entries are rewritten
+        in place with LSET, so readers see old and new entries mixed but never missing.
+
+    Arguments:
+        batch_size (int): The number of keys scanned per SCAN call.
+        pause (float): Seconds to sleep after each batch of keys.
+        max_retries (int): Attempts per list before it is left for the next run.
+
+    Returns:
+        dict: The number of lists scanned, lists rewritten and entries rewritten.
+    """
+    counts = {"lists": 0, "rewritten_lists": 0, "rewritten_entries": 0}
+    scanned = 0
+    async for key in raw_redis_client.scan_iter(match="chat:*", count=batch_size, _type="list"):
+        counts["lists"] += 1
+        for _ in range(max_retries):
+            async with raw_redis_client.pipeline(transaction=True) as pipe:
+                try:
+                    await pipe.watch(key)
+                    entries = await pipe.lrange(key, 0, -1)
+                    stale = [(i, e) for i, e in enumerate(entries) if not is_current(e)]
+                    if not stale:
+                        break
+                    pipe.multi()
+                    for i, entry in stale:
+                        pipe.lset(key, i, encode_entry(decode_entry(entry)))
+                    await pipe.execute()
+                    counts["rewritten_lists"] += 1
+                    counts["rewritten_entries"] += len(stale)
+                    break
+                except redis.WatchError:
+                    continue
+        scanned += 1
+        if scanned % batch_size == 0:
+            await asyncio.sleep(pause)
+    await redis_client.set(HISTORY_ENCODING_MIGRATED_KEY, HISTORY_ENCODING)
+    logger.info("History encoding migrated to %s: %s", HISTORY_ENCODING, counts)
+    return counts
+
+async def ensure_history_encoding():
+    """
+    Function Task:
+        Migrates the stored history to the configured HISTORY_ENCODING once,
+        unless a previous run already finished for that encoding. A lock key
+        keeps several workers starting at once from all running the migration.
+
+    Arguments:
+        None
+
+    Returns:
+        None
+    """
+    if await redis_client.get(HISTORY_ENCODING_MIGRATED_KEY) == HISTORY_ENCODING:
+        return
+    if not await redis_client.set(HISTORY_ENCODING_LOCK_KEY, HISTORY_ENCODING, nx=True, ex=3600):
+        return
+    try:
+        await migrate_history_encoding()
+    except Exception as e:
+        logger.error("Error migrating history encoding: %s", e)
+    finally:
+        await redis_client.delete(HISTORY_ENCODING_LOCK_KEY)
+
+def _decode_hash(mapping):
+    """
+    Function Task:
+        Converts a hash read through the raw client to text keys and values.
+
+    Arguments:
+        mapping (dict): The hash with bytes keys and values.
+
+    Returns:
+        dict: The hash with str keys and values.
+    """
+    return {k.decode("utf-8"): v.decode("utf-8") for k, v in mapping.items()}
+
+@timed(REDIS_CALL_SECONDS)
+async def rehydrate_session(uuid, session_id):
+    """
+    Function Task:
+        Moves an archived session back into Redis. Called when a session is read
+        and found empty; only sessions still listed in the user's index can be
+        archived, so a new session costs one ZSCORE and no archive lookup.
+        The restore is a WATCHed MULTI on the history key, so two requests
+        rehydrating the same session at once never duplicate its messages.
+
+    Arguments:
+        uuid (str): The user's unique identifier.
+        session_id (str): The chat session's unique identifier.
+
+    Returns:
+        bool: True if the session is in Redis afterwards, False if it was not archived.
+    """
+    if await redis_client.zscore(session_index_key(uuid), session_id) is None:
+        return False
+    archived = await history_archive.get(uuid, session_id)
+    if archived is None or not archived["history"]:
+        return False
+    key = session_key(uuid, session_id)
+    # Entries archived before an encoding change come back in the current encoding
+    history = [e if is_current(e) else encode_entry(decode_entry(e)) for e in archived["history"]]
+    async with raw_redis_client.pipeline(transaction=True) as pipe:
+        try:
+            await pipe.watch(key)
+            if await pipe.exists(key):
+                return True
+            pipe.multi()
+            pipe.rpush(key, *history)
+            if archived["meta"]:
+                pipe.hset(session_meta_key(uuid, session_id), mapping=archived["meta"])
+            if archived["summary"]:
+                pipe.hset(session_summary_key(uuid, session_id), mapping=archived["summary"])
+            # Counts as activity, so the session is not archived again straight away
+            if HISTORY_ARCHIVE_ENABLED:
+                pipe.zadd(SESSION_ACTIVITY_KEY, {f"{uuid}:{session_id}": int(time.time())})
+            await pipe.execute()
+        except redis.WatchError:
+            # Restored by a concurrent request
+            return True
+    await history_archive.delete_many([(uuid, session_id)])
+    logger.info("Session rehydrated from archive: uuid=%s, session_id=%s, messages=%s", uuid, session_id, len(history))
+    return True
+
+async def _evict_if_unchanged(uuid, session_id, snapshot):
+    """
+    Function Task:
+        Deletes an archived session from Redis, unless it changed after it was read.
+        The keys are WATCHed while the snapshot is compared, so a message appended
+        between the comparison and the delete aborts the delete instead of being lost.
+
+    Arguments:
+        uuid (str): The user's unique identifier.
+        session_id (str): The chat session's unique identifier.
+        snapshot (dict): The session as written to the archive.
+
+    Returns:
+        bool: True if the session was evicted.
+    """
+    key = session_key(uuid, session_id)
+    meta_key = session_meta_key(uuid, session_id)
+    summary_key = session_summary_key(uuid, session_id)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        try:
+            await pipe.watch(key, meta_key, summary_key)
+            length = await pipe.llen(key)
+            updated_at = await pipe.hget(meta_key, "updated_at")
+            upto = await pipe.hget(summary_key, "upto")
+            if (length != len(snapshot["history"]) or updated_at != snapshot["meta"].get("updated_at")
+                    or upto != snapshot["summary"].get("upto")):
+                return False
+            pipe.multi()
+            pipe.delete(key, meta_key, summary_key)
+            pipe.zrem(SESSION_ACTIVITY_KEY, f"{uuid}:{session_id}")
+            await pipe.execute()
+            return True
+        except redis.WatchError:
+            return False
+
+async def archive_idle_sessions(idle_seconds=HISTORY_ARCHIVE_IDLE_DAYS * 86400, batch_size=HISTORY_ARCHIVE_BATCH, pause=0.01):
+    """
+    Function Task:
+        Moves sessions idle for longer than idle_seconds from Redis to the archive.
+        Sessions are taken from the idle end of the activity index in batches:
+        each batch is read with one pipeline and written to the archive in one
+        SQLite transaction (off the event loop), then every session is evicted
+        only if it is unchanged. A session's index entry is kept, so it still
+        appears in the user's session list.
+
+    Arguments:
+        idle_seconds (float): How long a session must have been idle.
+        batch_size (int): The number of sessions archived per batch.
+        pause (float): Seconds to sleep between batches.
+
+    Returns:
+        int: The number of sessions archived.
+    """
+    cutoff = int(time.time() - idle_seconds)
+    archived = 0
+    while True:
+        members = await redis_client.zrangebyscore(SESSION_ACTIVITY_KEY, "-inf", cutoff, start=0, num=batch_size)
+        if not members:
+            break
+        pairs = [member.split(":", 1) for member in members]
+        pipe = raw_redis_client.pipeline(transaction=False)
+        for uuid, session_id in pairs:
+            pipe.lrange(session_key(uuid, session_id), 0, -1)
+            pipe.hgetall(session_meta_key(uuid, session_id))
+            pipe.hgetall(session_summary_key(uuid, session_id))
+        results = await pipe.execute()
+        sessions = []
+        empty = []
+        for (uuid, session_id), i in zip(pairs, range(0, len(results), 3)):
+            history, meta, summary = results[i:i + 3]
+            if not history:
+                empty.append(f"{uuid}:{session_id}")
+                continue
+            sessions.append({"uuid": uuid, "session_id": session_id, "history": history,
+                             "meta": _decode_hash(meta), "summary": _decode_hash(summary)})
+        if empty:
+            await redis_client.zrem(SESSION_ACTIVITY_KEY, *empty)
+        if sessions:
+            await history_archive.put_many(sessions)
+        changed = []
+        evicted = 0
+        for session in sessions:
+            if await _evict_if_unchanged(session["uuid"], session["session_id"], session):
+                evicted += 1
+            else:
+                changed.append((session["uuid"], session["session_id"]))
+        if changed:
+            # Still in Redis and newer than the archived copy
+            await history_archive.delete_many(changed)
+        archived += evicted
+        if not evicted and not empty:
+            break
+        await asyncio.sleep(pause)
+    if archived:
+        logger.info("Idle sessions archived: %s", archived)
+    return archived
+
+async def run_history_archiver(interval=HISTORY_ARCHIVE_INTERVAL):
+    """
+    Function Task:
+        Archives idle sessions every interval seconds until cancelled. A lock key
+        that expires after one interval lets only one worker run each pass.
+
+    Arguments:
+        interval (int): Seconds between archiving passes.
+
+    Returns:
+        None
+    """
+    try:
+        while True:
+            try:
+                if await redis_client.set(HISTORY_ARCHIVE_LOCK_KEY, "1", nx=True, ex=max(1, interval)):
+                    await archive_idle_sessions()
+            except Exception as e:
+                logger.error("Error archiving idle sessions: %s", e)
+            await asyncio.sleep(interval)
+    finally:
+        await history_archive.close()
+
+@timed(REDIS_CALL_SECONDS)
+async def append_stream_frame(uuid, session_id, message, reset=False):
+    """
+    Function Task:
+        Records a generation frame in the session's stream so a reconnecting client can replay it.
+
+    Arguments:
+        uuid (str): The user's unique identifier.
+        session_id (str): The chat session's unique identifier.
+        message (dict): The frame sent to the client.
+        reset (bool): The frame is the first of a new generation: the frames of earlier
+            generations are deleted in the same transaction, so a replay only sees this one.
+
+    Returns:
+        str: The stream entry ID, used as the frame's sequence number.
+    """
+    key = stream_key(uuid, session_id)
+    pipe = redis_client.pipeline(transaction=reset)
+    if reset:
+        pipe.delete(key)
+    pipe.xadd(key, {"frame": json.dumps(message)}, maxlen=RESUME_STREAM_MAXLEN, approximate=True)
+    pipe.expire(key, RESUME_STREAM_TTL)
+    results = await pipe.execute()
+    return results[-2]
+
+@timed(REDIS_CALL_SECONDS)
+async def read_stream_frames(uuid, session_id, after_id=None, count=500):
+    """
+    Function Task:
+        Reads recorded generation frames that come after a given sequence number.
+
+    Arguments:
+        uuid (str): The user's unique identifier.
+        session_id (str): The chat session's unique identifier.
+        after_id (str | None): The last sequence number the client has seen, or None to read from the start.
+        count (int): The maximum number of frames to read.
+
+    Returns:
+        list: (sequence number, frame) tuples, oldest first.
+    """
+    start = f"({after_id}" if after_id else "-"
+    entries = await redis_client.xrange(stream_key(uuid, session_id), min=start, max="+", count=count)
+    return [(entry_id, {**json.loads(fields["frame"]), "seq": entry_id}) for entry_id, fields in entries]
+
+@timed(REDIS_CALL_SECONDS)
+async def generation_in_progress(uuid, session_id):
+    """
+    Function Task:
+        Checks whether the session's last recorded frame belongs to an unfinished generation.
+
+    Arguments:
+        uuid (str): The user's unique identifier.
+        session_id (str): The chat session's unique identifier.
+
+    Returns:
+        bool: True if frames were recorded and the last one is not a terminal frame.
+    """
+    entries = await redis_client.xrevrange(stream_key(uuid, session_id), count=1)
+    if not entries:
+        return False
+    return json.loads(entries[0][1]["frame"]).get("type") not in TERMINAL_FRAME_TYPES
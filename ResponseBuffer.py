@@ -0,0 +1,128 @@
+import asyncio
+import logging
+from uuid import uuid4
+from settings import settings
+from Redis import checkpoint_partial_response, commit_partial_response, discard_partial_response
+
+
+logger = logging.getLogger(__name__)
+
+
+# How often the text generated so far is written to Redis (0 = only when the response ends)
+RESPONSE_CHECKPOINT_MS = settings.response_checkpoint_ms
+
+
+class ResponseBuffer:
+    """Accumulates a streamed assistant response and persists it write-behind.
+
+    Chunks are collected in a list and joined once, instead of growing a string
+    chunk by chunk. While the response streams, a background task appends the
+    text generated since the previous checkpoint to the session's partial
+    response in Redis every `checkpoint_ms` milliseconds, so a crashed worker
+    loses at most that much output, and each character is written once however
+    long the response gets. The final message replaces the checkpoint atomically.
+
+    Checkpoints carry a token unique to this buffer. The first one replaces
+    whatever an earlier, unfinished generation left in the key (saving that text
+    to the history first), so two generations' output is never joined together.
+
+    Attributes:
+        uuid (str): The user's unique identifier.
+        session_id (str): The chat session's unique identifier.
+        checkpoint_ms (int): Milliseconds between checkpoints (0 disables them).
+        token (str): Identifies this generation's checkpoints.
+        checkpoints (int): How many checkpoints were written.
+    """
+
+    def __init__(self, uuid: str, session_id: str, checkpoint_ms: int = RESPONSE_CHECKPOINT_MS):
+        """Initialize an empty buffer for the session's next assistant message."""
+        self.uuid = uuid
+        self.session_id = session_id
+        self.checkpoint_ms = checkpoint_ms
+        # A live generation renews its lease every checkpoint; a partial outliving it is recovered
+        self.lease_ms = max(10000, 5 * checkpoint_ms)
+        self.token = uuid4().hex
+        self.checkpoints = 0
+        self._parts = []
+        self._written = 0
+        self._task: asyncio.Task | None = None
+        self._committed = False
+        self._stopping = asyncio.Event()
+
+    def start(self):
+        """Start checkpointing in the background. Call when the model starts streaming."""
+        if self.checkpoint_ms > 0 and self._task is None:
+            self._task = asyncio.create_task(self._checkpoint_loop())
+
+    def append(self, chunk: str):
+        """Add a chunk of model output."""
+        if chunk:
+            self._parts.append(chunk)
+
+    def text(self) -> str:
+        """Return the response so far."""
+        return "".join(self._parts)
+
+    async def commit(self) -> str:
+        """Stop checkpointing and save the response as an assistant message, replacing the checkpoint.
+
+        Returns:
+            str: The full response (nothing is saved if it is blank).
+        """
+        await self._stop()
+        text = self.text()
+        if self._committed:
+            return text
+        # Set first: if the write is interrupted, the checkpoint it would have replaced is recovered instead
+        self._committed = True
+        await commit_partial_response(self.uuid, self.session_id, self.token, text, checkpointed=self.checkpoints > 0)
+        return text
+
+    async def discard(self):
+        """Stop checkpointing and delete the checkpoint without saving the response."""
+        if await self._stop():
+            await discard_partial_response(self.uuid, self.session_id, self.token)
+
+    async def checkpoint(self):
+        """Append the text generated since the previous checkpoint to the partial response in Redis."""
+        end = len(self._parts)
+        delta = "".join(self._parts[self._written:end])
+        try:
+            written = await checkpoint_partial_response(self.uuid, self.session_id, self.token, delta, self.lease_ms,
+                                                        first=self.checkpoints == 0)
+        except Exception as e:
+            # The delta is retried with the next checkpoint
+            logger.warning("Response checkpoint failed: session_id=%s: %s", self.session_id, e)
+            return
+        if not written:
+            # A newer generation saved this one's checkpoint and took the session over
+            logger.info("Response checkpoint taken over, checkpointing stopped: session_id=%s", self.session_id)
+            self._stopping.set()
+            return
+        self._written = end
+        self.checkpoints += 1
+
+    async def _checkpoint_loop(self):
+        """Checkpoint every checkpoint_ms until _stop is called."""
+        await self.checkpoint()
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.checkpoint_ms / 1000)
+            except asyncio.TimeoutError:
+                await self.checkpoint()
+
+    async def _stop(self) -> bool:
+        """Stop the checkpoint loop, waiting for a checkpoint in progress, so nothing is written after the final message.
+
+        Returns:
+            bool: True if checkpointing had been started.
+        """
+        task, self._task = self._task, None
+        if task is None:
+            return False
+        self._stopping.set()
+        try:
+            await task
+        except Exception as e:
+            logger.warning("Response checkpoint loop failed: session_id=%s: %s", self.session_id, e)
+        return True
@@ -1,30 +1,55 @@
-from dotenv import load_dotenv
-import os
+from settings import settings
+import asyncio
+import json
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
 from models import User
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from Schemas import TokenData  
-from database import get_db    
+from database import get_async_db
+from cache import TTLCache
+from metrics import LOGIN_SECONDS
 import logging                 
 
 
 # Logging setup 
 logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
-SECRET_KEY = os.getenv("SECRET_KEY")
-ALGORITHM = os.getenv("ALGORITHM")
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
+SECRET_KEY = settings.secret_key
+ALGORITHM = settings.algorithm
+ACCESS_TOKEN_EXPIRE_MINUTES = settings.access_token_expire_minutes
+# Size and kind ("thread" or "process") of the pool that runs bcrypt checks
+AUTH_POOL_SIZE = settings.auth_pool_size
+AUTH_POOL_KIND = settings.auth_pool_kind
+AUTH_CACHE_SIZE = settings.auth_cache_size
+AUTH_CACHE_TTL = settings.auth_cache_ttl
+# Pub/sub channel on which user changes are announced, so every worker drops its cached copies
+AUTH_INVALIDATION_CHANNEL = "auth:invalidate"
 
 # --- Auth and User Management ---
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# jose and passlib are imported on first use, keeping them off the server's import path
+_pwd_context = None
 oauth_2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Pool for bcrypt checks, created on first use
+_verify_executor: Executor | None = None
+
+# Decoded tokens (token -> username, never outliving the token's exp) and loaded users (username -> User)
+_token_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+_user_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+
+
+def _get_pwd_context():
+    """Return the bcrypt password context, creating it on first use (also in pool worker processes)."""
+    global _pwd_context
+    if _pwd_context is None:
+        from passlib.context import CryptContext
+        _pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    return _pwd_context
 
 def verify_password(plain_password, hashed_password):
     """
@@ -39,40 +64,98 @@ def verify_password(plain_password, hashed_password):
         bool: True if the passwords match, False otherwise.
     """
     # logging.INFO(f'{plain_password}, {hashed_password}')
-    return pwd_context.verify(plain_password, hashed_password)
+    return _get_pwd_context().verify(plain_password, hashed_password)
 
-def get_user(db: Session, username: str):
+async def get_user(db: AsyncSession, username: str):
     """
     Function Task:
         Looks up a user in the database using their username.
 
     Arguments:
-        db (Session): The database session to use for the query.
+        db (AsyncSession): The database session to use for the query.
         username (str): The username to search for.
 
     Returns:
         User or None: The user object if found, otherwise None.
     """
-    return db.query(User).filter(User.username == username).first()
+    result = await db.execute(select(User).where(User.username == username))
+    return result.scalars().first()
 
-def authenticate_user(db: Session, username: str, password: str):
+async def authenticate_user(db: AsyncSession, username: str, password: str):
     """
     Function Task:
         Checks if the username and password are correct and returns the user if they are.
+        The bcrypt check runs in the authentication pool, so active WebSocket
+        streams keep flowing during login bursts.
 
     Arguments:
-        db (Session): The database session to use for the query.
+        db (AsyncSession): The database session to use for the query.
         username (str): The username entered by the user.
         password (str): The plain password entered by the user.
 
     Returns:
         User or None: The user object if authentication is successful, otherwise None.
     """
-    user = get_user(db, username)
-    if not user or not verify_password(password, user.hashed_password):
+    started = time.perf_counter()
+    user = await get_user(db, username)
+    if not user or user.disabled or not await verify_password_async(password, user.hashed_password):
+        LOGIN_SECONDS.labels("failure").observe(time.perf_counter() - started)
         return None
+    LOGIN_SECONDS.labels("success").observe(time.perf_counter() - started)
     return user
 
+def _get_verify_executor():
+    """
+    Function Task:
+        Returns the pool used for password checks, creating it on first use.
+        In "process" mode bcrypt runs in a process pool so logins scale across all cores.
+
+    Arguments:
+        None
+
+    Returns:
+        Executor: The password verification executor.
+    """
+    global _verify_executor
+    if _verify_executor is None:
+        if AUTH_POOL_KIND == "process":
+            _verify_executor = ProcessPoolExecutor(max_workers=AUTH_POOL_SIZE)
+        else:
+            _verify_executor = ThreadPoolExecutor(max_workers=AUTH_POOL_SIZE, thread_name_prefix="auth")
+    return _verify_executor
+
+def shutdown_auth_executors():
+    """
+    Function Task:
+        Shuts down the authentication pool.
+
+    Arguments:
+        None
+
+    Returns:
+        None
+    """
+    global _verify_executor
+    if _verify_executor is not None:
+        _verify_executor.shutdown(wait=False, cancel_futures=True)
+    _verify_executor = None
+
+async def verify_password_async(plain_password, hashed_password):
+    """
+    Function Task:
+        Checks a password like verify_password, but in the authentication pool so
+        the bcrypt work does not block the event loop.
+
+    Arguments:
+        plain_password (str): The password entered by the user.
+        hashed_password (str): The hashed password from the database.
+
+    Returns:
+        bool: True if the passwords match, False otherwise.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_verify_executor(), verify_password, plain_password, hashed_password)
+
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     """
     Function Task:
@@ -85,19 +168,22 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     Returns:
         str: The encoded JWT token as a string.
     """
+    from jose import jwt
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=15))
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-async def get_current_user(token: str = Depends(oauth_2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth_2_scheme), db: AsyncSession = Depends(get_async_db)):
     """
     Function Task:
         Decodes the JWT token from the request and returns the current user from the database.
+        Decoded tokens and users are cached in-process, so repeated calls skip the
+        JWT decode and the database query until the token expires or the user is invalidated.
 
     Arguments:
         token (str): The JWT token sent by the client.
-        db (Session): The database session to use for the query.
+        db (AsyncSession): The database session to use for the query.
 
     Returns:
         User: The user object for the currently authenticated user.
@@ -110,18 +196,152 @@ async def get_current_user(token: str = Depends(oauth_2_scheme), db: Session = D
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            logger.warning("JWT decode failed: username missing")
+    username = _token_cache.get(token)
+    if username is None:
+        from jose import JWTError, jwt
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            username: str = payload.get("sub")
+            if username is None:
+                logger.warning("JWT decode failed: username missing")
+                raise credentials_exception
+        except JWTError:
+            logger.warning("JWTError during token validation")
             raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
-        logger.warning("JWTError during token validation")
-        raise credentials_exception
-    user = get_user(db, username=token_data.username)
+        _token_cache.set(token, username, ttl=payload["exp"] - time.time() if "exp" in payload else None)
+    token_data = TokenData(username=username)
+    user = _user_cache.get(token_data.username)
     if user is None:
-        logger.warning(f"User not found: {token_data.username}")
+        user = await get_user(db, username=token_data.username)
+        if user is None:
+            logger.warning("User not found: %s", token_data.username)
+            raise credentials_exception
+        _user_cache.set(user.username, user)
+    if user.disabled:
+        logger.warning("Disabled user rejected: %s", user.username)
         raise credentials_exception
-    return user
\ No newline at end of file
+    return user
+
+def invalidate_user(username: str):
+    """
+    Function Task:
+        Drops a user and every cached token of that user from this worker's authentication caches.
+        To reach every worker, use publish_auth_invalidation.
+
+    Arguments:
+        username (str): The username of the user that changed.
+
+    Returns:
+        None
+    """
+    invalidate_users([username])
+
+def invalidate_users(usernames):
+    """
+    Function Task:
+        Drops several users and their cached tokens from this worker's authentication caches,
+        scanning the token cache once.
+
+    Arguments:
+        usernames (Iterable[str]): The usernames of the users that changed.
+
+    Returns:
+        None
+    """
+    usernames = set(usernames)
+    for username in usernames:
+        _user_cache.pop(username)
+    _token_cache.pop_matching(lambda token, cached_username: cached_username in usernames)
+    logger.info("Auth cache invalidated for %s user(s)", len(usernames))
+
+def clear_auth_cache():
+    """
+    Function Task:
+        Empties the token and user caches, e.g. after a bulk change to the users table.
+
+    Arguments:
+        None
+
+    Returns:
+        None
+    """
+    _token_cache.clear()
+    _user_cache.clear()
+
+def publish_auth_invalidation(usernames=None):
+    """
+    Function Task:
+        Announces that users were disabled, deleted or changed, so every server worker
+        drops them from its authentication caches. Call it after the change is committed;
+        it is synchronous so scripts such as seed_users.py and import_users.py can use it.
+        If Redis cannot be reached, the change takes effect within AUTH_CACHE_TTL.
+
+    Arguments:
+        usernames (list | None): The changed usernames, or None to clear the caches entirely.
+
+    Returns:
+        None
+    """
+    import redis
+    message = json.dumps({"all": True} if usernames is None else {"usernames": list(usernames)})
+    try:
+        client = redis.Redis.from_url(settings.redis_url)
+        try:
+            client.publish(AUTH_INVALIDATION_CHANNEL, message)
+        finally:
+            client.close()
+    except Exception as e:
+        logger.warning("Could not publish auth cache invalidation: %s", e)
+
+async def listen_for_auth_invalidations(redis_client, retry_seconds: float = 1):
+    """
+    Function Task:
+        Drops the users announced by publish_auth_invalidation from this worker's caches.
+        Runs until cancelled. Announcements published while the subscription is down are
+        lost, so the caches are cleared each time it is (re)established.
+
+    Arguments:
+        redis_client: The Redis client to subscribe with.
+        retry_seconds (float): The pause before resubscribing after an error.
+
+    Returns:
+        None
+    """
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(AUTH_INVALIDATION_CHANNEL)
+            clear_auth_cache()
+            async for item in pubsub.listen():
+                if item.get("type") != "message":
+                    continue
+                try:
+                    payload = json.loads(item["data"])
+                except ValueError:
+                    logger.warning("Ignoring invalid auth invalidation message")
+                    continue
+                if payload.get("all"):
+                    clear_auth_cache()
+                    logger.info("Auth cache cleared")
+                else:
+                    invalidate_users(payload.get("usernames") or [])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Auth invalidation subscription failed, retrying: %s", e)
+            await asyncio.sleep(retry_seconds)
+        finally:
+            await pubsub.aclose()
+
+def auth_cache_stats():
+    """
+    Function Task:
+        Reports the size and hit/miss counters of the token and user caches.
+
+    Arguments:
+        None
+
+    Returns:
+        dict: The statistics of both caches.
+    """
+    return {"tokens": _token_cache.stats(), "users": _user_cache.stats()}
\ No newline at end of file
@@ -0,0 +1,98 @@
+"""
+Benchmark: Ollama backend routing and failover.
+
+Starts --backends stub Ollama servers (see benchmarks/stub_ollama.py) plus --dead
+backends that refuse connections, then streams --requests generations from
+--sessions sessions through a BackendPool for each routing strategy. Reports how
+requests were spread, how many failed, and how long the run took; dead backends
+should be ejected after OLLAMA_EJECT_FAILURES connect errors and receive no more traffic.
+
+Usage (from the project root):
+    python -m benchmarks.backend_balancing --backends 3 --dead 1 --requests 200
+"""
+import argparse
+import asyncio
+import json
+import socket
+import time
+import aiohttp
+
+from ollama_backends import BackendPool
+from benchmarks.stub_ollama import start_stub
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_strategy(strategy, urls, args):
+    pool = BackendPool(urls, strategy=strategy, eject_failures=args.eject_failures, eject_seconds=60)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    errors = 0
+    sessions_per_backend = {}
+
+    async def one(i, http):
+        nonlocal errors
+        session_id = f"session-{i % args.sessions}"
+        payload = {"model": "stub", "messages": [{"role": "user", "content": "hi"}], "stream": True}
+        async with semaphore:
+            try:
+                async with pool.post(http, session_id, payload) as resp:
+                    async for _ in resp.content:
+                        pass
+                    sessions_per_backend.setdefault(str(resp.url), set()).add(session_id)
+            except Exception:
+                errors += 1
+
+    start = time.perf_counter()
+    async with aiohttp.ClientSession() as http:
+        await asyncio.gather(*(one(i, http) for i in range(args.requests)))
+    elapsed = time.perf_counter() - start
+    backends = pool.stats()["backends"]
+    for backend in backends:
+        backend["sessions"] = len(sessions_per_backend.get(backend["url"], ()))
+    return {"strategy": strategy, "seconds": round(elapsed, 2), "errors": errors, "backends": backends}
+
+
+async def run(args):
+    ports = [free_port() for _ in range(args.backends)]
+    runners = [await start_stub(port, tokens=args.tokens, tokens_per_sec=args.tokens_per_sec, first_token_ms=20)
+               for port in ports]
+    urls = [f"http://127.0.0.1:{port}/api/chat" for port in ports]
+    urls += [f"http://127.0.0.1:{free_port()}/api/chat" for _ in range(args.dead)]
+    try:
+        return [await run_strategy(strategy, urls, args) for strategy in ("least_outstanding", "session_affinity")]
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", type=int, default=3)
+    parser.add_argument("--dead", type=int, default=1, help="backends that refuse connections")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--sessions", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--tokens", type=int, default=20)
+    parser.add_argument("--tokens-per-sec", type=float, default=200)
+    parser.add_argument("--eject-failures", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.requests} requests from {args.sessions} sessions, {args.backends} live + {args.dead} dead backends")
+    for r in results:
+        print(f"{r['strategy']}: {r['seconds']} s, {r['errors']} errors")
+        for b in r["backends"]:
+            print(f"    {b['url']}: {b['requests_total']} requests, {b['failures_total']} failures, "
+                  f"{b['sessions']} sessions, available={b['available']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark: storage size and cost of the chat history encodings.
+
+Builds a synthetic conversation (short user questions, assistant answers of
+varying length, drawn from README.md text) and reports, per encoding:
+    bytes/message   average stored size of one list entry
+    encode_us       microseconds to serialize one entry
+    decode_us       microseconds to parse one entry
+
+Encodings:
+    json            the legacy format (json.dumps of the entry dict)
+    msgpack         version byte + msgpack [role code, content, timestamp], zstd for
+                    entries of HISTORY_COMPRESS_MIN_BYTES or more
+
+Usage (from the project root):
+    python -m benchmarks.history_encoding --messages 5000
+    HISTORY_COMPRESS_MIN_BYTES=256 python -m benchmarks.history_encoding --json
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+from history_codec import HISTORY_COMPRESS_MIN_BYTES, decode_entry, encode_entry
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def conversation(count, seed=0):
+    with open(os.path.join(ROOT, "README.md"), encoding="utf-8") as f:
+        words = f.read().split()
+    rng = random.Random(seed)
+
+    def text(n):
+        start = rng.randrange(0, max(1, len(words) - n))
+        return " ".join(words[start:start + n])
+
+    messages = [{"role": "system", "content": "You are a helpful assistant.", "timestamp": 1700000000}]
+    for i in range(1, count):
+        role = "user" if i % 2 else "assistant"
+        length = rng.randint(5, 40) if role == "user" else rng.choice([rng.randint(20, 80), rng.randint(150, 600)])
+        messages.append({"role": role, "content": text(length), "timestamp": 1700000000 + i})
+    return messages
+
+
+def measure(messages, encoding, repeat):
+    encoded = [encode_entry(m, encoding) for m in messages]
+    sizes = [len(e.encode("utf-8")) if isinstance(e, str) else len(e) for e in encoded]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for m in messages:
+            encode_entry(m, encoding)
+    encode_s = (time.perf_counter() - start) / (repeat * len(messages))
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for e in encoded:
+            decode_entry(e)
+    decode_s = (time.perf_counter() - start) / (repeat * len(messages))
+    assert [decode_entry(e) for e in encoded] == messages
+    compressed = sum(1 for e in encoded if isinstance(e, bytes) and e[:1] == b"\x02")
+    return {
+        "encoding": encoding,
+        "bytes_per_message": round(sum(sizes) / len(sizes), 1),
+        "total_bytes": sum(sizes),
+        "encode_us": round(encode_s * 1e6, 2),
+        "decode_us": round(decode_s * 1e6, 2),
+        "compressed_entries": compressed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    messages = conversation(args.messages)
+    results = [measure(messages, encoding, args.repeat) for encoding in ("json", "msgpack")]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    baseline = results[0]["total_bytes"]
+    print(f"{args.messages} messages, zstd from {HISTORY_COMPRESS_MIN_BYTES} bytes")
+    for r in results:
+        print(f"{r['encoding']:>8}: {r['bytes_per_message']:>8} bytes/message ({r['total_bytes'] / baseline:.0%})  "
+              f"encode {r['encode_us']} us  decode {r['decode_us']} us  compressed {r['compressed_entries']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Benchmark: how long the server takes to import and to become ready.
+
+Measures:
+    import          `python -X importtime -c "import server"` in a fresh interpreter,
+                    repeated --runs times: the median total, and from the median run
+                    the packages that took longest (the self time of every module
+                    summed per top-level package, e.g. sqlalchemy or APIRouter)
+    ready           seconds from starting uvicorn to the first 200 from /ready, and
+                    the startup time the server reports there (with an in-process
+                    fakeredis TCP server, unless --redis-url is given)
+
+Nothing is seeded and no Ollama backend is contacted; a temporary SQLite database
+and log file are used.
+
+Usage (from the project root):
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --runs 10 --top 15 --json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from benchmarks.loadtest import ROOT, free_port, git_commit, start_fake_redis
+
+
+def server_env(workdir, redis_url):
+    return {
+        **os.environ,
+        "REDIS_URL": redis_url,
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'import_time.db')}",
+        "LOG_FILE": os.path.join(workdir, "server.log"),
+        "SECRET_KEY": os.environ.get("SECRET_KEY", "import-time-secret"),
+        "MODEL_NAME": os.environ.get("MODEL_NAME", "stub"),
+        "SEED_DEMO_USERS": "false",
+    }
+
+
+def parse_importtime(stderr):
+    """Return the microseconds spent per top-level package in a -X importtime report, and the total."""
+    packages, total = {}, 0
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except ValueError:
+            continue  # the header line
+        name = fields[2]
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+        # Nested imports are indented by two spaces per level; the outermost ones add up to the total
+        if not name[1:].startswith(" "):
+            total += cumulative_us
+    return packages, total
+
+
+def measure_import(env, runs):
+    results = []
+    for _ in range(runs):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import server"],
+                              cwd=ROOT, env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"import server failed:\n{proc.stderr[-2000:]}")
+        results.append(parse_importtime(proc.stderr))
+    results.sort(key=lambda result: result[1])
+    return results[len(results) // 2], [total for _, total in results]
+
+
+def measure_ready(env, timeout=60):
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {process.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/ready", timeout=1) as resp:
+                    body = json.load(resp)
+                return {"seconds_to_ready": round(time.perf_counter() - started, 3),
+                        "startup_seconds": body.get("startup_seconds")}
+            except (urllib.error.URLError, ConnectionError, TimeoutError):
+                time.sleep(0.02)
+        raise RuntimeError("Server did not become ready in time")
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="import measurements (the median is reported)")
+    parser.add_argument("--top", type=int, default=10, help="slowest packages to list")
+    parser.add_argument("--redis-url", help="use this Redis instead of an in-process fakeredis server")
+    parser.add_argument("--skip-ready", action="store_true", help="only measure the import")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="import-time-")
+    redis_url = args.redis_url
+    if not redis_url:
+        redis_port = free_port()
+        start_fake_redis(redis_port)
+        redis_url = f"redis://127.0.0.1:{redis_port}/0"
+    env = server_env(workdir, redis_url)
+
+    (packages, total), totals = measure_import(env, args.runs)
+    slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]
+    report = {
+        "commit": git_commit(),
+        "import_ms": round(total / 1000, 1),
+        "import_ms_runs": [round(t / 1000, 1) for t in totals],
+        "slowest_packages": [{"package": name, "ms": round(us / 1000, 1)} for name, us in slowest],
+    }
+    if not args.skip_ready:
+        report.update(measure_ready(env))
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"import server: {report['import_ms']} ms (median of {args.runs}: {report['import_ms_runs']})")
+    for item in report["slowest_packages"]:
+        print(f"  {item['ms']:>8} ms  {item['package']}")
+    if not args.skip_ready:
+        print(f"ready after {report['seconds_to_ready']} s (startup {report['startup_seconds']} s)")
+
+
+if __name__ == "__main__":
+    main()
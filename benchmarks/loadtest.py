@@ -0,0 +1,300 @@
+"""
+Load test: the whole service under N concurrent users.
+
+Starts, in this order:
+    - an in-process fakeredis TCP server (or uses --redis-url, e.g. a local Redis)
+    - stub Ollama servers streaming NDJSON at a configurable rate (benchmarks/stub_ollama.py)
+    - uvicorn serving server:app in a subprocess, with a temporary SQLite user database and log file
+
+Then every simulated user logs in through /token, opens /api/chat, sends --messages
+messages (stopping --stop-ratio of the generations part-way), and lists /history_sessions.
+
+Reported (as JSON, so runs can be compared across commits):
+    time-to-first-token and per-chunk latency percentiles (client side)
+    generations/s and chunks/s over the chat phase
+    login and /history_sessions latency percentiles
+    server RSS growth per open WebSocket (Linux only)
+
+Usage (from the project root):
+    python -m benchmarks.loadtest --users 100 --messages 3 --output loadtest.json
+    python -m benchmarks.loadtest --users 200 --env STREAM_COALESCE_MS=20 --env OLLAMA_MAX_CONCURRENCY=16
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import aiohttp
+
+from benchmarks.stub_ollama import start_stub
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = "loadtest-password"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+    pick = lambda pct: values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+    return {
+        "count": len(values),
+        "p50_ms": round(pick(50) * 1000, 2),
+        "p95_ms": round(pick(95) * 1000, 2),
+        "p99_ms": round(pick(99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2),
+    }
+
+
+def rss_bytes(pid):
+    """Resident memory of a process, read from /proc; None where that is not available."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def start_fake_redis(port):
+    from fakeredis import TcpFakeServer
+    server = TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def create_users(database_url, count):
+    """Create the load test users; bcrypt runs once and the hash is shared."""
+    from passlib.context import CryptContext
+    from sqlalchemy import create_engine, delete
+    from sqlalchemy.orm import Session
+    from models import Base, User
+
+    hashed = CryptContext(schemes=["bcrypt"], deprecated="auto").hash(PASSWORD)
+    engine = create_engine(database_url)
+    Base.metadata.create_all(engine)
+    with Session(engine) as db:
+        db.execute(delete(User).where(User.username.like("loadtest-%")))
+        db.add_all(User(username=f"loadtest-{i}", full_name=f"Load Test {i}", email=f"loadtest-{i}@example.com",
+                        hashed_password=hashed, disabled=False, uuid=f"loadtest-uuid-{i}") for i in range(count))
+        db.commit()
+    engine.dispose()
+
+
+async def wait_ready(http, base_url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            async with http.get(f"{base_url}/ready") as resp:
+                if resp.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Server did not start in time")
+
+
+class Stats:
+    def __init__(self):
+        self.login = []
+        self.ttft = []
+        self.chunk_gaps = []
+        self.history = []
+        self.completed = 0
+        self.stopped = 0
+        self.queued_frames = 0
+        self.chunks = 0
+        self.errors = []
+
+
+async def run_user(i, args, http, base_url, ws_url, stats, connected, chat_start):
+    username = f"loadtest-{i}"
+    start = time.perf_counter()
+    async with http.post(f"{base_url}/token", data={"username": username, "password": PASSWORD}) as resp:
+        body = await resp.json()
+    stats.login.append(time.perf_counter() - start)
+    if resp.status != 200:
+        stats.errors.append(f"login {resp.status}: {body}")
+        await connected.wait()
+        return
+    uuid = body["user_uuid"]
+    async with http.ws_connect(f"{ws_url}/api/chat?uuid={uuid}", heartbeat=None, max_msg_size=0) as ws:
+        await ws.receive_json()  # session_id frame
+        await connected.wait()
+        await chat_start.wait()
+        rng = random.Random(i)
+        for n in range(args.messages):
+            stop_after = rng.randint(1, max(1, args.tokens // 2)) if rng.random() < args.stop_ratio else None
+            await ws.send_json({"type": "user_message", "content": f"Message {n} from {username}"})
+            sent = time.perf_counter()
+            last = None
+            chunks = 0
+            stop_sent = False
+            while True:
+                frame = await ws.receive_json(timeout=args.timeout)
+                kind = frame.get("type")
+                now = time.perf_counter()
+                if kind == "response_chunk":
+                    if last is None:
+                        stats.ttft.append(now - sent)
+                    else:
+                        stats.chunk_gaps.append(now - last)
+                    last = now
+                    chunks += 1
+                    stats.chunks += 1
+                    if stop_after is not None and not stop_sent and chunks >= stop_after:
+                        await ws.send_json({"type": "stop_generation"})
+                        stop_sent = True
+                elif kind == "queued":
+                    stats.queued_frames += 1
+                elif kind == "response_end":
+                    stats.completed += 1
+                    break
+                elif kind == "stopped":
+                    # A stop is confirmed by the generation and by the handler; stale confirmations are skipped
+                    if stop_sent:
+                        stats.stopped += 1
+                        break
+                elif kind == "error":
+                    stats.errors.append(frame.get("content"))
+                    break
+        start = time.perf_counter()
+        async with http.get(f"{base_url}/history_sessions", params={"uuid": uuid}) as resp:
+            await resp.read()
+        stats.history.append(time.perf_counter() - start)
+
+
+async def run(args):
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    redis_url = args.redis_url
+    if not redis_url:
+        redis_port = free_port()
+        start_fake_redis(redis_port)
+        redis_url = f"redis://127.0.0.1:{redis_port}/0"
+    stub_ports = [free_port() for _ in range(args.backends)]
+    stubs = [await start_stub(port, tokens=args.tokens, tokens_per_sec=args.tokens_per_sec, first_token_ms=args.first_token_ms)
+             for port in stub_ports]
+    port = free_port()
+    database_url = f"sqlite:///{os.path.join(workdir, 'loadtest.db')}"
+    env = {
+        **os.environ,
+        "REDIS_URL": redis_url,
+        "OLLAMA_URLS": ",".join(f"http://127.0.0.1:{p}/api/chat" for p in stub_ports),
+        "MODEL_NAME": "stub",
+        "DATABASE_URL": database_url,
+        "LOG_FILE": os.path.join(workdir, "server.log"),
+        "SECRET_KEY": os.environ.get("SECRET_KEY", "loadtest-secret"),
+        "ALGORITHM": os.environ.get("ALGORITHM", "HS256"),
+        "ACCESS_TOKEN_EXPIRE_MINUTES": os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", "30"),
+        "SEED_DEMO_USERS": "false",
+    }
+    env.update(dict(item.split("=", 1) for item in args.env))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    ws_url = f"ws://127.0.0.1:{port}"
+    stats = Stats()
+    try:
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(connector=connector) as http:
+            await wait_ready(http, base_url, process)
+            # Created once /ready reports that startup has created the user table
+            await asyncio.to_thread(create_users, database_url, args.users)
+            rss_idle = rss_bytes(process.pid)
+            connected = asyncio.Event()
+            chat_start = asyncio.Event()
+            users = [asyncio.create_task(run_user(i, args, http, base_url, ws_url, stats, connected, chat_start))
+                     for i in range(args.users)]
+            # Every user holds its WebSocket open before the chat phase starts
+            while len(stats.login) < args.users and not any(u.done() for u in users):
+                await asyncio.sleep(0.05)
+            await asyncio.sleep(0.5)
+            rss_connected = rss_bytes(process.pid)
+            connected.set()
+            chat_started = time.perf_counter()
+            chat_start.set()
+            results = await asyncio.gather(*users, return_exceptions=True)
+            chat_seconds = time.perf_counter() - chat_started
+            stats.errors.extend(repr(r) for r in results if isinstance(r, BaseException))
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        for stub in stubs:
+            await stub.cleanup()
+
+    per_connection = None
+    if rss_idle is not None and rss_connected is not None:
+        per_connection = round((rss_connected - rss_idle) / max(1, args.users))
+    return {
+        "commit": git_commit(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "json")},
+        "chat_seconds": round(chat_seconds, 3),
+        "generations_per_sec": round((stats.completed + stats.stopped) / chat_seconds, 2),
+        "chunks_per_sec": round(stats.chunks / chat_seconds, 1),
+        "completed": stats.completed,
+        "stopped": stats.stopped,
+        "queued_frames": stats.queued_frames,
+        "errors": len(stats.errors),
+        "error_samples": stats.errors[:5],
+        "ttft": percentiles(stats.ttft),
+        "chunk_latency": percentiles(stats.chunk_gaps),
+        "login": percentiles(stats.login),
+        "history_sessions": percentiles(stats.history),
+        "server_rss_idle_bytes": rss_idle,
+        "server_rss_connected_bytes": rss_connected,
+        "rss_bytes_per_connection": per_connection,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=3, help="messages per user")
+    parser.add_argument("--stop-ratio", type=float, default=0.2, help="fraction of generations stopped part-way")
+    parser.add_argument("--backends", type=int, default=1, help="stub Ollama servers")
+    parser.add_argument("--tokens", type=int, default=50, help="tokens per stub response")
+    parser.add_argument("--tokens-per-sec", type=float, default=100)
+    parser.add_argument("--first-token-ms", type=float, default=50)
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for any frame")
+    parser.add_argument("--redis-url", help="use this Redis instead of an in-process fakeredis")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra server environment (repeatable)")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
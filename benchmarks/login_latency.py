@@ -0,0 +1,107 @@
+"""
+Benchmark: token-stream latency while logins are being processed.
+
+Runs simulated token streams (one frame every --tick-ms per stream) on the event
+loop while bursts of concurrent logins check bcrypt passwords. Every tick records
+how late it fired; a blocked event loop shows up as large p95/p99 lateness.
+
+Modes:
+    inline   bcrypt runs on the event loop (the old /token behaviour)
+    pool     bcrypt runs in the authentication pool (AUTH_POOL_KIND / AUTH_POOL_SIZE)
+
+Usage (from the project root):
+    python -m benchmarks.login_latency --logins 40 --concurrency 8
+    AUTH_POOL_KIND=process python -m benchmarks.login_latency
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
+
+import auth  # noqa: E402
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def token_stream(stop, tick, lateness):
+    expected = time.perf_counter() + tick
+    while not stop.is_set():
+        await asyncio.sleep(max(0.0, expected - time.perf_counter()))
+        now = time.perf_counter()
+        lateness.append((now - expected) * 1000)
+        expected = now + tick
+
+
+async def login(mode, password, hashed):
+    if mode == "inline":
+        return auth.verify_password(password, hashed)
+    return await auth.verify_password_async(password, hashed)
+
+
+async def run_mode(mode, args, hashed):
+    stop = asyncio.Event()
+    lateness = []
+    streams = [asyncio.create_task(token_stream(stop, args.tick_ms / 1000, lateness)) for _ in range(args.streams)]
+    await asyncio.sleep(0.2)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    login_times = []
+
+    async def one_login():
+        async with semaphore:
+            start = time.perf_counter()
+            await login(mode, "benchmark-password", hashed)
+            login_times.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one_login() for _ in range(args.logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await asyncio.gather(*streams)
+    auth.shutdown_auth_executors()
+    return {
+        "mode": mode,
+        "logins_per_sec": round(args.logins / elapsed, 1),
+        "login_p50_ms": round(statistics.median(login_times), 1),
+        "tick_p50_late_ms": round(percentile(lateness, 50), 2),
+        "tick_p95_late_ms": round(percentile(lateness, 95), 2),
+        "tick_p99_late_ms": round(percentile(lateness, 99), 2),
+        "tick_max_late_ms": round(max(lateness), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--tick-ms", type=float, default=20)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    hashed = auth._get_pwd_context().hash("benchmark-password")
+    results = [asyncio.run(run_mode(mode, args, hashed)) for mode in ("inline", "pool")]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.logins} logins ({args.concurrency} concurrent), {args.streams} streams ticking every {args.tick_ms} ms, "
+          f"pool={auth.AUTH_POOL_KIND}x{auth.AUTH_POOL_SIZE}")
+    for r in results:
+        print(f"{r['mode']:>7}: {r['logins_per_sec']:>6} logins/s  login p50 {r['login_p50_ms']} ms  "
+              f"stream lateness p50/p95/p99/max {r['tick_p50_late_ms']}/{r['tick_p95_late_ms']}/"
+              f"{r['tick_p99_late_ms']}/{r['tick_max_late_ms']} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark: cost of the /metrics instrumentation.
+
+Measures, per call:
+    histogram.observe / counter.inc     the work done per token and per generation
+    @timed wrapper                      added to every Redis.py call, against the same coroutine unwrapped
+    render_metrics                      the cost of one scrape, with --series label combinations
+
+Usage (from the project root):
+    python -m benchmarks.metrics_overhead --iterations 200000
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from metrics import Counter, Histogram, timed, render_metrics
+
+
+def per_call_ns(func, iterations):
+    start = time.perf_counter_ns()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter_ns() - start) / iterations
+
+
+async def per_await_ns(coro_func, iterations):
+    start = time.perf_counter_ns()
+    for _ in range(iterations):
+        await coro_func()
+    return (time.perf_counter_ns() - start) / iterations
+
+
+async def noop():
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--series", type=int, default=50, help="label combinations rendered per scrape")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    histogram = Histogram("bench_latency_seconds", "Benchmark histogram.", ("function",))
+    counter = Counter("bench_total", "Benchmark counter.")
+    series = histogram.labels("bench")
+    for i in range(args.series):
+        histogram.labels(f"fn{i}").observe(i / 1000)
+
+    timed_noop = timed(histogram, "noop")(noop)
+    plain = asyncio.run(per_await_ns(noop, args.iterations))
+    wrapped = asyncio.run(per_await_ns(timed_noop, args.iterations))
+    start = time.perf_counter()
+    scrapes = 200
+    for _ in range(scrapes):
+        render_metrics()
+    results = {
+        "observe_ns": round(per_call_ns(lambda: series.observe(0.0042), args.iterations), 1),
+        "counter_inc_ns": round(per_call_ns(counter.inc, args.iterations), 1),
+        "await_plain_ns": round(plain, 1),
+        "await_timed_ns": round(wrapped, 1),
+        "timed_overhead_ns": round(wrapped - plain, 1),
+        "render_ms": round((time.perf_counter() - start) / scrapes * 1000, 3),
+        "render_bytes": len(render_metrics()),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"histogram.observe      {results['observe_ns']} ns")
+    print(f"counter.inc            {results['counter_inc_ns']} ns")
+    print(f"@timed overhead        {results['timed_overhead_ns']} ns per call "
+          f"({results['await_plain_ns']} -> {results['await_timed_ns']} ns)")
+    print(f"render_metrics         {results['render_ms']} ms per scrape, {results['render_bytes']} bytes "
+          f"({args.series + 1} labelled series)")
+
+
+if __name__ == "__main__":
+    main()
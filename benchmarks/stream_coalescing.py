@@ -0,0 +1,90 @@
+"""
+Benchmark: per-token vs coalesced response_chunk frames.
+
+Simulates many concurrent generations that each stream tokens at a fixed rate
+through ChunkCoalescer into a fake WebSocket. The fake socket JSON-encodes every
+frame and writes it to /dev/null, so the per-frame encoding and syscall cost the
+server pays is included in the measured CPU time. `send_s` is the time spent
+inside send_json alone; `cpu_s` also includes the simulated token producer.
+
+Usage (from the project root):
+    python -m benchmarks.stream_coalescing --streams 300 --tokens 200 --token-interval-ms 5
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from ChunkCoalescer import ChunkCoalescer
+
+
+class NullWebSocket:
+    """Stand-in for a WebSocket that encodes frames and writes them to /dev/null."""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.frames = 0
+        self.send_seconds = 0.0
+
+    async def send_json(self, data):
+        start = time.perf_counter()
+        os.write(self.fd, json.dumps(data).encode("utf-8"))
+        self.send_seconds += time.perf_counter() - start
+        self.frames += 1
+
+
+async def stream(websocket, window_ms, max_chars, tokens, token_interval):
+    coalescer = ChunkCoalescer(websocket, window_ms, max_chars)
+    for i in range(tokens):
+        await coalescer.add(f" tok{i % 10}")
+        await asyncio.sleep(token_interval)
+    await coalescer.close()
+
+
+async def run_mode(window_ms, args):
+    fd = os.open(os.devnull, os.O_WRONLY)
+    sockets = [NullWebSocket(fd) for _ in range(args.streams)]
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    await asyncio.gather(*(
+        stream(ws, window_ms, args.max_chars, args.tokens, args.token_interval_ms / 1000)
+        for ws in sockets
+    ))
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    os.close(fd)
+    frames = sum(ws.frames for ws in sockets)
+    return {
+        "window_ms": window_ms,
+        "frames": frames,
+        "frames_per_sec": round(frames / wall, 1),
+        "cpu_seconds": round(cpu, 3),
+        "cpu_us_per_token": round(cpu / (args.streams * args.tokens) * 1e6, 2),
+        "send_seconds": round(sum(ws.send_seconds for ws in sockets), 3),
+        "wall_seconds": round(wall, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=300)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--token-interval-ms", type=float, default=5)
+    parser.add_argument("--max-chars", type=int, default=256)
+    parser.add_argument("--windows", default="0,20,50", help="comma separated coalescing windows in ms (0 = per-token)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = [asyncio.run(run_mode(int(w), args)) for w in args.windows.split(",")]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.streams} streams x {args.tokens} tokens, one token every {args.token_interval_ms} ms")
+    print(f"{'window_ms':>9} {'frames':>9} {'frames/s':>10} {'cpu_s':>7} {'cpu_us/token':>13} {'send_s':>7} {'wall_s':>7}")
+    for r in results:
+        print(f"{r['window_ms']:>9} {r['frames']:>9} {r['frames_per_sec']:>10} {r['cpu_seconds']:>7} {r['cpu_us_per_token']:>13} {r['send_seconds']:>7} {r['wall_seconds']:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Stub Ollama server for benchmarks and local testing.
+
+Implements the parts of the Ollama API the app uses:
+    POST /api/chat   streams NDJSON chunks ({"message": {"content": ...}, "done": false}) followed by
+                     a final {"done": true}, or one JSON object when "stream" is false
+    GET  /api/tags   health check
+
+Tokens are emitted at --tokens-per-sec after a --first-token-ms delay, so generation
+load can be simulated without a GPU. Several ports can be served by one process.
+
+Usage (from the project root):
+    python -m benchmarks.stub_ollama --port 11435 --port 11436 --tokens 200 --tokens-per-sec 50
+    OLLAMA_URLS=http://localhost:11435/api/chat,http://localhost:11436/api/chat uvicorn server:app
+"""
+import argparse
+import asyncio
+import json
+from aiohttp import web
+
+
+def make_app(tokens: int = 100, tokens_per_sec: float = 50, first_token_ms: float = 100, fail_rate: float = 0):
+    """Return an aiohttp app behaving like an Ollama server with the given generation speed."""
+    state = {"requests": 0}
+
+    async def chat(request):
+        state["requests"] += 1
+        payload = await request.json()
+        if fail_rate and state["requests"] % round(1 / fail_rate) == 0:
+            return web.json_response({"error": "stub failure"}, status=500)
+        model = payload.get("model", "stub")
+        words = [f"tok{i} " for i in range(tokens)]
+        await asyncio.sleep(first_token_ms / 1000)
+        if not payload.get("stream", True):
+            return web.json_response({"model": model, "message": {"role": "assistant", "content": "".join(words)}, "done": True})
+        resp = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await resp.prepare(request)
+        interval = 1 / tokens_per_sec if tokens_per_sec > 0 else 0
+        try:
+            for word in words:
+                chunk = {"model": model, "message": {"role": "assistant", "content": word}, "done": False}
+                await resp.write(json.dumps(chunk).encode() + b"\n")
+                if interval:
+                    await asyncio.sleep(interval)
+            done = {"model": model, "message": {"role": "assistant", "content": ""}, "done": True, "eval_count": tokens}
+            await resp.write(json.dumps(done).encode() + b"\n")
+            await resp.write_eof()
+        except ConnectionResetError:
+            # The client stopped the generation
+            pass
+        return resp
+
+    async def tags(request):
+        return web.json_response({"models": [{"name": "stub"}]})
+
+    app = web.Application()
+    app.router.add_post("/api/chat", chat)
+    app.router.add_get("/api/tags", tags)
+    app["state"] = state
+    return app
+
+
+async def start_stub(port: int, host: str = "127.0.0.1", **options) -> web.AppRunner:
+    """Start a stub server in the running event loop; stop it with `await runner.cleanup()`."""
+    runner = web.AppRunner(make_app(**options))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+async def serve(args):
+    runners = [
+        await start_stub(port, args.host, tokens=args.tokens, tokens_per_sec=args.tokens_per_sec,
+                         first_token_ms=args.first_token_ms, fail_rate=args.fail_rate)
+        for port in args.port
+    ]
+    print("Stub Ollama listening on " + ", ".join(f"http://{args.host}:{port}/api/chat" for port in args.port))
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, action="append", help="port to listen on (repeatable, default 11435)")
+    parser.add_argument("--tokens", type=int, default=100, help="tokens per response")
+    parser.add_argument("--tokens-per-sec", type=float, default=50, help="streaming rate (0 = as fast as possible)")
+    parser.add_argument("--first-token-ms", type=float, default=100, help="delay before the first token")
+    parser.add_argument("--fail-rate", type=float, default=0, help="fraction of chat requests answered with HTTP 500")
+    args = parser.parse_args()
+    args.port = args.port or [11435]
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import json
+from typing import Callable, Dict
+from settings import settings
+
+
+# Defaults used for models without their own entry in CONTEXT_MODEL_BUDGETS
+CONTEXT_MAX_MESSAGES = settings.context_max_messages
+CONTEXT_MAX_TOKENS = settings.context_max_tokens
+# e.g. {"llama2": {"max_tokens": 3500, "max_messages": 30}}
+CONTEXT_MODEL_BUDGETS = settings.context_model_budgets
+
+# Tokens added per message for the role and chat template markers
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def estimate_tokens(text: str) -> int:
+    """
+    Function Task:
+        Roughly estimates the number of tokens in a text (about 4 characters per token).
+
+    Arguments:
+        text (str): The text to measure.
+
+    Returns:
+        int: The estimated token count.
+    """
+    return len(text) // 4 + 1
+
+_tokenizers: Dict[str, Callable[[str], int]] = {}
+
+def register_tokenizer(model: str, tokenizer: Callable[[str], int]):
+    """
+    Function Task:
+        Registers a token counting function for a model, replacing the default estimate.
+
+    Arguments:
+        model (str): The model name, as sent to Ollama.
+        tokenizer (callable): A function that takes a text and returns its token count.
+
+    Returns:
+        None
+    """
+    _tokenizers[model] = tokenizer
+    _policies.pop(model, None)
+
+
+class ContextWindowPolicy:
+    """Decides which part of a conversation is sent to the model.
+
+    The first message (the system prompt) and the rolling summary, if any, are
+    always kept. The newest messages are
+    then added until either the message limit or the token budget is reached.
+    Only the fields the model needs (role and content) are sent.
+
+    Attributes:
+        max_messages (int): The maximum number of messages after the system prompt.
+        max_tokens (int): The token budget for the whole context.
+        tokenizer (callable): Counts the tokens in a text.
+    """
+
+    def __init__(self, max_messages: int, max_tokens: int, tokenizer: Callable[[str], int] = estimate_tokens):
+        """Initialize the policy with its limits and tokenizer."""
+        if max_messages < 1:
+            # The newest message (the question being answered) must always fit
+            raise ValueError(f"max_messages must be at least 1, got {max_messages}")
+        self.max_messages = max_messages
+        self.max_tokens = max_tokens
+        self.tokenizer = tokenizer
+
+    def count(self, message: dict) -> int:
+        """Return the token cost of one message."""
+        return self.tokenizer(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+
+    def apply(self, history: list, summary: str | None = None) -> list:
+        """Return the messages to send to the model for the given history."""
+        """ARGS: history (list): the stored messages, oldest first, starting with the system prompt
+                summary (str | None): the rolling summary of older messages, sent right after the system prompt"""
+        if not history:
+            return []
+        head, rest = [], history
+        if history[0].get("role") == "system":
+            head, rest = [history[0]], history[1:]
+        if summary:
+            head.append({"role": "system", "content": f"Summary of the earlier conversation: {summary}"})
+        budget = self.max_tokens - sum(self.count(m) for m in head)
+        kept = []
+        for message in reversed(rest):
+            if len(kept) >= self.max_messages:
+                break
+            cost = self.count(message)
+            if cost > budget and kept:
+                break
+            # The newest message is always kept, even if it alone is over budget
+            budget -= cost
+            kept.append(message)
+        kept.reverse()
+        return [{"role": m["role"], "content": m["content"]} for m in head + kept]
+
+
+_policies: Dict[str, ContextWindowPolicy] = {}
+
+def get_policy(model: str) -> ContextWindowPolicy:
+    """
+    Function Task:
+        Returns the context window policy for a model, using its entry in
+        CONTEXT_MODEL_BUDGETS if there is one and the defaults otherwise.
+
+    Arguments:
+        model (str): The model name, as sent to Ollama.
+
+    Returns:
+        ContextWindowPolicy: The policy for the model.
+    """
+    policy = _policies.get(model)
+    if policy is None:
+        budget = CONTEXT_MODEL_BUDGETS.get(model, {})
+        policy = ContextWindowPolicy(
+            max_messages=int(budget.get("max_messages", CONTEXT_MAX_MESSAGES)),
+            max_tokens=int(budget.get("max_tokens", CONTEXT_MAX_TOKENS)),
+            tokenizer=_tokenizers.get(model, estimate_tokens),
+        )
+        _policies[model] = policy
+    return policy
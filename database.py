@@ -1,13 +1,79 @@
-from sqlalchemy import create_engine
+from settings import settings
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 
+SQLALCHEMY_DATABASE_URL = settings.database_url
+DB_POOL_SIZE = settings.db_pool_size
+DB_MAX_OVERFLOW = settings.db_max_overflow
+DB_POOL_TIMEOUT = settings.db_pool_timeout
+
+# Async drivers used when DATABASE_URL names a plain dialect
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+
+def to_async_url(url: str) -> str:
+    """
+    Function Task:
+        Converts a database URL to the matching async driver URL.
+
+    Arguments:
+        url (str): The database URL, e.g. sqlite:///./test.db or postgresql://user@host/db.
+
+    Returns:
+        str: The URL with an async driver, e.g. sqlite+aiosqlite:///./test.db.
+    """
+    scheme, rest = url.split("://", 1)
+    if "+" in scheme:
+        return url
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}://{rest}"
+
+def _enable_sqlite_wal(dbapi_connection, connection_record):
+    """
+    Function Task:
+        Switches each new SQLite connection to WAL mode, so readers do not block
+        the writer and the other way round.
+
+    Arguments:
+        dbapi_connection: The raw DBAPI connection.
+        connection_record: The pool's record of the connection (unused).
+
+    Returns:
+        None
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+IS_SQLITE = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+
+# Synchronous engine, used by scripts such as seed_users.py
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False} if IS_SQLITE else {}
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine, used by the request handlers
+async_engine = create_async_engine(
+    to_async_url(SQLALCHEMY_DATABASE_URL),
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_pre_ping=not IS_SQLITE,
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+if IS_SQLITE:
+    event.listen(engine, "connect", _enable_sqlite_wal)
+    event.listen(async_engine.sync_engine, "connect", _enable_sqlite_wal)
+
 
 def get_db():
     db = SessionLocal()
@@ -15,3 +81,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import msgpack
+import zstandard
+from settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+# Sessions idle for longer than HISTORY_ARCHIVE_IDLE_DAYS are moved out of Redis into this SQLite file
+HISTORY_ARCHIVE_ENABLED = settings.history_archive_enabled
+HISTORY_ARCHIVE_PATH = settings.history_archive_path
+HISTORY_ARCHIVE_IDLE_DAYS = settings.history_archive_idle_days
+HISTORY_ARCHIVE_INTERVAL = settings.history_archive_interval
+HISTORY_ARCHIVE_BATCH = settings.history_archive_batch
+HISTORY_ARCHIVE_COMPRESS_LEVEL = settings.history_archive_compress_level
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archived_sessions (
+    uuid TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    updated_at INTEGER NOT NULL,
+    archived_at INTEGER NOT NULL,
+    meta TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    history BLOB NOT NULL,
+    PRIMARY KEY (uuid, session_id)
+)
+"""
+
+
+class HistoryArchive:
+    """Cold storage for idle chat sessions in a local SQLite file.
+
+    Each row holds a whole session: its metadata and summary hashes as JSON and
+    its stored history entries, unchanged, as one zstd-compressed msgpack list.
+    The blocking SQLite calls run in a worker thread; every method takes a batch
+    so archiving many sessions costs one thread hop and one transaction.
+
+    Attributes:
+        path (str): The SQLite database file.
+    """
+
+    def __init__(self, path: str = HISTORY_ARCHIVE_PATH, compress_level: int = HISTORY_ARCHIVE_COMPRESS_LEVEL):
+        self.path = path
+        self._compressor = zstandard.ZstdCompressor(level=compress_level)
+        self._decompressor = zstandard.ZstdDecompressor()
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self, create: bool):
+        """Return the connection, or None if the archive file does not exist and create is False."""
+        if self._conn is None:
+            if not create and not os.path.exists(self.path):
+                return None
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _put_many(self, sessions: list):
+        with self._lock:
+            conn = self._connect(create=True)
+            now = int(time.time())
+            rows = [
+                (s["uuid"], s["session_id"], int(s["meta"].get("updated_at") or 0), now,
+                 json.dumps(s["meta"]), json.dumps(s["summary"]),
+                 self._compressor.compress(msgpack.packb(s["history"], use_bin_type=True)))
+                for s in sessions
+            ]
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO archived_sessions VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def _get(self, uuid: str, session_id: str):
+        with self._lock:
+            conn = self._connect(create=False)
+            if conn is None:
+                return None
+            row = conn.execute(
+                "SELECT meta, summary, history FROM archived_sessions WHERE uuid = ? AND session_id = ?",
+                (uuid, session_id),
+            ).fetchone()
+        if row is None:
+            return None
+        meta, summary, history = row
+        return {
+            "uuid": uuid,
+            "session_id": session_id,
+            "meta": json.loads(meta),
+            "summary": json.loads(summary),
+            "history": msgpack.unpackb(self._decompressor.decompress(history), raw=False),
+        }
+
+    def _get_metas(self, uuid: str, session_ids: list) -> dict:
+        with self._lock:
+            conn = self._connect(create=False)
+            if conn is None or not session_ids:
+                return {}
+            placeholders = ",".join("?" * len(session_ids))
+            rows = conn.execute(
+                f"SELECT session_id, meta FROM archived_sessions WHERE uuid = ? AND session_id IN ({placeholders})",
+                (uuid, *session_ids),
+            ).fetchall()
+        return {session_id: json.loads(meta) for session_id, meta in rows}
+
+    def _delete_many(self, sessions: list):
+        with self._lock:
+            conn = self._connect(create=False)
+            if conn is None or not sessions:
+                return
+            with conn:
+                conn.executemany("DELETE FROM archived_sessions WHERE uuid = ? AND session_id = ?", sessions)
+
+    def _count(self) -> int:
+        with self._lock:
+            conn = self._connect(create=False)
+            if conn is None:
+                return 0
+            return conn.execute("SELECT COUNT(*) FROM archived_sessions").fetchone()[0]
+
+    def _close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    async def put_many(self, sessions: list):
+        """Store sessions (dicts with uuid, session_id, meta, summary and history), replacing older copies."""
+        await asyncio.to_thread(self._put_many, sessions)
+
+    async def get(self, uuid: str, session_id: str) -> dict | None:
+        """Return an archived session, or None if it is not archived."""
+        return await asyncio.to_thread(self._get, uuid, session_id)
+
+    async def get_metas(self, uuid: str, session_ids: list) -> dict:
+        """Return the metadata of those of a user's sessions that are archived, keyed by session id."""
+        return await asyncio.to_thread(self._get_metas, uuid, session_ids)
+
+    async def delete_many(self, sessions: list):
+        """Remove (uuid, session_id) pairs from the archive."""
+        await asyncio.to_thread(self._delete_many, sessions)
+
+    async def stats(self) -> dict:
+        """Return the archive location and the number of archived sessions."""
+        return {"enabled": HISTORY_ARCHIVE_ENABLED, "path": self.path, "sessions": await asyncio.to_thread(self._count)}
+
+    async def close(self):
+        """Close the SQLite connection; it is reopened on next use."""
+        await asyncio.to_thread(self._close)
+
+
+history_archive = HistoryArchive()
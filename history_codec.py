@@ -0,0 +1,116 @@
+import json
+import msgpack
+import zstandard
+from settings import settings
+
+
+# "json" writes the legacy format, "msgpack" the compact one; both are always readable
+HISTORY_ENCODING = settings.history_encoding
+# Packed entries at least this large are zstd-compressed (when that makes them smaller)
+HISTORY_COMPRESS_MIN_BYTES = settings.history_compress_min_bytes
+HISTORY_COMPRESS_LEVEL = settings.history_compress_level
+
+# The first byte of a stored entry tells its format; legacy JSON entries start with "{"
+FORMAT_MSGPACK = 0x01
+FORMAT_MSGPACK_ZSTD = 0x02
+FORMAT_JSON = ord("{")
+
+# Roles are stored as small integers; unknown roles are stored as strings
+ROLES = ("system", "user", "assistant")
+ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+BASE_FIELDS = ("role", "content", "timestamp")
+
+_compressor = zstandard.ZstdCompressor(level=HISTORY_COMPRESS_LEVEL)
+_decompressor = zstandard.ZstdDecompressor()
+
+
+def encode_entry(entry: dict, encoding: str = HISTORY_ENCODING):
+    """
+    Function Task:
+        Serializes a history entry for storage in a chat: list.
+
+        msgpack entries are a version byte followed by [role code, content, timestamp]
+        (plus a map of any other fields); long ones are zstd-compressed.
+
+    Arguments:
+        entry (dict): The entry, with 'role', 'content' and 'timestamp' keys.
+        encoding (str): "json" for the legacy format or "msgpack" for the compact one.
+
+    Returns:
+        str | bytes: The JSON text, or the versioned binary entry.
+    """
+    if encoding != "msgpack":
+        return json.dumps(entry)
+    fields = [ROLE_CODES.get(entry["role"], entry["role"]), entry["content"], entry.get("timestamp", 0)]
+    extra = {key: value for key, value in entry.items() if key not in BASE_FIELDS}
+    if extra:
+        fields.append(extra)
+    packed = msgpack.packb(fields, use_bin_type=True)
+    if len(packed) >= HISTORY_COMPRESS_MIN_BYTES:
+        compressed = _compressor.compress(packed)
+        if len(compressed) < len(packed):
+            return bytes((FORMAT_MSGPACK_ZSTD,)) + compressed
+    return bytes((FORMAT_MSGPACK,)) + packed
+
+
+def decode_entry(raw) -> dict:
+    """
+    Function Task:
+        Parses a stored history entry in any supported format.
+
+    Arguments:
+        raw (str | bytes): The entry as read from Redis.
+
+    Returns:
+        dict: The entry, with 'role', 'content' and 'timestamp' keys.
+    """
+    if isinstance(raw, str):
+        return json.loads(raw)
+    version = raw[0]
+    if version == FORMAT_JSON:
+        return json.loads(raw)
+    if version == FORMAT_MSGPACK:
+        fields = msgpack.unpackb(memoryview(raw)[1:], raw=False)
+    elif version == FORMAT_MSGPACK_ZSTD:
+        fields = msgpack.unpackb(_decompressor.decompress(memoryview(raw)[1:]), raw=False)
+    else:
+        raise ValueError(f"Unknown history entry format: {version}")
+    role = fields[0]
+    entry = {"role": ROLES[role] if isinstance(role, int) else role, "content": fields[1], "timestamp": fields[2]}
+    if len(fields) > 3:
+        entry.update(fields[3])
+    return entry
+
+
+def entry_json(raw) -> str:
+    """
+    Function Task:
+        Returns a stored entry as JSON text; legacy JSON entries are passed through without parsing.
+
+    Arguments:
+        raw (str | bytes): The entry as read from Redis.
+
+    Returns:
+        str: The entry as a JSON object.
+    """
+    if isinstance(raw, str):
+        return raw
+    if raw[:1] == b"{":
+        return raw.decode("utf-8")
+    return json.dumps(decode_entry(raw))
+
+
+def is_current(raw, encoding: str = HISTORY_ENCODING) -> bool:
+    """
+    Function Task:
+        Tells whether a stored entry already uses the configured encoding.
+
+    Arguments:
+        raw (str | bytes): The entry as read from Redis.
+        encoding (str): The configured encoding.
+
+    Returns:
+        bool: False if the entry should be rewritten by the migrator.
+    """
+    is_json = isinstance(raw, str) or raw[:1] == b"{"
+    return is_json == (encoding != "msgpack")
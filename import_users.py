@@ -0,0 +1,320 @@
+"""
+Bulk user import.
+
+Streams users from a CSV or JSONL file into the user database:
+    - passwords are bcrypt-hashed in a process pool across all cores, the next
+      batch being hashed while the current one is written
+    - rows are upserted by username in batches: existing users are updated
+      (their uuid, which keys their chat history, is kept), new ones inserted,
+      and users missing from the file are left alone
+    - running servers are told (over Redis pub/sub) to drop the cached users of
+      every committed batch, so disabled users are logged out immediately
+    - progress is checkpointed after every committed batch, so a crashed or
+      interrupted import resumes where it stopped (re-running a batch is harmless)
+
+Columns / keys: username (required), password or hashed_password (one required),
+full_name, email, disabled (true/false/1/0), uuid (generated for new users when missing).
+
+Usage (from the project root):
+    python import_users.py users.csv
+    python import_users.py users.jsonl --batch-size 2000 --workers 8
+    python import_users.py users.csv --restart        # ignore the checkpoint
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+import uuid as uuid_module
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from passlib.context import CryptContext
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError
+from database import engine
+from models import Base, User
+from auth import publish_auth_invalidation
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# Columns overwritten when the username already exists; uuid is only set on insert
+UPDATE_COLUMNS = ("full_name", "email", "hashed_password", "disabled")
+
+
+def hash_password(password):
+    """
+    Function Task:
+        Hashes one password with bcrypt; runs in the worker processes.
+
+    Arguments:
+        password (str): The plain password.
+
+    Returns:
+        str: The bcrypt hash.
+    """
+    return pwd_context.hash(password)
+
+def read_rows(path, fmt):
+    """
+    Function Task:
+        Streams the user records of a CSV or JSONL file without loading it whole.
+
+    Arguments:
+        path (str): The input file.
+        fmt (str): "csv" or "jsonl".
+
+    Returns:
+        Iterator[dict]: One record per user, in file order.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+def _to_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or "").strip().lower() in ("1", "true", "yes", "y")
+
+def to_user_row(record):
+    """
+    Function Task:
+        Converts an input record to a users table row, leaving the password to be hashed.
+
+    Arguments:
+        record (dict): The record read from the file.
+
+    Returns:
+        tuple: The row (or None if the record is invalid) and the plain password
+            (None if the record already carries a hash).
+    """
+    username = (record.get("username") or "").strip()
+    password = record.get("password")
+    hashed = record.get("hashed_password")
+    if not username or not (password or hashed):
+        return None, None
+    row = {
+        "username": username,
+        "full_name": record.get("full_name") or None,
+        "email": (record.get("email") or "").strip() or None,
+        "hashed_password": hashed or None,
+        "disabled": _to_bool(record.get("disabled")),
+        "uuid": record.get("uuid") or str(uuid_module.uuid4()),
+    }
+    return row, None if hashed else password
+
+def dedupe_rows(rows):
+    """
+    Function Task:
+        Keeps one row per username, the last one, in first-seen order. One
+        upsert statement may not touch the same row twice (PostgreSQL raises
+        CardinalityViolation), so a batch must not repeat a username.
+
+    Arguments:
+        rows (list): users table rows.
+
+    Returns:
+        list: The rows, without duplicate usernames.
+    """
+    latest = {}
+    for row in rows:
+        latest[row["username"]] = row
+    return list(latest.values())
+
+def upsert_users(conn, rows):
+    """
+    Function Task:
+        Inserts users, or updates them when the username exists, in one statement.
+        A username repeated in rows is written once, with its last row.
+
+    Arguments:
+        conn (Connection): An open connection, inside a transaction.
+        rows (list): users table rows.
+
+    Returns:
+        None
+    """
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect in ("mysql", "mariadb"):
+        from sqlalchemy.dialects.mysql import insert
+        stmt = insert(User.__table__).values(dedupe_rows(rows))
+        conn.execute(stmt.on_duplicate_key_update({c: stmt.inserted[c] for c in UPDATE_COLUMNS}))
+        return
+    else:
+        raise RuntimeError(f"Upsert is not supported for the {dialect} dialect")
+    rows = dedupe_rows(rows)
+    stmt = insert(User.__table__).values(rows)
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=["username"], set_={c: stmt.excluded[c] for c in UPDATE_COLUMNS}
+    ))
+
+def write_batch(rows):
+    """
+    Function Task:
+        Upserts a batch in one transaction. If the batch violates a constraint
+        (e.g. an email already used by another username), it is retried row by
+        row so only the offending rows are rejected.
+
+    Arguments:
+        rows (list): users table rows with their passwords hashed.
+
+    Returns:
+        list: The usernames that were rejected, with the reason.
+    """
+    # When a username repeats in the batch, its last row wins
+    rows = dedupe_rows(rows)
+    try:
+        with engine.begin() as conn:
+            upsert_users(conn, rows)
+        return []
+    except IntegrityError:
+        pass
+    rejected = []
+    for row in rows:
+        try:
+            with engine.begin() as conn:
+                upsert_users(conn, [row])
+        except IntegrityError as e:
+            rejected.append((row["username"], str(e.orig)))
+    return rejected
+
+def load_checkpoint(path, input_path, restart):
+    """
+    Function Task:
+        Returns how many input records a previous run already committed.
+
+    Arguments:
+        path (str): The checkpoint file.
+        input_path (str): The input file; a checkpoint for another file or size is ignored.
+        restart (bool): Ignore any checkpoint.
+
+    Returns:
+        dict: The checkpoint, with 'records' (records committed) and the running totals.
+    """
+    fresh = {"input": os.path.abspath(input_path), "size": os.path.getsize(input_path),
+             "records": 0, "upserted": 0, "invalid": 0, "rejected": 0}
+    if restart or not os.path.exists(path):
+        return fresh
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("input") != fresh["input"] or checkpoint.get("size") != fresh["size"]:
+        print(f"Checkpoint {path} is for a different input; starting over", file=sys.stderr)
+        return fresh
+    return checkpoint
+
+def save_checkpoint(path, checkpoint):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, path)
+
+def _prepare(pool, records, chunksize):
+    """Convert a batch of records to rows and submit its passwords for hashing."""
+    rows, passwords, invalid = [], [], 0
+    for record in records:
+        row, password = to_user_row(record)
+        if row is None:
+            invalid += 1
+            continue
+        rows.append(row)
+        passwords.append(password)
+    to_hash = [p for p in passwords if p is not None]
+    hashes = pool.map(hash_password, to_hash, chunksize=chunksize) if to_hash else iter(())
+    return len(records), rows, passwords, invalid, hashes
+
+def import_users(path, fmt, batch_size=1000, workers=None, checkpoint_path=None, restart=False):
+    """
+    Function Task:
+        Imports the users of a file as described in the module docstring.
+
+    Arguments:
+        path (str): The CSV or JSONL file.
+        fmt (str): "csv" or "jsonl".
+        batch_size (int): Records hashed and written per batch.
+        workers (int | None): Hashing processes (None = one per core).
+        checkpoint_path (str | None): Progress file (default: the input path + ".checkpoint").
+        restart (bool): Ignore an existing checkpoint.
+
+    Returns:
+        dict: The totals and throughput of this run.
+    """
+    workers = workers or os.cpu_count() or 1
+    checkpoint_path = checkpoint_path or path + ".checkpoint"
+    checkpoint = load_checkpoint(checkpoint_path, path, restart)
+    if not inspect(engine).has_table(User.__tablename__):
+        Base.metadata.create_all(bind=engine)
+    records = read_rows(path, fmt)
+    if checkpoint["records"]:
+        print(f"Resuming after {checkpoint['records']} records", file=sys.stderr)
+        # Skipped records are only parsed, never hashed
+        for _ in islice(records, checkpoint["records"]):
+            pass
+    chunksize = max(1, batch_size // (workers * 4))
+    started = time.perf_counter()
+    processed = upserted = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        batch = list(islice(records, batch_size))
+        pending = _prepare(pool, batch, chunksize) if batch else None
+        while pending:
+            count, rows, passwords, invalid, hashes = pending
+            # Hash the next batch while this one is finished and written
+            batch = list(islice(records, batch_size))
+            pending = _prepare(pool, batch, chunksize) if batch else None
+            hashes = iter(list(hashes))
+            for row, password in zip(rows, passwords):
+                if password is not None:
+                    row["hashed_password"] = next(hashes)
+            rejected = write_batch(rows) if rows else []
+            if rows:
+                # Running servers drop their cached copies of updated (e.g. disabled) users
+                rejected_names = {username for username, _ in rejected}
+                publish_auth_invalidation([row["username"] for row in rows if row["username"] not in rejected_names])
+            for username, reason in rejected:
+                print(f"Rejected {username}: {reason}", file=sys.stderr)
+            processed += count
+            upserted += len(rows) - len(rejected)
+            checkpoint["records"] += count
+            checkpoint["upserted"] += len(rows) - len(rejected)
+            checkpoint["invalid"] += invalid
+            checkpoint["rejected"] += len(rejected)
+            save_checkpoint(checkpoint_path, checkpoint)
+            elapsed = time.perf_counter() - started
+            print(f"{checkpoint['records']} records ({processed / elapsed:.0f} records/s)", file=sys.stderr)
+    elapsed = time.perf_counter() - started
+    return {
+        "records": checkpoint["records"],
+        "upserted": checkpoint["upserted"],
+        "invalid": checkpoint["invalid"],
+        "rejected": checkpoint["rejected"],
+        "this_run_records": processed,
+        "this_run_upserted": upserted,
+        "seconds": round(elapsed, 2),
+        "records_per_sec": round(processed / elapsed, 1) if elapsed else None,
+        "workers": workers,
+        "checkpoint": checkpoint_path,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="CSV or JSONL file of users")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="input format (default: from the file extension)")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, help="hashing processes (default: one per core)")
+    parser.add_argument("--checkpoint", help="progress file (default: PATH.checkpoint)")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start from the first record")
+    args = parser.parse_args()
+    fmt = args.format or ("jsonl" if args.path.endswith((".jsonl", ".ndjson")) else "csv")
+    report = import_users(args.path, fmt, args.batch_size, args.workers, args.checkpoint, args.restart)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import atexit
+import json
+import logging
+import queue
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+from settings import settings
+
+
+LOG_FILE = settings.log_file
+LOG_LEVEL = settings.log_level
+# "text" keeps the classic one-line format, "json" writes one JSON object per record
+LOG_FORMAT = settings.log_format
+# "size", "time" or "none"
+LOG_ROTATION = settings.log_rotation
+LOG_MAX_BYTES = settings.log_max_bytes
+LOG_BACKUP_COUNT = settings.log_backup_count
+LOG_ROTATE_WHEN = settings.log_rotate_when
+# Message prefix -> keep one record in N, e.g. {"History appended": 10}
+LOG_SAMPLING = settings.log_sampling
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+
+# Fields of the current request/connection that are added to every record logged under it
+_log_context: ContextVar[dict] = ContextVar("log_context", default={})
+# Attributes every LogRecord has; anything else on a record came from extra= or the log context
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+_listener: QueueListener | None = None
+
+
+def bind_log_context(**fields):
+    """
+    Function Task:
+        Adds fields (e.g. uuid, session_id) to every record logged from the current
+        task and from the tasks it starts afterwards.
+
+    Arguments:
+        **fields: The values to attach to the log records.
+
+    Returns:
+        None
+    """
+    _log_context.set({**_log_context.get(), **fields})
+
+
+class ContextFilter(logging.Filter):
+    """Copies the bound log context onto each record; runs in the logging thread of the caller."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, value in _log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps one record in N for messages starting with a configured prefix.
+
+    Matching uses the unformatted message template, so a dropped record is never formatted.
+    Warnings and errors are always kept.
+    """
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = {prefix: int(n) for prefix, n in rates.items() if int(n) > 1}
+        self._seen = dict.fromkeys(self.rates, 0)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not self.rates or record.levelno >= logging.WARNING or not isinstance(record.msg, str):
+            return True
+        for prefix, n in self.rates.items():
+            if record.msg.startswith(prefix):
+                self._seen[prefix] += 1
+                return self._seen[prefix] % n == 1
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as one JSON object with its context and extra= fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _InProcessQueueHandler(QueueHandler):
+    """A QueueHandler that hands records over unformatted.
+
+    The stock prepare() formats the message on the caller's thread so the record can be
+    pickled; the queue here never leaves the process, so formatting is left to the listener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def _file_handler() -> logging.Handler:
+    if LOG_ROTATION == "size":
+        handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    elif LOG_ROTATION == "time":
+        handler = TimedRotatingFileHandler(LOG_FILE, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    else:
+        handler = logging.FileHandler(LOG_FILE, mode="a", encoding="utf-8")
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+    return handler
+
+
+def setup_logging():
+    """
+    Function Task:
+        Routes all logging through an in-memory queue: callers only enqueue the record,
+        and a background thread formats it and writes it to the (rotating) log file,
+        so a slow disk never blocks the event loop. Safe to call more than once.
+
+    Arguments:
+        None
+
+    Returns:
+        QueueListener: The listener thread writing the records.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+    log_queue = queue.SimpleQueue()
+    queue_handler = _InProcessQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(LOG_SAMPLING))
+    queue_handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+    _listener = QueueListener(log_queue, _file_handler(), respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """
+    Function Task:
+        Writes out the records still queued and stops the listener thread.
+
+    Arguments:
+        None
+
+    Returns:
+        None
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,228 @@
+import functools
+import math
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable, Dict, Tuple
+
+# Latency buckets in seconds, from sub-millisecond Redis calls to multi-minute generations
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+RATE_BUCKETS = (1, 2, 5, 10, 15, 20, 30, 40, 50, 75, 100, 150, 200, 500)
+
+_registry: list = []
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric(ABC):
+    """Base class for metrics: a name, help text and one series per label combination.
+
+    Updates are plain attribute arithmetic on the event loop thread, so recording a
+    value costs well under a microsecond; the text is only built when /metrics is scraped.
+    """
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[tuple, object] = {}
+        _registry.append(self)
+
+    def labels(self, *values):
+        """Return the series for the given label values, creating it on first use."""
+        series = self._series.get(values)
+        if series is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            series = self._series[values] = self._new_series()
+        return series
+
+    @abstractmethod
+    def _new_series(self):
+        """Return an empty series of this metric's kind."""
+
+    @abstractmethod
+    def _samples(self):
+        """Yield (sample name, formatted labels, value) for every series."""
+
+    def render(self) -> str:
+        """Return the metric in the Prometheus text exposition format."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in self._samples())
+        return "\n".join(lines)
+
+
+class _CounterSeries:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+
+class Counter(_Metric):
+    """A value that only goes up, e.g. the number of generations."""
+
+    kind = "counter"
+
+    def _new_series(self):
+        return _CounterSeries()
+
+    def inc(self, amount: float = 1):
+        """Increase the unlabelled series."""
+        self.labels().inc(amount)
+
+    def _samples(self):
+        for values, series in self._series.items():
+            yield self.name, _format_labels(self.labelnames, values), series.value
+
+
+class _GaugeSeries:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function = None
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set_function(self, function: Callable[[], float]):
+        """Read the value from function when the metrics are scraped instead of tracking it."""
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function is not None else self.value
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, e.g. the number of open WebSockets."""
+
+    kind = "gauge"
+
+    def _new_series(self):
+        return _GaugeSeries()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self.labels().dec(amount)
+
+    def set_function(self, function: Callable[[], float]):
+        self.labels().set_function(function)
+
+    def _samples(self):
+        for values, series in self._series.items():
+            yield self.name, _format_labels(self.labelnames, values), series.get()
+
+
+class _HistogramSeries:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # One count per bucket plus the +Inf bucket; made cumulative when rendered
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    """A distribution of observed values in fixed buckets, e.g. request latencies."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_series(self):
+        return _HistogramSeries(self.buckets)
+
+    def observe(self, value: float):
+        """Record a value in the unlabelled series."""
+        self.labels().observe(value)
+
+    def _samples(self):
+        for values, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series.counts):
+                cumulative += count
+                yield f"{self.name}_bucket", _format_labels(self.labelnames, values, f'le="{_format_value(bound)}"'), cumulative
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}_sum", labels, series.sum
+            yield f"{self.name}_count", labels, series.count
+
+
+def timed(histogram: Histogram, label: str | None = None):
+    """Decorate an async function so its duration is recorded in histogram.
+
+    With a single-label histogram the series is labelled with label, or the function name by default.
+    """
+    def decorator(func):
+        series = histogram.labels(label or func.__name__) if histogram.labelnames else histogram.labels()
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                series.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def render_metrics() -> str:
+    """Return every registered metric in the Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+# --- Metrics of the chat hot path ---
+GENERATION_TTFT = Histogram("chat_time_to_first_token_seconds", "Time from starting a generation to its first token.")
+GENERATION_DURATION = Histogram("chat_generation_duration_seconds", "Total duration of a generation.", ("outcome",))
+GENERATION_TOKENS_PER_SECOND = Histogram("chat_generation_tokens_per_second", "Streaming rate of completed generations.", buckets=RATE_BUCKETS)
+GENERATION_TOKENS = Counter("chat_generated_tokens_total", "Tokens streamed to clients.")
+REDIS_CALL_SECONDS = Histogram("redis_call_duration_seconds", "Latency of the chat store operations in Redis.py.", ("function",))
+LOGIN_SECONDS = Histogram("auth_login_duration_seconds", "Latency of username/password authentication.", ("outcome",))
+WEBSOCKET_CONNECTIONS = Gauge("chat_websocket_connections", "WebSockets connected to this worker.")
+GENERATION_TASKS = Gauge("chat_generation_tasks", "Generation tasks tracked by this worker's connection manager.")
+GENERATIONS_RUNNING = Gauge("chat_generations_running", "Generations holding a scheduler slot.")
+GENERATION_QUEUE_DEPTH = Gauge("chat_generation_queue_depth", "Generations waiting for a scheduler slot.")
+GENERATIONS_REJECTED = Counter("chat_generations_rejected_total", "Generations rejected because the queue was full.")
@@ -0,0 +1,226 @@
+import asyncio
+import hashlib
+import logging
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+import aiohttp
+from settings import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+# Comma separated chat endpoints, e.g. http://gpu1:11434/api/chat,http://gpu2:11434/api/chat
+OLLAMA_URLS = settings.ollama_urls
+# "least_outstanding" or "session_affinity"
+OLLAMA_ROUTING = settings.ollama_routing
+OLLAMA_HEALTH_INTERVAL = settings.ollama_health_interval
+OLLAMA_EJECT_FAILURES = settings.ollama_eject_failures
+OLLAMA_EJECT_SECONDS = settings.ollama_eject_seconds
+OLLAMA_CONNECT_RETRIES = settings.ollama_connect_retries
+
+
+class NoBackendAvailable(Exception):
+    """Raised when no Ollama backend could take a request."""
+
+
+class Backend:
+    """One Ollama server and its health and load counters.
+
+    Attributes:
+        url (str): The chat endpoint, e.g. http://localhost:11434/api/chat.
+        health_url (str): The endpoint probed by active health checks (/api/tags on the same host).
+        outstanding (int): Requests in flight on this backend.
+        consecutive_failures (int): Failures since the last success.
+        ejected_until (float): Monotonic time until which the backend receives no traffic.
+        requests_total (int): Requests sent to this backend.
+        failures_total (int): Failed requests and health checks.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        parts = urlsplit(url)
+        self.health_url = f"{parts.scheme}://{parts.netloc}/api/tags"
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.requests_total = 0
+        self.failures_total = 0
+
+    def available(self, now: float) -> bool:
+        """Return True if the backend is not ejected."""
+        return now >= self.ejected_until
+
+    def stats(self, now: float) -> dict:
+        """Return the backend's load and health counters."""
+        return {
+            "url": self.url,
+            "available": self.available(now),
+            "outstanding": self.outstanding,
+            "consecutive_failures": self.consecutive_failures,
+            "requests_total": self.requests_total,
+            "failures_total": self.failures_total,
+        }
+
+
+class BackendPool:
+    """Spreads Ollama requests over several backends.
+
+    Routing strategies:
+        least_outstanding: the available backend with the fewest requests in flight.
+        session_affinity: the same backend for every turn of a session (rendezvous hashing),
+            so the backend's prompt/KV cache for the conversation stays warm; when that backend
+            is ejected the session moves to the next one in its hash order.
+
+    A backend that fails eject_failures times in a row (connect errors, 5xx responses,
+    broken streams or failed health checks) is ejected for eject_seconds. Requests that
+    fail to connect are retried on another backend.
+
+    Attributes:
+        backends (list): The Backend objects.
+        strategy (str): The routing strategy.
+    """
+
+    def __init__(self, urls: list, strategy: str = "least_outstanding", eject_failures: int = 3,
+                 eject_seconds: float = 30, connect_retries: int = 2, health_interval: float = 10):
+        """Initialize the pool with one Backend per URL."""
+        if strategy not in ("least_outstanding", "session_affinity"):
+            raise ValueError(f"Unknown Ollama routing strategy: {strategy}")
+        self.backends = [Backend(url) for url in urls]
+        self.strategy = strategy
+        self.eject_failures = eject_failures
+        self.eject_seconds = eject_seconds
+        self.connect_retries = connect_retries
+        self.health_interval = health_interval
+        self._health_task: asyncio.Task | None = None
+        self._next = 0
+
+    def choose(self, session_id: str | None = None, exclude: set = frozenset()):
+        """Pick the backend for a request, skipping ejected backends and those in exclude."""
+        """Returns: a Backend, or None if every backend is excluded. When all remaining backends
+        are ejected, one of them is still returned rather than failing the request outright."""
+        now = time.monotonic()
+        candidates = [b for b in self.backends if b.url not in exclude]
+        if not candidates:
+            return None
+        available = [b for b in candidates if b.available(now)] or candidates
+        if self.strategy == "session_affinity" and session_id:
+            return max(available, key=lambda b: hashlib.md5(f"{b.url}|{session_id}".encode()).digest())
+        # Rotate the starting point so ties are spread instead of always hitting the first backend
+        self._next = (self._next + 1) % len(available)
+        rotated = available[self._next:] + available[:self._next]
+        return min(rotated, key=lambda b: b.outstanding)
+
+    def mark_success(self, backend: Backend):
+        """Record a successful request or health check."""
+        if backend.consecutive_failures >= self.eject_failures:
+            logger.info("Ollama backend restored: %s", backend.url)
+        backend.consecutive_failures = 0
+        backend.ejected_until = 0.0
+
+    def mark_failure(self, backend: Backend, reason: str):
+        """Record a failure and eject the backend once it has failed too many times in a row."""
+        backend.failures_total += 1
+        backend.consecutive_failures += 1
+        if backend.consecutive_failures >= self.eject_failures:
+            now = time.monotonic()
+            was_available = backend.available(now)
+            backend.ejected_until = now + self.eject_seconds
+            if was_available:
+                logger.warning("Ollama backend ejected for %ss: %s (%s)", self.eject_seconds, backend.url, reason)
+
+    @asynccontextmanager
+    async def post(self, http: aiohttp.ClientSession, session_id: str | None, payload: dict):
+        """POST a payload to a backend chosen by the routing strategy and yield the response.
+        Connection failures and 5xx responses are retried on other backends before any data
+        is handed to the caller; the backend's outcome is recorded when the caller is done."""
+        tried = set()
+        last_error = None
+        backend = resp = None
+        for _ in range(self.connect_retries + 1):
+            backend = self.choose(session_id, tried)
+            if backend is None:
+                break
+            tried.add(backend.url)
+            backend.requests_total += 1
+            # Counted before connecting so concurrent requests see each other
+            backend.outstanding += 1
+            try:
+                resp = await http.post(backend.url, json=payload)
+            except BaseException as e:
+                backend.outstanding -= 1
+                if not isinstance(e, (aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+                    raise
+                self.mark_failure(backend, f"connect: {e}")
+                last_error = e
+                continue
+            if resp.status >= 500:
+                backend.outstanding -= 1
+                self.mark_failure(backend, f"HTTP {resp.status}")
+                last_error = aiohttp.ClientResponseError(resp.request_info, resp.history, status=resp.status)
+                resp.release()
+                resp = None
+                continue
+            break
+        if resp is None:
+            raise NoBackendAvailable(f"No Ollama backend could take the request: {last_error}")
+        try:
+            yield resp
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.mark_failure(backend, f"stream: {e}")
+            raise
+        else:
+            self.mark_success(backend)
+        finally:
+            backend.outstanding -= 1
+            resp.release()
+
+    async def check_health(self, http: aiohttp.ClientSession):
+        """Probe every backend once and update its health."""
+        async def probe(backend: Backend):
+            try:
+                async with http.get(backend.health_url, timeout=aiohttp.ClientTimeout(total=5)) as resp:
+                    if resp.status < 500:
+                        self.mark_success(backend)
+                    else:
+                        self.mark_failure(backend, f"health check HTTP {resp.status}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.mark_failure(backend, f"health check: {e}")
+        await asyncio.gather(*(probe(b) for b in self.backends))
+
+    def start(self, http: aiohttp.ClientSession):
+        """Start the periodic active health checks (only useful with more than one backend)."""
+        if self._health_task is None and len(self.backends) > 1 and self.health_interval > 0:
+            self._health_task = asyncio.create_task(self._health_loop(http))
+
+    async def close(self):
+        """Stop the active health checks."""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+
+    async def _health_loop(self, http: aiohttp.ClientSession):
+        """Run check_health every health_interval seconds."""
+        while True:
+            await asyncio.sleep(self.health_interval)
+            try:
+                await self.check_health(http)
+            except Exception as e:
+                logger.error("Error checking Ollama backends: %s", e)
+
+    def stats(self) -> dict:
+        """Return the routing strategy and the counters of every backend."""
+        now = time.monotonic()
+        return {"strategy": self.strategy, "backends": [b.stats(now) for b in self.backends]}
+
+
+backend_pool = BackendPool(
+    OLLAMA_URLS,
+    strategy=OLLAMA_ROUTING,
+    eject_failures=OLLAMA_EJECT_FAILURES,
+    eject_seconds=OLLAMA_EJECT_SECONDS,
+    connect_retries=OLLAMA_CONNECT_RETRIES,
+    health_interval=OLLAMA_HEALTH_INTERVAL,
+)
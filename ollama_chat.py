@@ -1,65 +1,297 @@
 import logging
 import asyncio
 import json
+import time
 import aiohttp
-from Redis import ensure_system_message, append_history, get_history
+from Redis import ensure_system_message, append_history, get_context_history, get_summary, save_summary, get_history_range
+from context_window import get_policy
+from ChunkCoalescer import ChunkCoalescer
+from ResponseBuffer import ResponseBuffer
+from ollama_backends import backend_pool
+from response_cache import response_cache
+from metrics import GENERATION_TTFT, GENERATION_DURATION, GENERATION_TOKENS_PER_SECOND, GENERATION_TOKENS
 from fastapi import WebSocket
-import os
-from dotenv import load_dotenv
+from settings import settings
 
 
 logger = logging.getLogger(__name__)
 
-load_dotenv()
 
-OLLAMA_URL = os.getenv("OLLAMA_URL")
-MODEL_NAME = os.getenv("MODEL_NAME")
+MODEL_NAME = settings.model_name
+OLLAMA_POOL_LIMIT = settings.ollama_pool_limit
+OLLAMA_POOL_LIMIT_PER_HOST = settings.ollama_pool_limit_per_host
+OLLAMA_KEEPALIVE_TIMEOUT = settings.ollama_keepalive_timeout
+OLLAMA_CONNECT_TIMEOUT = settings.ollama_connect_timeout
+OLLAMA_READ_TIMEOUT = settings.ollama_read_timeout
+STREAM_COALESCE_MS = settings.stream_coalesce_ms
+STREAM_COALESCE_MAX_CHARS = settings.stream_coalesce_max_chars
+SUMMARY_ENABLED = settings.summary_enabled
+SUMMARY_TRIGGER_MESSAGES = settings.summary_trigger_messages
+SUMMARY_KEEP_RECENT = settings.summary_keep_recent
+SUMMARY_MODEL = settings.summary_model
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Update the summary with the new messages. Keep every fact, name, decision and open "
+    "question that later turns may rely on. Reply with the updated summary only."
+)
+
+# Process-wide HTTP client, created on startup and closed on shutdown
+_http_session: aiohttp.ClientSession | None = None
+_pool_counters = {"in_flight": 0, "peak_in_flight": 0, "requests_total": 0}
+# Sessions with a summary being computed, and the background tasks doing it
+_summarizing: set = set()
+_summary_tasks: set = set()
+
+
+async def start_http_client():
+    """
+    Function Task:
+        Creates the shared aiohttp session used for every Ollama request, so
+        TCP connections are pooled and kept alive between chat turns.
+
+    Arguments:
+        None
+
+    Returns:
+        None
+    """
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        return
+    connector = aiohttp.TCPConnector(
+        limit=OLLAMA_POOL_LIMIT,
+        limit_per_host=OLLAMA_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=OLLAMA_KEEPALIVE_TIMEOUT,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=None,
+        sock_connect=OLLAMA_CONNECT_TIMEOUT,
+        sock_read=OLLAMA_READ_TIMEOUT,
+    )
+    _http_session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    backend_pool.start(_http_session)
+    logger.info("Ollama HTTP client started: backends=%s, limit=%s, limit_per_host=%s",
+                len(backend_pool.backends), OLLAMA_POOL_LIMIT, OLLAMA_POOL_LIMIT_PER_HOST)
+
+async def close_http_client():
+    """
+    Function Task:
+        Stops the backend health checks and closes the shared aiohttp session
+        and its pooled connections.
+
+    Arguments:
+        None
+
+    Returns:
+        None
+    """
+    global _http_session
+    await backend_pool.close()
+    if _http_session is not None:
+        await _http_session.close()
+        _http_session = None
+        logger.info("Ollama HTTP client closed")
+
+async def get_http_session():
+    """
+    Function Task:
+        Returns the shared aiohttp session, starting it if the startup hook has not run yet.
+
+    Arguments:
+        None
+
+    Returns:
+        aiohttp.ClientSession: The shared client session.
+    """
+    if _http_session is None or _http_session.closed:
+        await start_http_client()
+    return _http_session
+
+def pool_stats():
+    """
+    Function Task:
+        Reports the state of the Ollama connection pool and of every backend so
+        saturation and ejected backends can be monitored.
+
+    Arguments:
+        None
+
+    Returns:
+        dict: The pool limits, request counters, idle connection count and backend stats.
+    """
+    stats = {
+        "limit": OLLAMA_POOL_LIMIT,
+        "limit_per_host": OLLAMA_POOL_LIMIT_PER_HOST,
+        **_pool_counters,
+        "idle_connections": 0,
+        "started": _http_session is not None and not _http_session.closed,
+        **backend_pool.stats(),
+    }
+    if stats["started"]:
+        connector = _http_session.connector
+        # aiohttp does not expose pool usage publicly; idle keep-alive connections live in _conns
+        stats["idle_connections"] = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+    return stats
 
 async def generate_with_ollama(uuid, session_id, websocket: WebSocket):
     """
-    Generate a response using the Ollama API with the full conversation history for the given session ID.
+    Generate a response using the Ollama API with the conversation history for the given session ID,
+    bounded by the model's context window policy. The request goes to the backend picked by backend_pool.
+    When the response cache is enabled, a cached answer to the same context is replayed instead.
+    The streamed answer is checkpointed to Redis as it arrives (see ResponseBuffer), so a crash loses little of it.
     Args:
         session_id (str): The unique session ID for the conversation.
-        websocket: The WebSocket connection to send messages back to the client.
+        websocket: The WebSocket connection (or ConnectionManager.SessionSender) to send messages back to the client.
         conversation_histories (dict): Dictionary containing conversation histories keyed by session ID.
-        OLLAMA_URL (str): The URL of the Ollama API endpoint.
+        OLLAMA_URLS (list): The Ollama API endpoints requests are balanced over.
         MODEL_NAME (str): The name of the model to use for generation.
     """
     """Returns: None By default"""
     """sends the JSON response to the websocket connection""" 
+    started = time.perf_counter()
     await ensure_system_message(uuid, session_id)
-    history = await get_history(uuid, session_id)
+    policy = get_policy(MODEL_NAME)
+    history, summary, length = await get_context_history(uuid, session_id, policy.max_messages)
+    maybe_summarize(uuid, session_id, length)
     payload = {
         "model": MODEL_NAME,
-        "messages": history,
+        "messages": policy.apply(history, summary),
         "stream": True
     }
-    full_response = ""
+    buffer = ResponseBuffer(uuid, session_id)
+    coalescer = ChunkCoalescer(websocket, STREAM_COALESCE_MS, STREAM_COALESCE_MAX_CHARS)
+    cache_key = None
+    # Metrics: streamed chunks (one token each) and when the first one arrived
+    tokens = 0
+    first_token_at = None
+    outcome = "completed"
+    if response_cache is not None and response_cache.cacheable(payload["messages"]):
+        cache_key = response_cache.key(uuid, MODEL_NAME, payload["messages"])
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(OLLAMA_URL, json=payload) as resp:
+        if cache_key is not None:
+            cached = await response_cache.get(cache_key)
+            if cached is not None:
+                outcome = "cached"
+                await coalescer.add(cached)
+                await coalescer.close()
+                await append_history(uuid, session_id, "assistant", cached)
+                await websocket.send_json({"type": "response_end"})
+                logger.info("Model response served from cache: uuid=%s, session_id=%s", uuid, session_id,
+                            extra={"latency_ms": round((time.perf_counter() - started) * 1000, 1)})
+                return
+        session = await get_http_session()
+        _pool_counters["in_flight"] += 1
+        _pool_counters["requests_total"] += 1
+        _pool_counters["peak_in_flight"] = max(_pool_counters["peak_in_flight"], _pool_counters["in_flight"])
+        try:
+            async with backend_pool.post(session, session_id, payload) as resp:
+                buffer.start()
                 async for line in resp.content:
                     if not line or line == b"\n":
                         continue
                     try:
                         data = json.loads(line.decode("utf-8"))
                         chunk = data.get("message", {}).get("content", "")
-                        full_response += chunk
-                        await websocket.send_json({
-                            "type": "response_chunk",
-                            "content": chunk
-                        })
+                        if chunk:
+                            tokens += 1
+                            if first_token_at is None:
+                                first_token_at = time.perf_counter()
+                                GENERATION_TTFT.observe(first_token_at - started)
+                        buffer.append(chunk)
+                        await coalescer.add(chunk)
                     except Exception as e:
-                        logger.error(f"Error parsing Ollama chunk: {e}")
-                await append_history(uuid, session_id, "assistant", full_response)
+                        logger.error("Error parsing Ollama chunk: %s", e)
+                if first_token_at is not None and tokens > 1:
+                    GENERATION_TOKENS_PER_SECOND.observe((tokens - 1) / max(time.perf_counter() - first_token_at, 1e-6))
+                await coalescer.close()
+                full_response = await buffer.commit()
                 await websocket.send_json({"type": "response_end"})
-                logger.info(f"Model response completed: uuid={uuid}, session_id={session_id}")
+                logger.info("Model response completed: uuid=%s, session_id=%s", uuid, session_id, extra={
+                    "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+                    "ttft_ms": round((first_token_at - started) * 1000, 1) if first_token_at is not None else None,
+                    "tokens": tokens,
+                })
+                if cache_key is not None and full_response.strip():
+                    await response_cache.set(cache_key, full_response)
+        finally:
+            _pool_counters["in_flight"] -= 1
     except asyncio.CancelledError:
+        outcome = "stopped"
         # Save the partial answer so far!
-        if full_response.strip():
-            await append_history(uuid, session_id, "assistant", full_response)
-            logger.info(f"Model response stopped and partial saved: uuid={uuid}, session_id={session_id}")
+        if (await buffer.commit()).strip():
+            logger.info("Model response stopped and partial saved: uuid=%s, session_id=%s", uuid, session_id)
+        await coalescer.close()
         await websocket.send_json({"type": "stopped"})
     except Exception as e:
-        logger.error(f"Error in generate_with_ollama: {e}")
-        await websocket.send_json({"type": "error", "content": str(e)})
\ No newline at end of file
+        outcome = "error"
+        logger.error("Error in generate_with_ollama: %s", e)
+        await buffer.discard()
+        await coalescer.close()
+        await websocket.send_json({"type": "error", "content": str(e)})
+    finally:
+        GENERATION_DURATION.labels(outcome).observe(time.perf_counter() - started)
+        GENERATION_TOKENS.inc(tokens)
+
+def maybe_summarize(uuid, session_id, length):
+    """
+    Function Task:
+        Starts a background summarization of a session's older messages when
+        summaries are enabled and the session has grown past the threshold.
+
+    Arguments:
+        uuid (str): The user's unique identifier.
+        session_id (str): The chat session's unique identifier.
+        length (int): The number of messages stored for the session.
+
+    Returns:
+        None
+    """
+    if not SUMMARY_ENABLED or length <= SUMMARY_TRIGGER_MESSAGES or session_id in _summarizing:
+        return
+    _summarizing.add(session_id)
+    task = asyncio.create_task(summarize_session(uuid, session_id, length))
+    _summary_tasks.add(task)
+    task.add_done_callback(_summary_tasks.discard)
+
+async def summarize_session(uuid, session_id, length):
+    """
+    Function Task:
+        Folds the messages that are older than the most recent SUMMARY_KEEP_RECENT
+        into the session's stored summary. Only messages added since the last
+        summary are sent to the model, together with the previous summary.
+
+    Arguments:
+        uuid (str): The user's unique identifier.
+        session_id (str): The chat session's unique identifier.
+        length (int): The number of messages stored for the session.
+
+    Returns:
+        None
+    """
+    try:
+        summary, upto = await get_summary(uuid, session_id)
+        new_upto = length - SUMMARY_KEEP_RECENT
+        if new_upto - upto < SUMMARY_TRIGGER_MESSAGES - SUMMARY_KEEP_RECENT:
+            return
+        messages = await get_history_range(uuid, session_id, upto, new_upto)
+        transcript = "\n".join(f"{m['role'].capitalize()}: {m['content']}" for m in messages)
+        prompt = f"Current summary:\n{summary or '(none)'}\n\nNew messages:\n{transcript}"
+        payload = {
+            "model": SUMMARY_MODEL,
+            "messages": [
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": prompt},
+            ],
+            "stream": False
+        }
+        session = await get_http_session()
+        async with backend_pool.post(session, session_id, payload) as resp:
+            resp.raise_for_status()
+            data = await resp.json(content_type=None)
+        new_summary = data.get("message", {}).get("content", "").strip()
+        if new_summary and await save_summary(uuid, session_id, new_summary, upto, new_upto):
+            logger.info("Session summary updated: uuid=%s, session_id=%s, upto=%s", uuid, session_id, new_upto)
+    except Exception as e:
+        logger.error("Error summarizing session %s: %s", session_id, e)
+    finally:
+        _summarizing.discard(session_id)
@@ -0,0 +1,186 @@
+import logging
+import math
+import time
+from settings import settings
+from fastapi import HTTPException, WebSocketException, status
+from starlette.requests import HTTPConnection
+from cache import TTLCache
+
+
+logger = logging.getLogger(__name__)
+
+
+RATE_LIMIT_ENABLED = settings.rate_limit_enabled
+# Limits are "requests/seconds" token buckets: bursts of up to `requests`, refilled evenly over `seconds` ("0" = no limit)
+RATE_LIMIT_MESSAGES = settings.rate_limit_messages  # chat messages per user
+RATE_LIMIT_LOGIN = settings.rate_limit_login  # /token attempts per client IP
+RATE_LIMIT_HTTP = settings.rate_limit_http  # HTTP requests and WebSocket connects per client IP
+# Take the client IP from X-Forwarded-For; only enable behind a proxy that sets it
+RATE_LIMIT_TRUST_FORWARDED = settings.rate_limit_trust_forwarded
+RATE_LIMIT_LOCAL_CACHE_SIZE = settings.rate_limit_local_cache_size
+RATE_LIMIT_PREFIX = "ratelimit:"
+
+# Token bucket, refilled from the Redis server clock so every worker agrees on the time.
+# KEYS[1] bucket hash; ARGV capacity, refill rate in tokens/ms, cost.
+# Returns {allowed (0/1), milliseconds until `cost` tokens are available, tokens left}.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil or ts == nil then
+    tokens = capacity
+    ts = now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry_ms = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_ms = math.ceil((cost - tokens) / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate) + 1000)
+return {allowed, retry_ms, math.floor(tokens)}
+"""
+
+
+def parse_limit(value: str):
+    """Return (requests, seconds) for a "requests/seconds" limit, or None for "0" / empty."""
+    value = (value or "").strip()
+    if not value or value == "0":
+        return None
+    requests, _, seconds = value.partition("/")
+    requests, seconds = int(requests), float(seconds or 1)
+    if requests <= 0 or seconds <= 0:
+        return None
+    return requests, seconds
+
+
+class RateLimiter:
+    """A token bucket per identity (user, IP, ...), shared by every worker through Redis.
+
+    The bucket is checked and updated by one Lua script, so concurrent requests
+    never both take the last token. Denials are remembered in-process until the
+    bucket has refilled, so a client hammering past its limit is rejected without
+    a Redis round trip. If Redis fails, requests are allowed.
+
+    Attributes:
+        name (str): The limit's name, part of the Redis key.
+        capacity (int): The burst size.
+        period (float): Seconds in which a full bucket refills.
+        allowed (int): Requests let through.
+        denied (int): Requests rejected, including those rejected locally.
+        denied_locally (int): Requests rejected from the in-process cache.
+        errors (int): Checks that failed and were allowed.
+    """
+
+    def __init__(self, redis_client, name: str, capacity: int, period: float,
+                 local_cache_size: int = RATE_LIMIT_LOCAL_CACHE_SIZE):
+        self.redis = redis_client
+        self.name = name
+        self.capacity = capacity
+        self.period = period
+        self._rate_per_ms = capacity / (period * 1000)
+        self._script = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+        # identity -> monotonic time at which the next request may pass
+        self._denied = TTLCache(maxsize=local_cache_size, ttl=period)
+        self.allowed = 0
+        self.denied = 0
+        self.denied_locally = 0
+        self.errors = 0
+
+    async def hit(self, identity: str, cost: int = 1) -> float:
+        """Take `cost` tokens for identity. Returns 0 if allowed, else the seconds to wait before retrying."""
+        retry_at = self._denied.get(identity)
+        if retry_at is not None:
+            remaining = retry_at - time.monotonic()
+            if remaining > 0:
+                self.denied += 1
+                self.denied_locally += 1
+                return remaining
+        try:
+            allowed, retry_ms, _ = await self._script(keys=[f"{RATE_LIMIT_PREFIX}{self.name}:{identity}"],
+                                                      args=[self.capacity, self._rate_per_ms, cost])
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Rate limit check failed, allowing request: %s", e)
+            return 0
+        if allowed:
+            self.allowed += 1
+            return 0
+        retry_after = int(retry_ms) / 1000
+        self._denied.set(identity, time.monotonic() + retry_after, ttl=retry_after)
+        self.denied += 1
+        logger.warning("Rate limit exceeded: limit=%s, identity=%s, retry_after=%.1fs", self.name, identity, retry_after)
+        return retry_after
+
+    def stats(self) -> dict:
+        """Return the limit and how many requests were allowed and denied."""
+        return {
+            "limit": f"{self.capacity}/{self.period:g}s",
+            "allowed": self.allowed,
+            "denied": self.denied,
+            "denied_locally": self.denied_locally,
+            "errors": self.errors,
+        }
+
+
+def create_rate_limiter(name: str, limit: str):
+    """Return a RateLimiter for a "requests/seconds" limit, or None if rate limiting is off or the limit is "0"."""
+    parsed = parse_limit(limit)
+    if not RATE_LIMIT_ENABLED or parsed is None:
+        return None
+    from Redis import redis_client
+    return RateLimiter(redis_client, name, *parsed)
+
+
+message_limiter = create_rate_limiter("messages", RATE_LIMIT_MESSAGES)
+login_limiter = create_rate_limiter("login", RATE_LIMIT_LOGIN)
+http_limiter = create_rate_limiter("http", RATE_LIMIT_HTTP)
+
+
+def client_ip(connection: HTTPConnection) -> str:
+    """Return the client IP of a request or WebSocket, honouring X-Forwarded-For only if configured."""
+    if RATE_LIMIT_TRUST_FORWARDED:
+        forwarded = connection.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return connection.client.host if connection.client else "unknown"
+
+
+def _reject(connection: HTTPConnection, retry_after: float):
+    seconds = max(1, math.ceil(retry_after))
+    if connection.scope["type"] == "websocket":
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason=f"Rate limit exceeded, retry in {seconds}s")
+    raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many requests",
+                        headers={"Retry-After": str(seconds)})
+
+
+async def limit_requests(connection: HTTPConnection):
+    """Dependency applying RATE_LIMIT_HTTP per client IP to every route (HTTP requests and WebSocket connects)."""
+    if http_limiter is not None:
+        retry_after = await http_limiter.hit(client_ip(connection))
+        if retry_after:
+            _reject(connection, retry_after)
+
+
+async def limit_logins(connection: HTTPConnection):
+    """Dependency applying RATE_LIMIT_LOGIN per client IP to /token."""
+    if login_limiter is not None:
+        retry_after = await login_limiter.hit(client_ip(connection))
+        if retry_after:
+            _reject(connection, retry_after)
+
+
+def rate_limit_stats() -> dict:
+    """Return the statistics of every enabled limit."""
+    limiters = {"messages": message_limiter, "login": login_limiter, "http": http_limiter}
+    return {"enabled": RATE_LIMIT_ENABLED,
+            **{name: limiter.stats() for name, limiter in limiters.items() if limiter is not None}}
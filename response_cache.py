@@ -0,0 +1,188 @@
+import hashlib
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from settings import settings
+from cache import TTLCache
+
+
+logger = logging.getLogger(__name__)
+
+
+# "off", "memory" (per process) or "redis" (shared by every worker)
+RESPONSE_CACHE_BACKEND = settings.response_cache_backend
+RESPONSE_CACHE_TTL = settings.response_cache_ttl
+RESPONSE_CACHE_SIZE = settings.response_cache_size
+# Only contexts of at most this many messages are cached (0 = any); 2 is a system prompt plus a first question
+RESPONSE_CACHE_MAX_MESSAGES = settings.response_cache_max_messages
+# Answers are cached per user unless this is set; shared answers are limited to a system prompt plus a first question
+RESPONSE_CACHE_SHARED = settings.response_cache_shared
+SHARED_MAX_MESSAGES = 2
+RESPONSE_CACHE_PREFIX = "respcache:"
+RESPONSE_CACHE_INDEX_KEY = "respcache:index"
+
+
+def response_cache_key(model: str, messages: list, scope: str | None = None) -> str:
+    """Return the cache key for a model and the messages sent to it, within scope (a user's uuid, or None for shared)."""
+    """Messages are reduced to role and whitespace-normalized content, so incidental
+    spacing differences in a prompt still hit the same entry."""
+    normalized = [{"role": m["role"], "content": " ".join(m["content"].split())} for m in messages]
+    body = json.dumps([scope, model, normalized], separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+class ResponseCache(ABC):
+    """Base class for the model response caches; subclasses implement _get and _set.
+
+    Answers are only reused for the user they were generated for, unless the cache
+    is shared (an opt-in): then any user asking the same first question gets the
+    cached answer, and only contexts of a system prompt plus one question are cached.
+
+    Attributes:
+        max_messages (int): The largest context that is looked up or stored (0 = any).
+        shared (bool): Whether answers are shared between users.
+        hits (int): How many lookups found a cached response.
+        misses (int): How many lookups found nothing.
+        stores (int): How many responses were cached.
+    """
+
+    backend = "off"
+
+    def __init__(self, max_messages: int = RESPONSE_CACHE_MAX_MESSAGES, shared: bool = RESPONSE_CACHE_SHARED):
+        self.max_messages = max_messages
+        self.shared = shared
+        if shared:
+            self.max_messages = min(max_messages or SHARED_MAX_MESSAGES, SHARED_MAX_MESSAGES)
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def cacheable(self, messages: list) -> bool:
+        """Return True if a response to these messages may be cached."""
+        return bool(messages) and (not self.max_messages or len(messages) <= self.max_messages)
+
+    def key(self, uuid: str, model: str, messages: list) -> str:
+        """Return the cache key for a user's request: scoped to the user unless the cache is shared."""
+        return response_cache_key(model, messages, None if self.shared else uuid)
+
+    async def get(self, key: str) -> str | None:
+        """Return the cached response for key, or None. A failing backend counts as a miss."""
+        try:
+            value = await self._get(key)
+        except Exception as e:
+            logger.warning("Response cache lookup failed: %s", e)
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, response: str):
+        """Cache a complete response under key. Errors are logged, never raised."""
+        try:
+            await self._set(key, response)
+        except Exception as e:
+            logger.warning("Response cache store failed: %s", e)
+            return
+        self.stores += 1
+
+    @abstractmethod
+    async def _get(self, key: str) -> str | None:
+        """Return the stored response for key, or None."""
+
+    @abstractmethod
+    async def _set(self, key: str, response: str):
+        """Store response under key."""
+
+    def stats(self) -> dict:
+        """Return the backend and the hit/miss counters of this process."""
+        lookups = self.hits + self.misses
+        return {
+            "backend": self.backend,
+            "shared": self.shared,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "stores": self.stores,
+        }
+
+
+class MemoryResponseCache(ResponseCache):
+    """Responses cached in this process in a bounded LRU with a time-to-live."""
+
+    backend = "memory"
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL,
+                 max_messages: int = RESPONSE_CACHE_MAX_MESSAGES, shared: bool = RESPONSE_CACHE_SHARED):
+        super().__init__(max_messages, shared)
+        self._cache = TTLCache(maxsize, ttl)
+
+    async def _get(self, key: str) -> str | None:
+        return self._cache.get(key)
+
+    async def _set(self, key: str, response: str):
+        self._cache.set(key, response)
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats.update(size=len(self._cache), maxsize=self._cache.maxsize, evictions=self._cache.evictions)
+        return stats
+
+
+class RedisResponseCache(ResponseCache):
+    """Responses cached in Redis and shared by every worker.
+
+    Every entry expires after ttl seconds. A sorted set indexes the entries by
+    store time so that only the newest maxsize entries are kept.
+    """
+
+    backend = "redis"
+
+    def __init__(self, redis_client, maxsize: int = RESPONSE_CACHE_SIZE, ttl: int = RESPONSE_CACHE_TTL,
+                 max_messages: int = RESPONSE_CACHE_MAX_MESSAGES, shared: bool = RESPONSE_CACHE_SHARED):
+        super().__init__(max_messages, shared)
+        self.redis = redis_client
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evictions = 0
+
+    async def _get(self, key: str) -> str | None:
+        return await self.redis.get(RESPONSE_CACHE_PREFIX + key)
+
+    async def _set(self, key: str, response: str):
+        now = time.time()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(RESPONSE_CACHE_PREFIX + key, response, ex=self.ttl)
+            pipe.zadd(RESPONSE_CACHE_INDEX_KEY, {key: now})
+            # Entries that expired on their own only need to leave the index
+            pipe.zremrangebyscore(RESPONSE_CACHE_INDEX_KEY, "-inf", now - self.ttl)
+            pipe.zcard(RESPONSE_CACHE_INDEX_KEY)
+            size = (await pipe.execute())[-1]
+        if size > self.maxsize:
+            oldest = await self.redis.zpopmin(RESPONSE_CACHE_INDEX_KEY, size - self.maxsize)
+            if oldest:
+                await self.redis.delete(*(RESPONSE_CACHE_PREFIX + member for member, _ in oldest))
+                self.evictions += len(oldest)
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats.update(maxsize=self.maxsize, evictions=self.evictions)
+        return stats
+
+
+def create_response_cache():
+    """Create the response cache selected by RESPONSE_CACHE_BACKEND."""
+    """Returns: a MemoryResponseCache, a RedisResponseCache backed by the shared Redis client, or None when caching is off."""
+    if RESPONSE_CACHE_BACKEND == "memory":
+        return MemoryResponseCache()
+    if RESPONSE_CACHE_BACKEND == "redis":
+        from Redis import redis_client
+        return RedisResponseCache(redis_client)
+    if RESPONSE_CACHE_BACKEND != "off":
+        logger.warning("Unknown RESPONSE_CACHE_BACKEND %r, response cache disabled", RESPONSE_CACHE_BACKEND)
+    return None
+
+
+response_cache = create_response_cache()
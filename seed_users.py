@@ -1,24 +1,20 @@
-from database import SessionLocal, engine
-from models import User
-from passlib.context import CryptContext
+from database import engine
 from models import Base
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from import_users import hash_password, upsert_users
+from auth import publish_auth_invalidation
 
 
 def seed():
     """
     Function Task:
         Seeds the database with initial user data.
-        Deletes existing users before seeding new ones.
+        Existing demo users are updated in place; other users are left alone.
+        For loading real user lists, use import_users.py.
     returns:
         None
     This function creates a few predefined users in the database for testing purposes.
     """
     Base.metadata.create_all(bind=engine)
-    db = SessionLocal()
-    db.query(User).delete()
-    db.commit()
 
     users = [
         {
@@ -47,18 +43,20 @@ def seed():
         },
     ]
 
-    for user_data in users:
-        user = User(
-            username=user_data["username"],
-            full_name=user_data["full_name"],
-            email=user_data["email"],
-            hashed_password=pwd_context.hash(user_data["password"]),
-            disabled=user_data["disabled"],
-            uuid=user_data["uuid"],
-        )
-        db.add(user)
-    db.commit()
-    db.close()
+    rows = [
+        {
+            "username": user_data["username"],
+            "full_name": user_data["full_name"],
+            "email": user_data["email"],
+            "hashed_password": hash_password(user_data["password"]),
+            "disabled": user_data["disabled"],
+            "uuid": user_data["uuid"],
+        }
+        for user_data in users
+    ]
+    with engine.begin() as conn:
+        upsert_users(conn, rows)
+    publish_auth_invalidation([row["username"] for row in rows])
 
 if __name__ == "__main__":
     seed()
@@ -1,26 +1,19 @@
 import logging
+from logging_setup import setup_logging
 from fastapi import FastAPI
-from APIRouter import router
-import os
-from seed_users import seed
+from APIRouter import router, probe_router
 
-# Logging
-logging.basicConfig(
-    filename="my_app.log",
-    filemode="a",
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s"
-)
+# Logging: records are queued and written to my_app.log by a background thread
+setup_logging()
 
 logger = logging.getLogger(__name__)
 
-if not os.path.exists("test.db"):# if the database file does not exist, seed the database
-    seed()
 
-
-# FastAPI app and CORS
+# FastAPI app and CORS; the router's lifespan connects to the database, Redis and Ollama
+# (and seeds the demo users into an empty database), so importing this module stays cheap
 app = FastAPI()
 app.include_router(router)
+app.include_router(probe_router)
 
 
 if __name__ == "__main__":
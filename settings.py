@@ -0,0 +1,157 @@
+import json
+import os
+from dataclasses import dataclass, field
+from dotenv import load_dotenv
+
+
+def _env(name, default=None, cast=str):
+    """Return a dataclass field read from the environment variable `name` when Settings is created."""
+    def read():
+        value = os.getenv(name)
+        if value is None or value == "":
+            return default
+        return cast(value)
+    return field(default_factory=read)
+
+
+def _flag(value: str) -> bool:
+    return value.strip().lower() in ("1", "true", "yes")
+
+
+def _lower(value: str) -> str:
+    return value.strip().lower()
+
+
+def _list(value: str) -> list:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+@dataclass(frozen=True)
+class Settings:
+    """All configuration of the application, read from the environment (and .env) once.
+
+    Field names are the lower-cased environment variable names; see the
+    Configuration table in README.md for what each one does.
+    """
+
+    # Server
+    redis_url: str = _env("REDIS_URL", "redis://localhost:6379/0")
+    database_url: str = _env("DATABASE_URL", "sqlite:///./test.db")
+    db_pool_size: int = _env("DB_POOL_SIZE", 5, int)
+    db_max_overflow: int = _env("DB_MAX_OVERFLOW", 10, int)
+    db_pool_timeout: float = _env("DB_POOL_TIMEOUT", 30.0, float)
+    seed_demo_users: bool = _env("SEED_DEMO_USERS", True, _flag)
+
+    # Authentication
+    secret_key: str | None = _env("SECRET_KEY")
+    algorithm: str = _env("ALGORITHM", "HS256")
+    access_token_expire_minutes: int = _env("ACCESS_TOKEN_EXPIRE_MINUTES", 30, int)
+    auth_pool_size: int = _env("AUTH_POOL_SIZE", min(4, os.cpu_count() or 1), int)
+    auth_pool_kind: str = _env("AUTH_POOL_KIND", "thread", _lower)
+    auth_cache_size: int = _env("AUTH_CACHE_SIZE", 10000, int)
+    auth_cache_ttl: float = _env("AUTH_CACHE_TTL", 300.0, float)
+
+    # Connections and streaming
+    connection_mode: str = _env("CONNECTION_MODE", "local", _lower)
+    connection_ownership_ttl: int = _env("CONNECTION_OWNERSHIP_TTL", 60, int)
+    resumable_streams: bool = _env("RESUMABLE_STREAMS", False, _flag)
+    resume_grace_seconds: float = _env("RESUME_GRACE_SECONDS", 30.0, float)
+    resume_stream_ttl: int = _env("RESUME_STREAM_TTL", 600, int)
+    resume_stream_maxlen: int = _env("RESUME_STREAM_MAXLEN", 5000, int)
+    stream_coalesce_ms: int = _env("STREAM_COALESCE_MS", 0, int)
+    stream_coalesce_max_chars: int = _env("STREAM_COALESCE_MAX_CHARS", 256, int)
+    response_checkpoint_ms: int = _env("RESPONSE_CHECKPOINT_MS", 1000, int)
+    response_partial_ttl: int = _env("RESPONSE_PARTIAL_TTL", 7 * 86400, int)
+
+    # Ollama
+    model_name: str | None = _env("MODEL_NAME")
+    ollama_urls: list = _env("OLLAMA_URLS", None, _list)
+    ollama_routing: str = _env("OLLAMA_ROUTING", "least_outstanding", _lower)
+    ollama_health_interval: float = _env("OLLAMA_HEALTH_INTERVAL", 10.0, float)
+    ollama_eject_failures: int = _env("OLLAMA_EJECT_FAILURES", 3, int)
+    ollama_eject_seconds: float = _env("OLLAMA_EJECT_SECONDS", 30.0, float)
+    ollama_connect_retries: int = _env("OLLAMA_CONNECT_RETRIES", 2, int)
+    ollama_max_concurrency: int = _env("OLLAMA_MAX_CONCURRENCY", 4, int)
+    generation_queue_size: int = _env("GENERATION_QUEUE_SIZE", 100, int)
+    ollama_pool_limit: int = _env("OLLAMA_POOL_LIMIT", 100, int)
+    ollama_pool_limit_per_host: int = _env("OLLAMA_POOL_LIMIT_PER_HOST", 0, int)
+    ollama_keepalive_timeout: float = _env("OLLAMA_KEEPALIVE_TIMEOUT", 60.0, float)
+    ollama_connect_timeout: float = _env("OLLAMA_CONNECT_TIMEOUT", 10.0, float)
+    ollama_read_timeout: float = _env("OLLAMA_READ_TIMEOUT", 300.0, float)
+
+    # Context window and summaries
+    context_max_messages: int = _env("CONTEXT_MAX_MESSAGES", 40, int)
+    context_max_tokens: int = _env("CONTEXT_MAX_TOKENS", 4096, int)
+    context_model_budgets: dict = _env("CONTEXT_MODEL_BUDGETS", {}, json.loads)
+    summary_enabled: bool = _env("SUMMARY_ENABLED", False, _flag)
+    summary_trigger_messages: int = _env("SUMMARY_TRIGGER_MESSAGES", 30, int)
+    summary_keep_recent: int = _env("SUMMARY_KEEP_RECENT", 10, int)
+    summary_model: str | None = _env("SUMMARY_MODEL")
+
+    # Response cache
+    response_cache_backend: str = _env("RESPONSE_CACHE_BACKEND", "off", _lower)
+    response_cache_ttl: int = _env("RESPONSE_CACHE_TTL", 3600, int)
+    response_cache_size: int = _env("RESPONSE_CACHE_SIZE", 1000, int)
+    response_cache_max_messages: int = _env("RESPONSE_CACHE_MAX_MESSAGES", 2, int)
+    response_cache_shared: bool = _env("RESPONSE_CACHE_SHARED", False, _flag)
+
+    # History storage
+    sessions_page_size: int = _env("SESSIONS_PAGE_SIZE", 50, int)
+    history_page_size: int = _env("HISTORY_PAGE_SIZE", 50, int)
+    history_encoding: str = _env("HISTORY_ENCODING", "json", _lower)
+    history_compress_min_bytes: int = _env("HISTORY_COMPRESS_MIN_BYTES", 512, int)
+    history_compress_level: int = _env("HISTORY_COMPRESS_LEVEL", 3, int)
+    history_archive_enabled: bool = _env("HISTORY_ARCHIVE_ENABLED", False, _flag)
+    history_archive_path: str = _env("HISTORY_ARCHIVE_PATH", "./history_archive.db")
+    history_archive_idle_days: float = _env("HISTORY_ARCHIVE_IDLE_DAYS", 30.0, float)
+    history_archive_interval: int = _env("HISTORY_ARCHIVE_INTERVAL", 3600, int)
+    history_archive_batch: int = _env("HISTORY_ARCHIVE_BATCH", 100, int)
+    history_archive_compress_level: int = _env("HISTORY_ARCHIVE_COMPRESS_LEVEL", 9, int)
+
+    # Rate limiting
+    rate_limit_enabled: bool = _env("RATE_LIMIT_ENABLED", False, _flag)
+    rate_limit_messages: str = _env("RATE_LIMIT_MESSAGES", "20/60")
+    rate_limit_login: str = _env("RATE_LIMIT_LOGIN", "10/60")
+    rate_limit_http: str = _env("RATE_LIMIT_HTTP", "300/60")
+    rate_limit_trust_forwarded: bool = _env("RATE_LIMIT_TRUST_FORWARDED", False, _flag)
+    rate_limit_local_cache_size: int = _env("RATE_LIMIT_LOCAL_CACHE_SIZE", 10000, int)
+
+    # Static files
+    static_dir: str = _env("STATIC_DIR", "static")
+    static_dev_reload: bool = _env("STATIC_DEV_RELOAD", False, _flag)
+    static_compress_min_bytes: int = _env("STATIC_COMPRESS_MIN_BYTES", 256, int)
+    static_cache_control: str = _env("STATIC_CACHE_CONTROL", "no-cache")
+
+    # Logging
+    log_file: str = _env("LOG_FILE", "my_app.log")
+    log_level: str = _env("LOG_LEVEL", "INFO", str.upper)
+    log_format: str = _env("LOG_FORMAT", "text", _lower)
+    log_rotation: str = _env("LOG_ROTATION", "size", _lower)
+    log_max_bytes: int = _env("LOG_MAX_BYTES", 10 * 1024 * 1024, int)
+    log_backup_count: int = _env("LOG_BACKUP_COUNT", 5, int)
+    log_rotate_when: str = _env("LOG_ROTATE_WHEN", "midnight")
+    log_sampling: dict = _env("LOG_SAMPLING", {"History appended": 10}, json.loads)
+
+    def __post_init__(self):
+        # OLLAMA_URL is the single-backend spelling of OLLAMA_URLS; summaries default to the chat model
+        if self.ollama_urls is None:
+            object.__setattr__(self, "ollama_urls", _list(os.getenv("OLLAMA_URL") or ""))
+        if self.summary_model is None:
+            object.__setattr__(self, "summary_model", self.model_name)
+
+    def check(self):
+        """Raise RuntimeError naming the required settings that are missing or out of range."""
+        missing = [name.upper() for name in ("secret_key",) if not getattr(self, name)]
+        if missing:
+            raise RuntimeError(f"Missing required settings: {', '.join(missing)} (set them in the environment or .env)")
+        if self.context_max_messages < 1:
+            raise RuntimeError(f"CONTEXT_MAX_MESSAGES must be at least 1, got {self.context_max_messages}")
+
+
+def load_settings() -> Settings:
+    """Read .env (without overriding variables already set) and return the settings."""
+    load_dotenv()
+    return Settings()
+
+
+settings = load_settings()
@@ -0,0 +1,215 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+import zstandard
+from settings import settings
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # optional: without it, br is simply not offered
+    brotli = None
+
+
+logger = logging.getLogger(__name__)
+
+
+STATIC_DIR = settings.static_dir
+# Re-read files whose modification time changed, and pick up new files, on every request
+STATIC_DEV_RELOAD = settings.static_dev_reload
+# Smaller files are only served uncompressed
+STATIC_COMPRESS_MIN_BYTES = settings.static_compress_min_bytes
+# Pages are revalidated on every load, which costs a 304 with no body while they are unchanged
+STATIC_CACHE_CONTROL = settings.static_cache_control
+
+# Preferred first when the client accepts several with the same q-value
+ENCODINGS = ("br", "zstd", "gzip")
+
+
+def _compress(data: bytes) -> dict:
+    """Return the encoded variants of data that are smaller than the original, by encoding name."""
+    variants = {}
+    if len(data) < STATIC_COMPRESS_MIN_BYTES:
+        return variants
+    candidates = {
+        "gzip": lambda: gzip.compress(data, compresslevel=9, mtime=0),
+        "zstd": lambda: zstandard.ZstdCompressor(level=19).compress(data),
+    }
+    if brotli is not None:
+        candidates["br"] = lambda: brotli.compress(data, quality=11)
+    for encoding, compress in candidates.items():
+        encoded = compress()
+        if len(encoded) < len(data):
+            variants[encoding] = encoded
+    return variants
+
+
+def parse_accept_encoding(header: str | None) -> dict:
+    """Return the q-value of each coding in an Accept-Encoding header."""
+    accepted = {}
+    for part in (header or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+class StaticAsset:
+    """One file under STATIC_DIR, held in memory with its precompressed variants.
+
+    Attributes:
+        name (str): The path relative to STATIC_DIR, with forward slashes.
+        media_type (str): The Content-Type it is served with.
+        mtime (float): The file's modification time when it was read.
+        last_modified (str): mtime as an HTTP date.
+        etag (str): A strong ETag derived from the content; encoded variants append the encoding.
+        variants (dict): The body by content coding, "identity" included.
+    """
+
+    def __init__(self, name: str, path: str):
+        with open(path, "rb") as f:
+            data = f.read()
+        self.name = name
+        self.path = path
+        self.mtime = os.stat(path).st_mtime
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+        media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        if media_type.startswith("text/") or media_type in ("application/javascript", "application/json"):
+            media_type += "; charset=utf-8"
+        self.media_type = media_type
+        self.etag = hashlib.sha256(data).hexdigest()[:32]
+        self.variants = {"identity": data, **_compress(data)}
+
+    def select(self, accept_encoding: str | None) -> str:
+        """Return the coding to send: the one the client rates highest (br, zstd, gzip on ties), else identity."""
+        accepted = parse_accept_encoding(accept_encoding)
+        best, best_q = "identity", 0.0
+        for encoding in ENCODINGS:
+            if encoding not in self.variants:
+                continue
+            q = accepted.get(encoding, accepted.get("*", 0.0))
+            if q > best_q:
+                best, best_q = encoding, q
+        return best
+
+    def etag_for(self, encoding: str) -> str:
+        return f'"{self.etag}"' if encoding == "identity" else f'"{self.etag}-{encoding}"'
+
+
+class StaticAssetStore:
+    """Serves the files under a directory from memory.
+
+    Files are read and compressed once by load(); requests then cost a dict
+    lookup. With dev_reload, a changed or new file is re-read when requested.
+
+    Attributes:
+        directory (str): The directory served.
+        dev_reload (bool): Whether files are checked for changes on every request.
+        assets (dict): The loaded StaticAsset objects by relative name.
+    """
+
+    def __init__(self, directory: str = STATIC_DIR, dev_reload: bool = STATIC_DEV_RELOAD):
+        self.directory = os.path.abspath(directory)
+        self.dev_reload = dev_reload
+        self.assets = {}
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Read and precompress every file under the directory. Blocking; run it off the event loop."""
+        assets = {}
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, self.directory).replace(os.sep, "/")
+                assets[name] = StaticAsset(name, path)
+        with self._lock:
+            self.assets = assets
+            self.loaded = True
+        for asset in assets.values():
+            sizes = ", ".join(f"{encoding}={len(body)}" for encoding, body in asset.variants.items())
+            logger.info("Static asset loaded: %s (%s)", asset.name, sizes)
+
+    def get(self, name: str) -> StaticAsset | None:
+        """Return the asset for a relative name, or None if there is no such file."""
+        if not self.loaded:
+            self.load()
+        asset = self.assets.get(name)
+        if not self.dev_reload:
+            return asset
+        path = os.path.abspath(os.path.join(self.directory, name))
+        if not path.startswith(self.directory + os.sep):
+            return None
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            self.assets.pop(name, None)
+            return None
+        if asset is None or asset.mtime != mtime:
+            asset = StaticAsset(name, path)
+            with self._lock:
+                self.assets[name] = asset
+            logger.info("Static asset reloaded: %s", name)
+        return asset
+
+    def response(self, request: Request, name: str) -> Response:
+        """Return the asset as a response: 304 when the client's copy is current, 404 if it does not exist."""
+        asset = self.get(name)
+        if asset is None:
+            return Response(status_code=404)
+        encoding = asset.select(request.headers.get("accept-encoding"))
+        headers = {
+            "ETag": asset.etag_for(encoding),
+            "Last-Modified": asset.last_modified,
+            "Cache-Control": STATIC_CACHE_CONTROL,
+            "Vary": "Accept-Encoding",
+        }
+        if _not_modified(request, headers["ETag"], asset.mtime):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(asset.variants[encoding], media_type=asset.media_type, headers=headers)
+
+    def stats(self) -> dict:
+        """Return the loaded files with their size per encoding."""
+        return {
+            "dev_reload": self.dev_reload,
+            "brotli": brotli is not None,
+            "assets": {name: {encoding: len(body) for encoding, body in asset.variants.items()}
+                       for name, asset in self.assets.items()},
+        }
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """Evaluate If-None-Match (weak comparison), or If-Modified-Since when no If-None-Match is sent."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+static_assets = StaticAssetStore()